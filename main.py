@@ -1,18 +1,29 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from routers import user, authentication, documents
-from sources import models, database
+from sources import models, database, migrations
+import asyncio
 import logging
 import sys
 import os
 from sources.config import settings
+from utils.llm_router import LLMUnavailableError
+from utils.concurrency import llm_limiter
 
 
 models.Base.metadata.create_all(bind=database.engine)
+migrations.upgrade()
 
 app = FastAPI()
 
+
+# Sync LLM calls on worker threads (streams, background ingestion) take their limiter slots on this loop
+@app.on_event("startup")
+async def bind_llm_limiter():
+    llm_limiter.bind_loop(asyncio.get_running_loop())
+
 origins = [settings.FRONT_LINK]
 
 app.add_middleware(
@@ -23,6 +34,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Every LLM provider failed (after retries and failover): tell the client to retry instead of storing error text
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The language model is temporarily unavailable. Please try again shortly."}
+    )
+
 app.include_router(authentication.router)
 app.include_router(user.router)
 app.include_router(documents.router)
@@ -2,7 +2,8 @@ import os
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from sources import models
-from utils.shared_models import chroma_collection
+from utils.vector_store import vector_store
+from utils import keyword_index, answer_cache, element_store, near_duplicates
 
 UPLOAD_DIRECTORY = "./uploads"
 
@@ -30,9 +31,18 @@ def delete_document(doc_id: int, current_user_id: int, db: Session):
                 print(f"Error deleting audio file {summary.audio_path}: {e}")
 
     try:
-        chroma_collection.delete(where={"doc_id": doc_id})
+        vector_store.delete(current_user_id, where={"doc_id": doc_id})
     except Exception as e:
-        print(f"Error deleting from ChromaDB: {e}")
+        print(f"Error deleting from the vector store: {e}")
+
+    try:
+        keyword_index.delete_document(doc_id)
+        near_duplicates.delete_document(doc_id)
+    except Exception as e:
+        print(f"Error deleting from keyword index: {e}")
+
+    element_store.delete(doc_id)
+    answer_cache.invalidate(owner_id=current_user_id, doc_id=doc_id)
 
     db.delete(doc)
     db.commit()
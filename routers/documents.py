@@ -1,19 +1,114 @@
 import os
+import json
 import shutil
+import asyncio
 from fastapi import APIRouter, Depends, status, HTTPException, UploadFile, File, BackgroundTasks
 from sqlalchemy.orm import Session
 from sources import schemas, database, oauth2, models, hashing
+from sources.database import SessionLocal
 from repo import documents
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import iterate_in_threadpool
 import io
 from utils.pdf_utils import generate_pdf_bytes
 from utils.file_processor import process_document_ingestion
-from utils.ai_services import generate_summary, audiolize_summary, generate_report, get_rag_response
+from utils.ai_services import (
+    audiolize_summary, agenerate_summary, agenerate_report, aget_rag_response,
+    stream_rag_response, stream_summary, stream_report, abatch_rag_responses
+)
+from utils.concurrency import run_blocking
+from utils.conversations import new_conversation_id
+from utils.single_flight import generation_flights
+from utils.map_reduce import map_reduce_summary, map_reduce_report, map_reduce_summary_prompt, map_reduce_report_prompt
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 ALLOWED_EXTENSIONS = {".pdf", ".docx", ".txt", ".mp3", ".wav", ".mp4", ".m4a"}
 INTERACTION_READY_STATUSES = {"ready_for_chat", "processing_ai", "complete"}
 UPLOAD_DIRECTORY = "./uploads"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+MAX_BATCH_QUESTIONS = 100
+
+
+def _get_ready_document(doc_id: int, owner_id: int, db: Session) -> models.Document:
+    doc = (
+        db.query(models.Document)
+        .filter(models.Document.id == doc_id)
+        .filter(models.Document.owner_id == owner_id)
+        .first()
+    )
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found.")
+    if doc.status not in INTERACTION_READY_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Document is not ready for interaction yet. Current status: {doc.status}")
+    return doc
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sse_stream(events, on_done):
+    """
+    Forwards generation events as server-sent events. `on_done` persists the final
+    result (the request's DB session is already closed while streaming) and returns
+    the payload of the closing 'done' event.
+    """
+    for event in events:
+        if event["type"] == "token":
+            yield _sse("token", {"text": event["text"]})
+        elif event["type"] == "citation":
+            yield _sse("citation", event["citation"])
+        elif event["type"] == "error":
+            yield _sse("error", {"detail": event["detail"]})
+        elif event["type"] == "done":
+            yield _sse("done", on_done(event))
+
+
+async def _map_reduce_sse_stream(build_prompt, empty_message: str, stream, on_done):
+    """
+    Server-sent events for the map_reduce strategy: a 'progress' event per finished map or reduce
+    call, then the streamed final generation. `build_prompt(progress)` runs the map phase; when it
+    yields no content the stream ends with an 'error' event instead of falling back to retrieval.
+    """
+    updates = asyncio.Queue()
+
+    async def run():
+        try:
+            return await build_prompt(updates.put_nowait)
+        finally:
+            updates.put_nowait(None)
+
+    task = asyncio.ensure_future(run())
+    try:
+        while (update := await updates.get()) is not None:
+            yield _sse("progress", update)
+        prompt = task.result()
+    except Exception as e:
+        yield _sse("error", {"detail": f"Error while generating response: {str(e)}"})
+        return
+    finally:
+        # The client went away during the map phase
+        task.cancel()
+
+    if prompt is None:
+        yield _sse("error", {"detail": empty_message})
+        return
+    # The final generation and on_done block, so they run on the threadpool like the other streams
+    async for message in iterate_in_threadpool(_sse_stream(stream(prompt), on_done)):
+        yield message
+
+
+def _save_chat_stream_result(question: str, user_id: int, doc_id: int = None):
+    def on_done(event: dict) -> dict:
+        response = event["response"]
+        db = SessionLocal()
+        try:
+            db.add(models.ChatHistory(question=question, answer=response["full_answer"], user_id=user_id, document_id=doc_id))
+            db.commit()
+        finally:
+            db.close()
+        return {"answer": response["answer"], "citations": response["citations"]}
+    return on_done
 
 @router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 def upload_document(
@@ -86,29 +181,41 @@ def get_user_documents(
     return documents
 
 @router.post("/library/chat", response_model=schemas.ChatResponse, status_code=status.HTTP_202_ACCEPTED)
-def chat_with_library(
+async def chat_with_library(
     request: schemas.ChatRequest,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(oauth2.get_current_user)
 ):
     """Chat across all documents owned by the current user. Returns an answer with inline citations to filenames/doc_ids."""
 
-    response = get_rag_response(request.question, owner_id=current_user.id)
+    conversation_id = request.conversation_id or new_conversation_id()
+    response = await aget_rag_response(request.question, owner_id=current_user.id, endpoint="library_chat", deadline_seconds=request.deadline_seconds, conversation_id=conversation_id)
 
     # Store the full answer WITH citations in the database
     chat_history_entry = models.ChatHistory(
         question=request.question,
         answer=response["full_answer"],  # Changed: Store full answer with references
+        conversation_id=conversation_id,
         user_id=current_user.id,
         document_id=None
     )
     db.add(chat_history_entry)
     db.commit()
 
-    return {"answer": response["answer"], "citations": response["citations"]}
+    return {"answer": response["answer"], "citations": response["citations"], "degradation_tier": response["degradation_tier"], "conversation_id": conversation_id}
+
+@router.post("/library/chat/stream")
+def stream_chat_with_library(
+    request: schemas.ChatRequest,
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    """Streaming variant of /library/chat: tokens and citations are sent as server-sent events."""
+    events = stream_rag_response(request.question, owner_id=current_user.id, endpoint="library_chat")
+    on_done = _save_chat_stream_result(request.question, current_user.id)
+    return StreamingResponse(_sse_stream(events, on_done), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.post("/{doc_id}/chat", response_model=schemas.ChatResponse, status_code=status.HTTP_202_ACCEPTED)
-def chat_with_document(
+async def chat_with_document(
     doc_id: int,
     request: schemas.ChatRequest,
     db: Session = Depends(database.get_db),
@@ -125,19 +232,78 @@ def chat_with_document(
     if doc.status not in INTERACTION_READY_STATUSES:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Document is not ready for interaction yet. Current status: {doc.status}")
 
-    response = get_rag_response(request.question, doc_id=doc.id)
+    conversation_id = request.conversation_id or new_conversation_id()
+    response = await aget_rag_response(request.question, doc_id=doc.id, endpoint="document_chat", user_id=current_user.id, deadline_seconds=request.deadline_seconds, conversation_id=conversation_id)
 
     # Store the full answer WITH citations in the database
     chat_history_entry = models.ChatHistory(
         question=request.question,
         answer=response["full_answer"],  # Changed: Store full answer with references
+        conversation_id=conversation_id,
         user_id=current_user.id,
         document_id=doc.id
     )
     db.add(chat_history_entry)
     db.commit()
 
-    return {"answer": response["answer"], "citations": response["citations"]}
+    return {"answer": response["answer"], "citations": response["citations"], "degradation_tier": response["degradation_tier"], "conversation_id": conversation_id}
+
+@router.post("/{doc_id}/chat/stream")
+def stream_chat_with_document(
+    doc_id: int,
+    request: schemas.ChatRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    """Streaming variant of /{doc_id}/chat: tokens and citations are sent as server-sent events."""
+    doc = _get_ready_document(doc_id, current_user.id, db)
+    events = stream_rag_response(request.question, doc_id=doc.id, endpoint="document_chat", user_id=current_user.id)
+    on_done = _save_chat_stream_result(request.question, current_user.id, doc.id)
+    return StreamingResponse(_sse_stream(events, on_done), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/{doc_id}/chat/batch")
+def batch_chat_with_document(
+    doc_id: int,
+    request: schemas.BatchChatRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    """
+    Answers a list of questions about one document. Each answer is sent as an 'answer' server-sent
+    event ({index, question, answer, citations, degradation_tier}) as soon as it is ready; all of them
+    are stored in the chat history in one transaction, followed by a 'done' event.
+    """
+    doc = _get_ready_document(doc_id, current_user.id, db)
+    questions = [question.strip() for question in request.questions if question.strip()]
+    if not questions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No questions given.")
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch.")
+    doc_id, user_id = doc.id, current_user.id
+
+    async def events():
+        answered = {}
+        try:
+            async for index, response in abatch_rag_responses(questions, doc_id=doc_id, endpoint="document_chat", user_id=user_id):
+                answered[index] = response
+                yield _sse("answer", {
+                    "index": index, "question": questions[index], "answer": response["answer"],
+                    "citations": response["citations"], "degradation_tier": response["degradation_tier"],
+                })
+        finally:
+            # Whatever was answered is kept, in question order, even if the client disconnected
+            session = SessionLocal()
+            try:
+                session.add_all([
+                    models.ChatHistory(question=questions[index], answer=answered[index]["full_answer"], user_id=user_id, document_id=doc_id)
+                    for index in sorted(answered)
+                ])
+                session.commit()
+            finally:
+                session.close()
+        yield _sse("done", {"answered": len(answered), "total": len(questions)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.get("/{doc_id}", response_model=schemas.DocumentDisplay, status_code=status.HTTP_202_ACCEPTED)
 def get_document(doc_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(oauth2.get_current_user)):
@@ -152,7 +318,7 @@ def get_document(doc_id: int, db: Session = Depends(database.get_db), current_us
     return doc
 
 @router.post("/{doc_id}/summarize", response_model=schemas.SummaryDisplay, status_code=status.HTTP_202_ACCEPTED)
-def summarize_document(
+async def summarize_document(
     doc_id: int,
     request: schemas.SummaryRequest,
     db: Session = Depends(database.get_db),
@@ -167,22 +333,86 @@ def summarize_document(
     if doc.status not in INTERACTION_READY_STATUSES:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Document is not ready for interaction yet. Current status: {doc.status}")
 
-    summary = generate_summary(doc_id, request.summary_type.value)
-    audio_summary_path = audiolize_summary(summary)
-    
-    summary_entry = models.Summary(
-            content=summary,
-            summary_type=request.summary_type.value,
-            audio_path=audio_summary_path,
-            user_id=doc.owner_id,
-            document_id=doc.id
+    summary_type = request.summary_type.value
+    owner_id, document_id = doc.owner_id, doc.id
+
+    map_reduce = request.strategy == schemas.GenerationStrategy.MAP_REDUCE
+
+    async def generate_and_store() -> int:
+        generate = map_reduce_summary if map_reduce else agenerate_summary
+        summary = await generate(document_id, summary_type, user_id=owner_id, refresh=request.bypass_cache)
+        audio_summary_path = await run_blocking(audiolize_summary, summary)
+
+        session = SessionLocal()
+        try:
+            summary_entry = models.Summary(
+                    content=summary,
+                    summary_type=summary_type,
+                    audio_path=audio_summary_path,
+                    user_id=owner_id,
+                    document_id=document_id
+                )
+            session.add(summary_entry)
+            session.commit()
+            return summary_entry.id
+        finally:
+            session.close()
+
+    # Identical concurrent requests (double-clicks, several tabs) share one generation and one row
+    flight_key = ("summary", document_id, summary_type, request.strategy.value, request.bypass_cache)
+    summary_id = await generation_flights.do(flight_key, generate_and_store)
+
+    return db.query(models.Summary).filter(models.Summary.id == summary_id).first()
+
+@router.post("/{doc_id}/summarize/stream")
+async def stream_summarize_document(
+    doc_id: int,
+    request: schemas.SummaryRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    """
+    Streaming variant of /{doc_id}/summarize. Audio is synthesized once the text is complete.
+    With the map_reduce strategy, 'progress' events are sent during the map phase and the final
+    generation is streamed after it.
+    """
+    doc = _get_ready_document(doc_id, current_user.id, db)
+    summary_type = request.summary_type.value
+    owner_id, document_id = doc.owner_id, doc.id
+
+    def on_done(event: dict) -> dict:
+        summary = event["text"]
+        audio_summary_path = audiolize_summary(summary)
+        db = SessionLocal()
+        try:
+            summary_entry = models.Summary(
+                content=summary,
+                summary_type=summary_type,
+                audio_path=audio_summary_path,
+                user_id=owner_id,
+                document_id=document_id
+            )
+            db.add(summary_entry)
+            db.commit()
+            db.refresh(summary_entry)
+            return schemas.SummaryDisplay.from_orm(summary_entry).dict()
+        finally:
+            db.close()
+
+    # bypass_cache regenerates and stores the new text in place of the cached one; the map
+    # phase always stores its partials, so it only skips reading them
+    use_cache = not request.bypass_cache
+    if request.strategy == schemas.GenerationStrategy.MAP_REDUCE:
+        events = _map_reduce_sse_stream(
+            lambda progress: map_reduce_summary_prompt(document_id, summary_type, user_id=owner_id, use_cache=use_cache, progress=progress),
+            "Could not produce partial summaries for this document.",
+            lambda prompt: stream_summary(document_id, summary_type, prompt=prompt, user_id=owner_id, refresh=request.bypass_cache),
+            on_done
         )
-    
-    db.add(summary_entry)
-    db.commit()
-    db.refresh(summary_entry)
+        return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
-    return summary_entry
+    events = stream_summary(document_id, summary_type, user_id=owner_id, refresh=request.bypass_cache)
+    return StreamingResponse(_sse_stream(events, on_done), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.delete("/delete_summary/{doc_id}", status_code=status.HTTP_200_OK)
 def delete_summary(
@@ -217,7 +447,7 @@ def download_summary_pdf(
 
 
 @router.post("/{doc_id}/report", response_model=schemas.ReportDisplay)
-def create_document_report(
+async def create_document_report(
     doc_id: int,
     request: schemas.ReportRequest,
     db: Session = Depends(database.get_db),
@@ -235,18 +465,79 @@ def create_document_report(
     if doc.status not in INTERACTION_READY_STATUSES:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Document is not ready for interaction yet. Current status: {doc.status}")
 
-    report_content = generate_report(doc_id, request.report_type.value)
-    new_report = models.Report(
-        content=report_content,
-        report_type=request.report_type.value,
-        user_id=current_user.id,
-        document_id=doc.id
-    )
-    db.add(new_report)
-    db.commit()
-    db.refresh(new_report)
+    report_type = request.report_type.value
+    user_id, document_id = current_user.id, doc.id
+
+    map_reduce = request.strategy == schemas.GenerationStrategy.MAP_REDUCE
+
+    async def generate_and_store() -> int:
+        generate = map_reduce_report if map_reduce else agenerate_report
+        report_content = await generate(document_id, report_type, user_id=user_id, refresh=request.bypass_cache)
+
+        session = SessionLocal()
+        try:
+            new_report = models.Report(
+                content=report_content,
+                report_type=report_type,
+                user_id=user_id,
+                document_id=document_id
+            )
+            session.add(new_report)
+            session.commit()
+            return new_report.id
+        finally:
+            session.close()
+
+    flight_key = ("report", document_id, report_type, request.strategy.value, request.bypass_cache)
+    report_id = await generation_flights.do(flight_key, generate_and_store)
+
+    return db.query(models.Report).filter(models.Report.id == report_id).first()
+
+@router.post("/{doc_id}/report/stream")
+async def stream_document_report(
+    doc_id: int,
+    request: schemas.ReportRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    """
+    Streaming variant of /{doc_id}/report: tokens and citations are sent as server-sent events
+    ('progress' events first during the map phase of the map_reduce strategy).
+    """
+    doc = _get_ready_document(doc_id, current_user.id, db)
+    report_type = request.report_type.value
+    user_id, document_id = current_user.id, doc.id
+
+    def on_done(event: dict) -> dict:
+        db = SessionLocal()
+        try:
+            new_report = models.Report(
+                content=event["text"],
+                report_type=report_type,
+                user_id=user_id,
+                document_id=document_id
+            )
+            db.add(new_report)
+            db.commit()
+            db.refresh(new_report)
+            return schemas.ReportDisplay.from_orm(new_report).dict()
+        finally:
+            db.close()
+
+    # bypass_cache regenerates and stores the new text in place of the cached one; the map
+    # phase always stores its partials, so it only skips reading them
+    use_cache = not request.bypass_cache
+    if request.strategy == schemas.GenerationStrategy.MAP_REDUCE:
+        events = _map_reduce_sse_stream(
+            lambda progress: map_reduce_report_prompt(document_id, report_type, user_id=user_id, use_cache=use_cache, progress=progress),
+            "Could not produce partial summaries for this document.",
+            lambda prompt: stream_report(document_id, report_type, prompt=prompt, user_id=user_id, refresh=request.bypass_cache),
+            on_done
+        )
+        return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
-    return new_report
+    events = stream_report(document_id, report_type, user_id=user_id, refresh=request.bypass_cache)
+    return StreamingResponse(_sse_stream(events, on_done), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.delete("/delete_report/{report_id}", status_code=status.HTTP_200_OK)
 def delete_report(
@@ -19,6 +19,52 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: str
     SMTP_Admin_EMAIL: str
 
+    # CPU inference backends: torch | torch_int8 | onnx | onnx_int8 (embeddings), torch | int8 (TTS)
+    EMBEDDING_BACKEND: str = "torch"
+    ONNX_QUANTIZATION_CONFIG: str = "avx2"
+    TTS_BACKEND: str = "torch"
+    # Embedding model and ingestion chunking; changing them needs a reindex (python -m utils.reindex)
+    EMBEDDING_MODEL: str = "BAAI/bge-m3"
+    CHUNK_SIZE: int = 20000
+    CHUNK_OVERLAP: int = 1000
+    # Background reindex: documents re-embedded per batch, and the pause between batches
+    REINDEX_BATCH_DOCUMENTS: int = 10
+    REINDEX_THROTTLE_SECONDS: float = 1.0
+
+    # Cross-encoder + MMR second retrieval stage (per-endpoint settings live in utils/retrieval.py)
+    RERANK_ENABLED: bool = False
+
+    # Vector partitioning: none (the single legacy collection) | owner (one collection per user) |
+    # shard (VECTOR_SHARDS hashed owner shards). Opt-in: existing vectors must be migrated first
+    VECTOR_PARTITIONING: str = "none"
+    VECTOR_SHARDS: int = 64
+    # Vector store backend: chroma | numpy (memory-mapped shards per owner, see utils/vector_store.py)
+    VECTOR_STORE_BACKEND: str = "chroma"
+    # NumPy backend index: float32 | float16 | int8, optionally truncated to the first N dimensions
+    # (0 = all); VECTOR_RESCORE keeps float32 copies on disk to re-rank the top candidates exactly
+    VECTOR_STORAGE_MODE: str = "float16"
+    VECTOR_TRUNCATE_DIM: int = 0
+    VECTOR_RESCORE: bool = True
+    # Comma-separated Chroma servers (host:port); empty uses the local ./chroma_db PersistentClient
+    CHROMA_SERVERS: str = ""
+
+    # Async LLM path: in-flight LLM call caps and the thread pool for CPU-bound model work
+    MAX_CONCURRENT_LLM_CALLS: int = 64
+    MAX_CONCURRENT_LLM_CALLS_PER_USER: int = 4
+    MODEL_EXECUTOR_WORKERS: int = 4
+
+    # LLM failover: Gemini is used when GOOGLE_API_KEY is set, a local Ollama model when OLLAMA_MODEL is set.
+    # A hedged request goes to the next provider after the current one's p95 latency (this default
+    # until a few calls were measured; roughly a typical full-length answer from the primary model)
+    OLLAMA_MODEL: str = ""
+    OLLAMA_BASE_URL: str = "http://localhost:11434"
+    LLM_HEDGE_DELAY_SECONDS: float = 12.0
+
+    # Default time budget for a chat request; past it answers degrade (see utils/degradation.py).
+    # Leaves the primary model ~40s after the fast-model reserve, above the free-tier model's
+    # typical full-length (4096-token) answer; compare with the router's measured latency_p95
+    CHAT_DEADLINE_SECONDS: float = 45.0
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,39 @@
+from sqlalchemy import text
+from sources.database import engine
+
+# Columns added to existing tables after they were first created. create_all only creates
+# missing tables, so databases created before a column existed get it here; every step is
+# guarded, so upgrade() runs at each startup. (table, column, SQLite column definition)
+ADDED_COLUMNS = [
+    ("document", "chunk_count", "INTEGER"),
+    ("document", "representative_chunks", "TEXT"),
+    ("chat_history", "conversation_id", "VARCHAR(32)"),
+]
+# Indexes declared with index=True on those columns, under SQLAlchemy's own names so fresh
+# databases (where create_all made them) are left alone. (index name, table, column)
+ADDED_INDEXES = [
+    ("ix_chat_history_conversation_id", "chat_history", "conversation_id"),
+]
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def upgrade(bind=engine):
+    """Brings an existing database up to the current models; call after create_all."""
+    with bind.begin() as conn:
+        for table, column, definition in ADDED_COLUMNS:
+            if column not in _columns(conn, table):
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                print(f"Database upgraded: added {table}.{column}")
+        for name, table, column in ADDED_INDEXES:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+
+
+if __name__ == "__main__":
+    # python -m sources.migrations  (upgrades DataBase.db without starting the API)
+    from sources import models
+    models.Base.metadata.create_all(bind=engine)
+    upgrade()
+    print("Database is up to date.")
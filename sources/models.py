@@ -27,6 +27,8 @@ class Document(Base):
     status = Column(String, default="pending") # pending -> extracting -> embedding -> ready_for_chat -> processing_ai -> complete / failed
     content = Column(Text, nullable=True)
     content_hash = Column(String(64), nullable=True, index=True) 
+    chunk_count = Column(Integer, nullable=True) # number of chunks stored in the vector index at ingestion
+    representative_chunks = Column(Text, nullable=True) # JSON list of chunk ids picked by clustering, best coverage first
     owner_id = Column(Integer, ForeignKey("user.id"))
     
     owner = relationship("User", back_populates="documents")
@@ -66,6 +68,7 @@ class ChatHistory(Base):
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    conversation_id = Column(String(32), nullable=True, index=True) # groups the turns of one chat session
     user_id = Column(Integer, ForeignKey("user.id"))
     document_id = Column(Integer, ForeignKey("document.id"))
 
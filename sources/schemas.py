@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from enum import Enum
 from datetime import datetime
@@ -14,8 +14,14 @@ class SummaryType(str, Enum):
     SHORT = "short"
     DETAILED = "detailed"
 
+class GenerationStrategy(str, Enum):
+    RETRIEVAL = "retrieval"   # top retrieved chunks only (fast)
+    MAP_REDUCE = "map_reduce" # every chunk summarized, then combined (full coverage)
+
 class SummaryRequest(BaseModel):
     summary_type: SummaryType = SummaryType.SHORT
+    strategy: GenerationStrategy = GenerationStrategy.RETRIEVAL
+    bypass_cache: bool = False # True regenerates and replaces the cached completion
 
 class SummaryBase(BaseModel):
     content: str
@@ -41,6 +47,8 @@ class ReportType(str, Enum):
 
 class ReportRequest(BaseModel):
     report_type: ReportType = ReportType.FORMAL
+    strategy: GenerationStrategy = GenerationStrategy.RETRIEVAL
+    bypass_cache: bool = False
 
 class ReportDisplay(BaseModel):
     id: int
@@ -63,8 +71,19 @@ class ChatHistoryDisplay(ChatHistoryBase):
         orm_mode = True
 
 
+# Longest per-request chat deadline a client may ask for
+MAX_CHAT_DEADLINE_SECONDS = 120.0
+
 class ChatRequest(BaseModel):
     question: str
+    # Overrides the server's CHAT_DEADLINE_SECONDS for this request
+    deadline_seconds: Optional[float] = Field(None, gt=0, le=MAX_CHAT_DEADLINE_SECONDS)
+    # Returned by the previous answer; follow-up questions reuse that conversation's context
+    conversation_id: Optional[str] = None
+
+class BatchChatRequest(BaseModel):
+    # Checklist questions answered against one document in a single request
+    questions: List[str]
 
 class Citation(BaseModel):
     number: int
@@ -74,6 +93,9 @@ class Citation(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     citations: List[Citation] = []
+    # full | reduced | fast_model | extractive (see utils/degradation.py)
+    degradation_tier: Optional[str] = None
+    conversation_id: Optional[str] = None
 
 class DocumentBase(BaseModel):
     id: int
@@ -0,0 +1,100 @@
+import os
+import sys
+import types
+import zlib
+import asyncio
+import numpy as np
+import pytest
+
+# Settings fields without defaults; unit tests never talk to these services
+for _name in ("BACK_LINK", "FRONT_LINK", "SECRET_KEY", "ALGORITHM", "HF_TOKEN", "OPEN_ROUTER_KEY",
+              "SMTP_EMAIL", "SMTP_PASSWORD", "SMTP_Admin_EMAIL"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("GOOGLE_API_KEY", "")
+
+FAKE_EMBEDDING_DIM = 64
+
+
+class FakeEmbeddingModel:
+    """Bag-of-words hashing embeddings: texts sharing words are similar, identical texts are identical."""
+    def tokenizer(self, texts, add_special_tokens=False):
+        return {"input_ids": [[zlib.crc32(word.encode("utf-8")) for word in text.split()] for text in texts]}
+
+    def encode(self, texts, normalize_embeddings=True, batch_size=32):
+        single = isinstance(texts, str)
+        vectors = np.zeros((1 if single else len(texts), FAKE_EMBEDDING_DIM), dtype=np.float32)
+        for row, text in enumerate([texts] if single else texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.strip(".,;:!?").encode("utf-8")) % FAKE_EMBEDDING_DIM] += 1.0
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+
+
+class FakeChatModel:
+    """A LangChain-style chat model answering every prompt with `reply` after `delay` seconds."""
+    def __init__(self, reply: str = "Answer:\nIt is in the documents [1].\n\nReferences:\n[1] (report.pdf)", delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = 0
+
+    def _message(self):
+        from langchain_core.messages import AIMessage
+        self.calls += 1
+        return AIMessage(content=self.reply)
+
+    def invoke(self, prompt):
+        if self.delay:
+            import time
+            time.sleep(self.delay)
+        return self._message()
+
+    async def ainvoke(self, prompt):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self._message()
+
+    def stream(self, prompt):
+        from langchain_core.messages import AIMessageChunk
+        self.calls += 1
+        for word in self.reply.split(" "):
+            yield AIMessageChunk(content=word + " ")
+
+
+def _fake_shared_models() -> types.ModuleType:
+    """
+    Stands in for utils.shared_models, which downloads and loads the embedding, reranker, Whisper
+    and TTS models and opens Chroma at import time.
+    """
+    from utils.llm_router import LLMRouter
+    module = types.ModuleType("utils.shared_models")
+    module.embedding_model = FakeEmbeddingModel()
+    module.reranker_model = None
+    module.CHROMA_DB_PATH = "./chroma_db"
+    module.CHROMA_COLLECTION_NAME = "documents"
+    module.chroma_cluster = None
+    module.chroma_client = None
+    module.chroma_collection = None
+    module.LLM_MODEL_ID = "test/primary"
+    module.LLM_SAMPLING_PARAMS = {"temperature": 0.1, "max_tokens": 4096, "top_p": 0.95}
+    module.llm = LLMRouter([("primary", FakeChatModel())], default_hedge_delay=12.0)
+    module.fast_llm = None
+    module.transcription_model = None
+    module.tts_model = None
+    module.tts_tokenizer = None
+    module.device = "cpu"
+    module.AUDIO_SAVE_DIRECTORY = "./audio_summaries"
+    return module
+
+
+if "utils.shared_models" not in sys.modules:
+    try:
+        sys.modules["utils.shared_models"] = _fake_shared_models()
+    except ImportError:
+        # Without langchain_core the modules that need the models cannot be imported anyway
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _work_in_tmp(tmp_path, monkeypatch):
+    # Module-level paths (SQLite files, stores) are relative to the working directory
+    monkeypatch.chdir(tmp_path)
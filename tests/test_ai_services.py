@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("scipy")
+
+from utils import ai_services, llm_cache
+
+
+@pytest.fixture
+def completion_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_connection", None)
+    yield
+    if llm_cache._connection is not None:
+        llm_cache._connection.close()
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """The fake chat model behind the primary provider of the shared router."""
+    backend = ai_services.llm.backends[0]
+    monkeypatch.setattr(backend.model, "reply", "first answer")
+    return backend.model
+
+
+def test_refresh_regenerates_and_replaces_the_cached_completion(completion_cache, model):
+    assert ai_services.get_llm_response("prompt", use_cache=True) == "first answer"
+    model.reply = "second answer"
+    assert ai_services.get_llm_response("prompt", use_cache=True) == "first answer"
+    assert ai_services.get_llm_response("prompt", use_cache=True, refresh=True) == "second answer"
+    assert ai_services.get_llm_response("prompt", use_cache=True) == "second answer"
+
+
+def test_async_refresh_replaces_the_cached_completion(completion_cache, model):
+    import asyncio
+    assert asyncio.run(ai_services.aget_llm_response("prompt", use_cache=True)) == "first answer"
+    model.reply = "second answer"
+    assert asyncio.run(ai_services.aget_llm_response("prompt", use_cache=True, refresh=True)) == "second answer"
+    assert asyncio.run(ai_services.aget_llm_response("prompt", use_cache=True)) == "second answer"
+
+
+def test_streamed_refresh_replaces_the_cached_completion(completion_cache, model):
+    def streamed_text(**kwargs):
+        events = list(ai_services._stream_document_generation("prompt", "empty", template="summary", **kwargs))
+        return events[-1]["text"].strip()
+
+    assert streamed_text() == "first answer"
+    model.reply = "second answer"
+    assert streamed_text() == "first answer"
+    assert streamed_text(refresh=True) == "second answer"
+    assert streamed_text() == "second answer"
+
+
+def test_batch_questions_queued_for_an_llm_slot_keep_the_full_tier(monkeypatch):
+    import asyncio
+    from conftest import FakeChatModel
+    from sources.config import settings
+    from utils import answer_cache
+
+    # Three rounds of 0.3 s calls would leave the last round under MIN_LLM_SECONDS of a shared 2 s deadline
+    monkeypatch.setattr(settings, "CHAT_DEADLINE_SECONDS", 2.0)
+    monkeypatch.setattr(ai_services.llm.backends[0], "model", FakeChatModel(delay=0.3))
+    monkeypatch.setattr(answer_cache, "lookup", lambda scope, embedding: None)
+    monkeypatch.setattr(answer_cache, "store", lambda *args: None)
+    retrievals = []
+
+    def contexts(questions, question_embeddings, **kwargs):
+        retrievals.append(len(questions))
+        return [({"documents": [["The report is in the documents."]], "metadatas": [[{}]]}, "[1] The report is in the documents.")
+                for _ in questions]
+
+    monkeypatch.setattr(ai_services, "prepare_rag_contexts", contexts)
+    questions = [f"Where is report {number}?" for number in range(3 * settings.MAX_CONCURRENT_LLM_CALLS_PER_USER)]
+
+    async def collect():
+        return [response async for _, response in ai_services.abatch_rag_responses(questions, doc_id=1, user_id=1)]
+
+    responses = asyncio.run(collect())
+    assert retrievals == [len(questions)]
+    assert [response["degradation_tier"] for response in responses] == ["full"] * len(questions)
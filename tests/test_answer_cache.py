@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+
+from utils import answer_cache
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_VERSIONS_PATH", str(tmp_path / "versions.db"))
+    monkeypatch.setattr(answer_cache, "_connection", None)
+    monkeypatch.setattr(answer_cache, "_entries", {})
+    yield
+    if answer_cache._connection is not None:
+        answer_cache._connection.close()
+
+
+SCOPE = answer_cache.scope_for(owner_id=1)
+
+
+def _cache_answer(scope=SCOPE, embedding=(1.0, 0.0)):
+    answer_cache.store(scope, answer_cache.version(scope), embedding, {"answer": "cached"})
+
+
+def test_similar_question_hits_and_dissimilar_misses():
+    _cache_answer()
+    assert answer_cache.lookup(SCOPE, [0.99, 0.01]) == {"answer": "cached", "cache_hit": True}
+    assert answer_cache.lookup(SCOPE, [0.0, 1.0]) is None
+    assert answer_cache.lookup(answer_cache.scope_for(owner_id=2), [1.0, 0.0]) is None
+
+
+def test_invalidate_drops_the_document_and_library_scopes():
+    doc_scope = answer_cache.scope_for(doc_id=7)
+    _cache_answer()
+    _cache_answer(doc_scope)
+    answer_cache.invalidate(owner_id=1, doc_id=7)
+    assert answer_cache.lookup(SCOPE, [1.0, 0.0]) is None
+    assert answer_cache.lookup(doc_scope, [1.0, 0.0]) is None
+
+
+def test_answer_built_before_an_invalidation_is_not_stored():
+    started_at = answer_cache.version(SCOPE)
+    answer_cache.invalidate(owner_id=1)
+    answer_cache.store(SCOPE, started_at, [1.0, 0.0], {"answer": "stale"})
+    assert answer_cache.lookup(SCOPE, [1.0, 0.0]) is None
+
+
+def test_invalidation_by_another_worker_reaches_this_one():
+    _cache_answer()
+    other_worker = sqlite3.connect(answer_cache.ANSWER_CACHE_VERSIONS_PATH)
+    other_worker.execute("INSERT INTO corpus_versions (scope, version) VALUES ('owner:1', 1) "
+                         "ON CONFLICT(scope) DO UPDATE SET version = version + 1")
+    other_worker.commit()
+    other_worker.close()
+    assert answer_cache.lookup(SCOPE, [1.0, 0.0]) is None
+
+
+def test_clear_invalidates_every_scope_including_unseen_ones():
+    unseen = answer_cache.scope_for(doc_id=9)
+    before = answer_cache.version(unseen)
+    _cache_answer()
+    answer_cache.clear()
+    assert answer_cache.lookup(SCOPE, [1.0, 0.0]) is None
+    assert answer_cache.version(unseen) != before
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("chromadb")
+from utils.chroma_cluster import HashRing
+
+
+def test_node_for_is_stable_and_uses_every_node():
+    ring = HashRing(["a:8001", "b:8002", "c:8003"])
+    placements = {f"documents_owner_{i}": ring.node_for(f"documents_owner_{i}") for i in range(300)}
+    assert placements == {key: HashRing(["c:8003", "a:8001", "b:8002"]).node_for(key) for key in placements}
+    assert set(placements.values()) == {"a:8001", "b:8002", "c:8003"}
+
+
+def test_adding_a_node_only_moves_partitions_to_it():
+    before = HashRing(["a:8001", "b:8002"])
+    after = HashRing(["a:8001", "b:8002", "c:8003"])
+    keys = [f"documents_owner_{i}" for i in range(1000)]
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    assert all(after.node_for(key) == "c:8003" for key in moved)
+    # About a third of the partitions should move to the new node, not all of them
+    assert 0.2 < len(moved) / len(keys) < 0.5
+
+
+def test_single_node_ring_places_everything_on_it():
+    ring = HashRing(["local"])
+    assert {ring.node_for(f"p{i}") for i in range(50)} == {"local"}
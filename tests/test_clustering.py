@@ -0,0 +1,35 @@
+import numpy as np
+from utils.clustering import kmeans, representative_indices
+
+
+def _blobs(sizes: list, seed: int = 0) -> np.ndarray:
+    """Tight clusters around orthogonal directions, `sizes[i]` points for direction i."""
+    rng = np.random.default_rng(seed)
+    dim = 8
+    return np.vstack([np.eye(dim)[i] + rng.normal(0, 0.01, (size, dim)) for i, size in enumerate(sizes)]).astype(np.float32)
+
+
+def test_kmeans_recovers_well_separated_clusters():
+    vectors = _blobs([5, 5, 5])
+    _, labels = kmeans(vectors, 3)
+    assert len(set(labels[:5])) == len(set(labels[5:10])) == len(set(labels[10:])) == 1
+    assert len(set(labels)) == 3
+
+
+def test_one_representative_per_cluster_biggest_cluster_first():
+    vectors = _blobs([2, 6, 4])
+    representatives = representative_indices(vectors, 3)
+    assert len(representatives) == 3
+    assert 2 <= representatives[0] < 8          # from the 6-point cluster
+    assert 8 <= representatives[1] < 12         # then the 4-point one
+    assert 0 <= representatives[2] < 2
+
+
+def test_representative_is_the_member_closest_to_the_centroid():
+    vectors = np.array([[1.0, 0.0], [0.9, 0.1], [0.8, 0.2]], dtype=np.float32)
+    assert representative_indices(vectors, 1) == [1]
+
+
+def test_k_is_capped_by_the_number_of_chunks():
+    assert sorted(representative_indices(_blobs([1, 1]), 5)) == [0, 1]
+    assert representative_indices([], 3) == []
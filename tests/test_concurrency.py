@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from utils.concurrency import LLMConcurrencyLimiter
+
+
+def test_limit_caps_calls_per_user_and_frees_idle_users():
+    limiter = LLMConcurrencyLimiter(max_in_flight=4, max_per_user=1)
+    peak = {1: 0}
+
+    async def call(user_id):
+        async with limiter.limit(user_id):
+            peak[user_id] = max(peak.get(user_id, 0), limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call(1) for _ in range(3)))
+
+    asyncio.run(main())
+    assert peak[1] == 1
+    assert limiter.in_flight == 0 and limiter._per_user == {}
+
+
+def test_sync_calls_share_the_async_slots():
+    limiter = LLMConcurrencyLimiter(max_in_flight=1, max_per_user=1)
+    entered = threading.Event()
+
+    def sync_call():
+        with limiter.limit_sync(user_id=1):
+            entered.set()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        async with limiter.limit(user_id=2):
+            worker = loop.run_in_executor(None, sync_call)
+            await asyncio.sleep(0.05)
+            # The only global slot is taken by the async call
+            assert not entered.is_set()
+        await worker
+        assert entered.is_set()
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_limit_sync_refuses_to_block_the_event_loop():
+    limiter = LLMConcurrencyLimiter(max_in_flight=1, max_per_user=1)
+
+    async def main():
+        limiter.bind_loop(asyncio.get_running_loop())
+        with pytest.raises(RuntimeError):
+            with limiter.limit_sync():
+                pass
+
+    asyncio.run(main())
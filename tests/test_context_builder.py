@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from utils import context_builder
+from utils.context_builder import compress_to_budget, count_tokens, key_sentences
+
+SOURCE = "SOURCE: report.pdf (doc_id=1)"
+
+
+def test_allocate_gives_small_chunks_everything_and_splits_the_rest():
+    assert context_builder._allocate([10, 100, 100], 110) == [10, 50, 50]
+    assert context_builder._allocate([10, 20], 100) == [10, 20]
+
+
+def test_chunks_within_budget_are_untouched():
+    chunks = [(SOURCE, "Rent is due monthly."), (SOURCE, "The deposit is two months.")]
+    assert compress_to_budget(chunks, 1000) == chunks
+
+
+def test_over_budget_chunk_keeps_its_best_sentences_in_order_and_the_label():
+    text = "Rent is due on the first. Parking costs extra each month. Late rent accrues interest."
+    compressed = compress_to_budget([(SOURCE, text)], count_tokens([SOURCE])[0] + 11, question="when is rent due",
+                                    question_embedding=context_builder.embedding_model.encode("when is rent due"))
+    label, kept = compressed[0]
+    assert label == SOURCE
+    assert "Rent is due on the first." in kept and "Parking" not in kept
+    assert sum(count_tokens([kept.replace(" [...]", "")])) <= 11
+
+
+def test_chunk_without_sentence_breaks_is_truncated_instead_of_emptied():
+    # A table: rows separated by single newlines form one long "sentence"
+    table = "\n".join(f"| row {i} | value {i} |" for i in range(40))
+    budget = count_tokens([SOURCE])[0] * 2 + 30
+    compressed = compress_to_budget([(SOURCE, table), (SOURCE, table)], budget)
+    for label, kept in compressed:
+        assert kept.startswith("| row 0 | value 0 |") and kept.endswith("[...]")
+        assert count_tokens([kept[:-len(" [...]")]])[0] <= 15
+
+
+def test_key_sentences_picks_by_word_overlap_in_document_order():
+    text = "Parking costs extra. Rent is due monthly. The deposit covers rent arrears."
+    assert key_sentences("when is rent due", text, 2) == ["Rent is due monthly.", "The deposit covers rent arrears."]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pydantic_settings")
+pytest.importorskip("langchain")
+
+from utils import conversations
+
+EMBEDDINGS = {
+    "rent": np.array([1.0, 0.0, 0.0], dtype=np.float32),
+    "deposit": np.array([0.8, 0.6, 0.0], dtype=np.float32),
+    "parking": np.array([0.0, 0.0, 1.0], dtype=np.float32),
+}
+
+
+def _chunks(ids: list) -> dict:
+    return {"ids": [ids], "documents": [[f"about {chunk_id}" for chunk_id in ids]], "metadatas": [[{"doc_id": 1} for _ in ids]]}
+
+
+@pytest.fixture
+def conversation(monkeypatch):
+    monkeypatch.setattr(conversations, "fetch_embeddings", lambda ids: {chunk_id: EMBEDDINGS[chunk_id] for chunk_id in ids})
+    conversation = conversations.Conversation("c", owner_id=1)
+    conversations.remember_turn(conversation, "when is rent due?", "On the first.", _chunks(["rent"]))
+    return conversation
+
+
+def _fresh(monkeypatch, ids: list):
+    monkeypatch.setattr(conversations, "hybrid_search", lambda *args, **kwargs: _chunks(ids))
+
+
+def test_first_question_is_never_a_follow_up():
+    assert conversations.follow_up_context(conversations.Conversation("c", owner_id=1), "q", [1.0, 0.0, 0.0], 4) is None
+
+
+def test_unrelated_question_gets_a_full_retrieval(conversation, monkeypatch):
+    _fresh(monkeypatch, ["parking"])
+    assert conversations.follow_up_context(conversation, "where do I park?", [0.0, 0.0, 1.0], 4) is None
+
+
+def test_follow_up_reuses_the_pool_plus_fresh_chunks(conversation, monkeypatch):
+    _fresh(monkeypatch, ["rent", "deposit"])
+    context = conversations.follow_up_context(conversation, "and the deposit?", [0.9, 0.3, 0.0], 4)
+    assert sorted(context["ids"][0]) == ["deposit", "rent"]
+
+
+def test_topic_shift_to_unseen_material_gets_a_full_retrieval(conversation, monkeypatch):
+    # Close enough to the pool to pass the bar, but a fresh chunk matches far better
+    _fresh(monkeypatch, ["deposit"])
+    question = EMBEDDINGS["deposit"] + np.array([0.0, 0.1, 0.0], dtype=np.float32)
+    assert conversations.follow_up_context(conversation, "how big is the deposit?", question, 4) is None
+
+
+def test_remember_turn_rolls_turns_out_of_the_recent_window(conversation):
+    assert conversations.remember_turn(conversation, "q2", "a2", None) is None
+    assert conversations.remember_turn(conversation, "q3", "a3", None) == ("when is rent due?", "On the first.")
+    # Turns without retrieved chunks keep the previous pool
+    assert conversation.pool["ids"][0] == ["rent"]
+    assert "User: q3" in conversation.history()
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from utils import degradation
+from utils.degradation import Deadline, generation_tier, retrieval_params, retrieval_tier, TIER_FULL, TIER_REDUCED, TIER_FAST_MODEL, TIER_EXTRACTIVE
+
+
+def _deadline(seconds: float, elapsed: float = 0.0) -> Deadline:
+    deadline = Deadline(seconds)
+    deadline.started -= elapsed
+    return deadline
+
+
+def test_retrieval_is_reduced_once_the_budget_is_eaten_or_llm_slots_are_full(monkeypatch):
+    assert retrieval_tier(_deadline(10.0, 1.0)) == TIER_FULL
+    assert retrieval_tier(_deadline(10.0, 5.0)) == TIER_REDUCED
+    monkeypatch.setattr(degradation, "is_overloaded", lambda: True)
+    assert retrieval_tier(_deadline(10.0)) == TIER_REDUCED
+
+
+def test_reduced_retrieval_halves_depth_and_context_and_skips_reranking():
+    assert retrieval_params(TIER_FULL, 8, 6000) == {"n_results": 8, "allow_rerank": True, "max_context_tokens": 6000}
+    assert retrieval_params(TIER_REDUCED, 8, 6000) == {"n_results": 4, "allow_rerank": False, "max_context_tokens": 3000}
+    assert retrieval_params(TIER_REDUCED, 4, 6000)["n_results"] == 3
+
+
+def test_generation_tier_follows_the_expected_llm_latency():
+    assert generation_tier(_deadline(30.0), TIER_FULL, 5.0, has_fast_model=True) == TIER_FULL
+    assert generation_tier(_deadline(30.0, 27.0), TIER_FULL, 5.0, has_fast_model=True) == TIER_FAST_MODEL
+    # Without a fast model the primary still gets its chance
+    assert generation_tier(_deadline(30.0, 27.0), TIER_REDUCED, 5.0, has_fast_model=False) == TIER_REDUCED
+    assert generation_tier(_deadline(30.0, 29.5), TIER_FULL, 5.0, has_fast_model=True) == TIER_EXTRACTIVE
+
+
+def test_unmeasured_latency_falls_back_to_the_default():
+    deadline = _deadline(degradation.DEFAULT_LLM_SECONDS + 5.0, 10.0)
+    assert generation_tier(deadline, TIER_FULL, None, has_fast_model=True) == TIER_FAST_MODEL
+    assert generation_tier(deadline, TIER_FULL, 2.0, has_fast_model=True) == TIER_FULL
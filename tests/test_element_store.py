@@ -0,0 +1,39 @@
+import types
+from utils import element_store
+
+ELEMENTS = [
+    {"type": "Title", "page": 1, "section": "Lease", "text": "Lease"},
+    {"type": "NarrativeText", "page": 1, "section": "Lease", "text": "Rent is due monthly. Ünïcode survives."},
+    {"type": "Table", "page": 2, "section": "Lease", "text": "| a | b |\n| 1 | 2 |"},
+]
+
+
+def test_save_and_load_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(element_store, "ELEMENTS_DIRECTORY", str(tmp_path / "elements"))
+    element_store.save(3, ELEMENTS)
+    assert element_store.load(3) == ELEMENTS
+    element_store.delete(3)
+    assert element_store.load(3) is None
+    # Deleting twice (or a document extracted before elements were kept) is fine
+    element_store.delete(3)
+
+
+def test_to_text_joins_elements_like_the_stored_content():
+    assert element_store.to_text(ELEMENTS) == "Lease\n\nRent is due monthly. Ünïcode survives.\n\n| a | b |\n| 1 | 2 |"
+
+
+def test_from_partition_tracks_the_latest_title_as_section():
+    class Element:
+        def __init__(self, category, text, page):
+            self.category, self.text, self.metadata = category, text, types.SimpleNamespace(page_number=page)
+
+        def __str__(self):
+            return self.text
+
+    rows = element_store.from_partition([Element("NarrativeText", "Preface", 1), Element("Title", "Terms", 2), Element("ListItem", "Pay rent", 2)])
+    assert [row["section"] for row in rows] == [None, "Terms", "Terms"]
+    assert rows[2] == {"type": "ListItem", "page": 2, "section": "Terms", "text": "Pay rent"}
+
+
+def test_transcripts_are_one_element():
+    assert element_store.from_transcript("hello there") == [{"type": "Transcript", "page": None, "section": None, "text": "hello there"}]
@@ -0,0 +1,81 @@
+import sqlite3
+import pytest
+from utils import keyword_index
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(keyword_index, "KEYWORD_INDEX_PATH", str(tmp_path / "keyword_index.db"))
+    monkeypatch.setattr(keyword_index, "_connection", None)
+    yield keyword_index
+    if keyword_index._connection is not None:
+        keyword_index._connection.close()
+
+
+def _meta(doc_id: int, owner_id: int) -> dict:
+    return {"doc_id": doc_id, "owner_id": owner_id, "filename": f"doc{doc_id}.pdf"}
+
+
+def test_search_matches_whole_ids_and_filters_by_scope(index):
+    index.add_chunks(["doc1_chunk0", "doc1_chunk1"], ["Policy POL-2023-117 covers travel.", "Clause_4 covers meals."], [_meta(1, 7)] * 2)
+    index.add_chunks(["doc2_chunk0"], ["POL-2023-117 was replaced."], [_meta(2, 8)])
+
+    assert [hit["id"] for hit in index.search("What does POL-2023-117 say?", owner_id=7)] == ["doc1_chunk0"]
+    assert [hit["id"] for hit in index.search("POL-2023-117", doc_id=2)] == ["doc2_chunk0"]
+    assert {hit["id"] for hit in index.search("POL-2023-117")} == {"doc1_chunk0", "doc2_chunk0"}
+    assert index.search("clause_4")[0]["metadata"] == _meta(1, 7)
+
+
+def test_search_ignores_fts_operators_in_questions(index):
+    index.add_chunks(["doc1_chunk0"], ["NEAR the station"], [_meta(1, 7)])
+    assert index.search('"NEAR" AND (station OR *)')[0]["id"] == "doc1_chunk0"
+    assert index.search("?!") == []
+
+
+def test_re_adding_a_chunk_replaces_it(index):
+    index.add_chunks(["doc1_chunk0"], ["alpha"], [_meta(1, 7)])
+    index.add_chunks(["doc1_chunk0"], ["beta"], [_meta(1, 7)])
+    assert index.search("alpha") == []
+    assert [hit["document"] for hit in index.search("beta")] == ["beta"]
+
+
+def test_replace_and_delete_document(index):
+    index.add_chunks(["doc1_chunk0", "doc1_chunk1"], ["alpha one", "alpha two"], [_meta(1, 7)] * 2)
+    index.add_chunks(["doc2_chunk0"], ["alpha three"], [_meta(2, 7)])
+
+    index.replace_document(1, ["doc1_chunk0"], ["alpha rewritten"], [_meta(1, 7)])
+    assert index.chunk_ids_of(1) == {"doc1_chunk0"}
+    index.delete_document(2)
+    assert [hit["id"] for hit in index.search("alpha")] == ["doc1_chunk0"]
+
+
+def test_doc_filters_and_deletes_use_the_id_index(index):
+    index.add_chunks(["doc1_chunk0"], ["alpha"], [_meta(1, 7)])
+    plan = index._get_connection().execute("EXPLAIN QUERY PLAN SELECT id FROM chunk_meta WHERE doc_id = 1").fetchall()
+    assert "chunk_meta_doc" in str(plan)
+
+
+def test_legacy_single_table_index_is_migrated(index, tmp_path):
+    conn = sqlite3.connect(index.KEYWORD_INDEX_PATH)
+    conn.execute(
+        "CREATE VIRTUAL TABLE chunks USING fts5(chunk_id UNINDEXED, doc_id UNINDEXED, owner_id UNINDEXED, "
+        "filename UNINDEXED, content, tokenize = \"unicode61 tokenchars '-_'\")"
+    )
+    conn.execute("INSERT INTO chunks VALUES ('doc1_chunk0', 1, 7, 'doc1.pdf', 'legacy text')")
+    conn.commit()
+    conn.close()
+
+    assert index.search("legacy")[0]["metadata"] == _meta(1, 7)
+    index.delete_document(1)
+    assert index.search("legacy") == []
+
+
+def test_shadow_tables_replace_the_live_ones_on_promotion(index):
+    index.add_chunks(["doc1_chunk0"], ["old generation"], [_meta(1, 7)])
+    index.build_shadow([{"ids": ["doc1_chunk0", "doc2_chunk0"], "documents": ["new generation", "deleted meanwhile"], "metadatas": [_meta(1, 7), _meta(2, 7)]}])
+    assert index.search("new") == []
+
+    index.delete_document(2)
+    index.promote_shadow()
+    assert [hit["id"] for hit in index.search("generation")] == ["doc1_chunk0"]
+    assert index.search("old") == [] and index.search("deleted") == []
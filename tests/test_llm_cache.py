@@ -0,0 +1,44 @@
+import pytest
+from utils import llm_cache
+
+PARAMS = {"temperature": 0.1, "max_tokens": 4096}
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_connection", None)
+    yield
+    if llm_cache._connection is not None:
+        llm_cache._connection.close()
+
+
+def test_key_covers_model_params_and_prompt():
+    key = llm_cache.completion_key("model-a", PARAMS, "prompt")
+    assert key == llm_cache.completion_key("model-a", dict(reversed(PARAMS.items())), "prompt")
+    assert key != llm_cache.completion_key("model-b", PARAMS, "prompt")
+    assert key != llm_cache.completion_key("model-a", {**PARAMS, "temperature": 0.7}, "prompt")
+    assert key != llm_cache.completion_key("model-a", PARAMS, "prompt!")
+
+
+def test_put_replaces_and_get_returns_the_latest_completion():
+    assert llm_cache.get("k") is None
+    llm_cache.put("k", "first")
+    llm_cache.put("k", "regenerated")
+    assert llm_cache.get("k") == "regenerated"
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    llm_cache.put("k", "old")
+    monkeypatch.setattr(llm_cache, "CACHE_TTL_SECONDS", -1)
+    assert llm_cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    monkeypatch.setattr(llm_cache, "MAX_ENTRIES", 2)
+    llm_cache.put("a", "1")
+    llm_cache.put("b", "2")
+    llm_cache.get("a")
+    llm_cache.put("c", "3")
+    assert llm_cache.get("b") is None
+    assert llm_cache.get("a") == "1" and llm_cache.get("c") == "3"
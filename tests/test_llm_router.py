@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from conftest import FakeChatModel
+from utils import llm_router
+from utils.llm_router import CircuitBreaker, LLMRouter, LLMUnavailableError, answered_by
+
+
+class FailingModel(FakeChatModel):
+    def invoke(self, prompt):
+        self.calls += 1
+        raise ConnectionError("provider down")
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        raise ConnectionError("provider down")
+
+    def stream(self, prompt):
+        self.calls += 1
+        raise ConnectionError("provider down")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_router, "_backoff", lambda attempt: 0.0)
+
+
+def test_failover_answers_from_the_next_provider_after_retries():
+    primary, secondary = FailingModel(), FakeChatModel(reply="from secondary")
+    router = LLMRouter([("primary", primary), ("secondary", secondary)], default_hedge_delay=5.0)
+    response = router.invoke("q")
+    assert response.content == "from secondary" and answered_by(response) == "secondary"
+    assert primary.calls == llm_router.MAX_RETRIES + 1
+    assert router.stats["primary"]["errors"] == llm_router.MAX_RETRIES + 1
+
+
+def test_async_failover_and_total_failure():
+    router = LLMRouter([("primary", FailingModel()), ("secondary", FakeChatModel(reply="ok"))], default_hedge_delay=5.0)
+    assert asyncio.run(router.ainvoke("q")).content == "ok"
+
+    dead = LLMRouter([("primary", FailingModel()), ("secondary", FailingModel())], default_hedge_delay=5.0)
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(dead.ainvoke("q"))
+    with pytest.raises(LLMUnavailableError):
+        dead.invoke("q")
+
+
+def test_slow_provider_is_hedged_and_the_first_answer_wins():
+    slow, fast = FakeChatModel(reply="slow", delay=0.5), FakeChatModel(reply="fast")
+    router = LLMRouter([("primary", slow), ("secondary", fast)], default_hedge_delay=0.05)
+    assert router.invoke("q").content == "fast"
+    assert router.stats["secondary"]["hedges"] == 1 and router.stats["secondary"]["wins"] == 1
+
+
+def test_circuit_opens_after_consecutive_failures_and_half_opens_after_cooldown(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_router.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30.0)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 30.0
+    assert breaker.state == "half_open"
+    # One trial call at a time
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_open_circuits_are_skipped():
+    primary, secondary = FailingModel(), FakeChatModel(reply="ok")
+    router = LLMRouter([("primary", primary), ("secondary", secondary)], default_hedge_delay=5.0)
+    for _ in range(llm_router.CIRCUIT_FAILURE_THRESHOLD):
+        router.backends[0].breaker.record_failure()
+    assert router.invoke("q").content == "ok"
+    assert primary.calls == 0 and router.stats["primary"]["circuit"] == "open"
+
+    router.backends[1].breaker.opened_at = router.backends[0].breaker.opened_at
+    with pytest.raises(LLMUnavailableError):
+        router.invoke("q")
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    router = LLMRouter([("primary", FailingModel()), ("secondary", FakeChatModel(reply="streamed answer"))], default_hedge_delay=5.0)
+    chunks = list(router.stream("q"))
+    assert "".join(chunk.content for chunk in chunks).strip() == "streamed answer"
+    assert {answered_by(chunk) for chunk in chunks} == {"secondary"}
+
+
+def test_latency_and_hedge_delay_are_tracked_per_template():
+    router = LLMRouter([("primary", FakeChatModel()), ("secondary", FakeChatModel())], default_hedge_delay=5.0)
+    backend = router.backends[0]
+    for seconds in (1.0, 1.2, 1.1, 0.9, 1.0):
+        backend.record(llm_router.time.monotonic() - seconds, template="rag")
+    for seconds in (30.0, 40.0, 35.0, 32.0, 38.0):
+        backend.record(llm_router.time.monotonic() - seconds, template="report")
+
+    assert backend.latency_percentile(95, "rag") < 2.0
+    assert backend.latency_percentile(95, "report") > 30.0
+    assert backend.latency_percentile(95) > 30.0
+    assert router._hedge_delay(backend, "rag") < 2.0
+    # Too few samples for a template: the default, never the pooled p95
+    assert router._hedge_delay(backend, "classify") == 5.0
+    assert set(router.stats["primary"]["latency_p95_by_template"]) == {"rag", "report"}
+
+
+def test_calls_record_latency_under_their_template():
+    router = LLMRouter([("primary", FakeChatModel())], default_hedge_delay=5.0)
+    router.invoke("q", template="rag")
+    asyncio.run(router.ainvoke("q", template="summary"))
+    list(router.stream("q", template="report"))
+    router.invoke("q")
+    assert {template: len(samples) for template, samples in router.backends[0].template_latencies.items()} == {"rag": 1, "summary": 1, "report": 1}
+    assert len(router.backends[0].latencies) == 4
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("scipy")
+
+from utils import map_reduce, llm_cache
+from utils.llm_router import LLMUnavailableError
+
+
+@pytest.fixture(autouse=True)
+def completion_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_connection", None)
+    yield
+    if llm_cache._connection is not None:
+        llm_cache._connection.close()
+
+
+@pytest.fixture
+def document(monkeypatch):
+    """A five-chunk document; the fake LLM summarizes a map call as "S<chunk>" and a reduce call as "R"."""
+    chunks = [f"chunk {i}" for i in range(5)]
+    monkeypatch.setattr(map_reduce, "all_document_chunks", lambda doc_id: {"documents": [chunks], "metadatas": [[{"filename": "report.pdf"}] * 5]})
+    calls = []
+
+    async def fake_llm(prompt, cache_key=None, template=None, **kwargs):
+        calls.append(template)
+        if "chunk 3" in prompt and template == "map":
+            raise LLMUnavailableError("down")
+        text = "R" if template == "reduce" else "S" + prompt.split("chunk ")[-1][0]
+        llm_cache.put(cache_key, text)
+        return text
+
+    monkeypatch.setattr(map_reduce, "aget_llm_response", fake_llm)
+    return calls
+
+
+def test_reduce_loop_runs_until_the_parts_fit_and_labels_their_ranges(document, monkeypatch):
+    monkeypatch.setattr(map_reduce, "REDUCE_GROUP_SIZE", 2)
+    progress = []
+    context = asyncio.run(map_reduce.map_reduce_context(1, progress=progress.append))
+
+    # 4 partials (chunk 3 failed) -> 2 reduced parts
+    assert document.count("map") == 5 and document.count("reduce") == 2
+    assert "(doc_id=1, parts 1-2 of 5)\nR" in context
+    assert "(doc_id=1, parts 3-5 of 5)\nR" in context
+    assert progress[-1] == {"phase": "reduce", "done": 2, "total": 2}
+
+
+def test_small_documents_skip_the_reduce_phase(document):
+    context = asyncio.run(map_reduce.map_reduce_context(1))
+    assert "reduce" not in document
+    assert context.count("SOURCE: report.pdf") == 4
+    assert "(doc_id=1, part 5 of 5)\nS4" in context
+
+
+def test_cached_partials_are_reused_unless_bypassed(document):
+    asyncio.run(map_reduce.map_reduce_context(1))
+    document.clear()
+    asyncio.run(map_reduce.map_reduce_context(1))
+    # Only the failed chunk is retried
+    assert document == ["map"]
+    document.clear()
+    asyncio.run(map_reduce.map_reduce_context(1, use_cache=False))
+    assert document.count("map") == 5
@@ -0,0 +1,59 @@
+import pytest
+from utils import near_duplicates
+
+BASE = (
+    "The tenant shall pay the monthly rent on the first day of each month by bank transfer "
+    "to the account named by the landlord, and late payments accrue interest at two percent."
+)
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(near_duplicates, "NEAR_DUPLICATES_PATH", str(tmp_path / "near_duplicates.db"))
+    monkeypatch.setattr(near_duplicates, "_connection", None)
+    yield near_duplicates
+    if near_duplicates._connection is not None:
+        near_duplicates._connection.close()
+
+
+def test_signature_is_deterministic_and_none_for_empty_text():
+    assert (near_duplicates.signature(BASE) == near_duplicates.signature(BASE)).all()
+    assert near_duplicates.signature(BASE).shape == (near_duplicates.NUM_PERMUTATIONS,)
+    assert near_duplicates.signature("  ...  ") is None
+
+
+def test_signature_ignores_case_and_punctuation():
+    assert near_duplicates.similarity(near_duplicates.signature(BASE), near_duplicates.signature(BASE.upper().replace(",", ""))) == 1.0
+
+
+def test_similarity_separates_near_duplicates_from_unrelated_text():
+    draft = BASE.replace("two percent", "three percent")
+    unrelated = "Quarterly revenue grew in every region except the north, where two stores closed for renovation."
+    assert near_duplicates.similarity(near_duplicates.signature(BASE), near_duplicates.signature(draft)) >= near_duplicates.DUPLICATE_THRESHOLD
+    assert near_duplicates.similarity(near_duplicates.signature(BASE), near_duplicates.signature(unrelated)) < 0.2
+
+
+def test_collapse_keeps_the_best_ranked_chunk_of_each_cluster(index):
+    meta = {"doc_id": 1, "owner_id": 7}
+    duplicates = index.add_chunks(
+        ["doc1_chunk0", "doc1_chunk1", "doc1_chunk2"],
+        [BASE, "An unrelated clause about parking spaces and visitor permits for the building.", BASE + " Signed."],
+        [meta, meta, meta],
+    )
+    assert duplicates == 1
+    assert index.collapse(["doc1_chunk2", "doc1_chunk1", "doc1_chunk0", "unindexed"]) == ["doc1_chunk2", "doc1_chunk1", "unindexed"]
+
+
+def test_near_duplicates_are_only_matched_within_an_owner(index):
+    index.add_chunks(["doc1_chunk0"], [BASE], [{"doc_id": 1, "owner_id": 7}])
+    assert index.add_chunks(["doc2_chunk0"], [BASE], [{"doc_id": 2, "owner_id": 8}]) == 0
+    assert index.collapse(["doc1_chunk0", "doc2_chunk0"]) == ["doc1_chunk0", "doc2_chunk0"]
+
+
+def test_deleting_a_cluster_head_hands_the_cluster_over(index):
+    meta = {"doc_id": 1, "owner_id": 7}
+    index.add_chunks(["doc1_chunk0"], [BASE], [meta])
+    index.add_chunks(["doc2_chunk0", "doc2_chunk1"], [BASE, BASE + " Signed."], [{"doc_id": 2, "owner_id": 7}] * 2)
+    index.delete_document(1)
+    assert index.collapse(["doc2_chunk1", "doc2_chunk0"]) == ["doc2_chunk1"]
+    assert index.dedup_stats(7) == {"chunks": 2, "clusters": 1, "duplicates": 1, "dedup_ratio": 0.5}
@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from utils import query_embeddings
+
+
+class CountingModel:
+    """Wraps the fake embedding model and records how many texts it encoded."""
+    def __init__(self, model):
+        self.model = model
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend([texts] if isinstance(texts, str) else texts)
+        return self.model.encode(texts, **kwargs)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    counting = CountingModel(query_embeddings.embedding_model)
+    monkeypatch.setattr(query_embeddings, "embedding_model", counting)
+    monkeypatch.setattr(query_embeddings, "_entries", query_embeddings.OrderedDict())
+    monkeypatch.setattr(query_embeddings, "stats", {"hits": 0, "misses": 0, "evictions": 0})
+    return counting
+
+
+def test_normalized_repeats_are_embedded_once(model):
+    first = query_embeddings.embed_query("When is rent due?")
+    assert query_embeddings.embed_query("  when IS rent   due? ") == first
+    assert model.encoded == ["When is rent due?"]
+    assert query_embeddings.hit_ratio() == 0.5
+
+
+def test_least_recently_used_question_is_evicted(model, monkeypatch):
+    monkeypatch.setattr(query_embeddings, "MAX_ENTRIES", 2)
+    query_embeddings.embed_query("a")
+    query_embeddings.embed_query("b")
+    query_embeddings.embed_query("a")
+    query_embeddings.embed_query("c")
+    assert query_embeddings.get("b") is None and query_embeddings.get("a") is not None
+    assert query_embeddings.stats["evictions"] == 1
+
+
+def test_batch_encodes_only_the_misses_together(model):
+    query_embeddings.embed_query("known")
+    embeddings = query_embeddings.embed_queries(["known", "new one", "new two"])
+    assert model.encoded == ["known", "new one", "new two"]
+    assert len(embeddings) == 3 and all(embedding is not None for embedding in embeddings)
+
+
+def test_summary_and_report_queries_are_pinned(model, monkeypatch):
+    monkeypatch.setattr(query_embeddings, "MAX_ENTRIES", 0)
+    query_embeddings.embed_query("anything")
+    assert query_embeddings.get(query_embeddings.SUMMARY_QUERY) is not None
+    assert model.encoded == ["anything"]
@@ -0,0 +1,96 @@
+import os
+import json
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("unstructured")
+pytest.importorskip("langgraph")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sources import models
+from utils import reindex, keyword_index, near_duplicates
+from utils.vector_store import GenerationalVectorStore, read_index_state
+
+CONTENT = "Rent is due on the first day of every month.\n\nThe deposit equals two months of rent."
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)
+    store = GenerationalVectorStore("numpy")
+    monkeypatch.setattr(reindex, "SessionLocal", session)
+    monkeypatch.setattr(reindex, "vector_store", store)
+    monkeypatch.setattr(reindex, "DUAL_WRITE_GRACE_SECONDS", 0)
+    monkeypatch.setattr(reindex.settings, "REINDEX_THROTTLE_SECONDS", 0)
+    monkeypatch.setattr(reindex.settings, "VECTOR_STORAGE_MODE", "float32")
+    for module, path in ((keyword_index, "KEYWORD_INDEX_PATH"), (near_duplicates, "NEAR_DUPLICATES_PATH")):
+        monkeypatch.setattr(module, path, str(tmp_path / f"{module.__name__}.db"))
+        monkeypatch.setattr(module, "_connection", None)
+
+    db = session()
+    db.add_all([
+        models.Document(id=1, filename="lease.pdf", status="complete", content=CONTENT, owner_id=1),
+        models.Document(id=2, filename="draft.pdf", status="failed", content=CONTENT, owner_id=1),
+    ])
+    db.commit()
+    db.close()
+    yield store, session
+    for module in (keyword_index, near_duplicates):
+        if module._connection is not None:
+            module._connection.close()
+
+
+def test_start_builds_a_shadow_generation_and_dual_writes(env):
+    store, _ = env
+    reindex.start()
+    state = read_index_state()
+    assert (state["active"], state["shadow"]) == (1, 2)
+    assert json.load(open(reindex.REINDEX_PROGRESS_PATH))["completed"] is True
+    # Only searchable documents are reindexed
+    assert {meta["doc_id"] for meta in store.store(2).get(1)["metadatas"]} == {1}
+    # Reads stay on the active generation while new uploads reach both
+    assert store.get(1)["ids"] == []
+    store.add(1, ["doc9_chunk0"], [[1.0] + [0.0] * 63], ["new upload"], [{"doc_id": 9, "owner_id": 1}])
+    assert store.store(1).get(1)["ids"] == store.store(2).get(1, ids=["doc9_chunk0"])["ids"] == ["doc9_chunk0"]
+
+
+def test_switch_serves_the_new_generation_with_aligned_sparse_indexes(env):
+    store, session = env
+    reindex.start(switch_when_done=True)
+    state = read_index_state()
+    assert (state["active"], state["previous"], state["shadow"]) == (2, 1, None)
+    assert not os.path.exists(reindex.REINDEX_PROGRESS_PATH)
+
+    chunk_ids = set(store.get(1, where={"doc_id": 1}, include=[])["ids"])
+    assert chunk_ids and keyword_index.chunk_ids_of(1) == chunk_ids == near_duplicates.chunk_ids_of(1)
+    assert keyword_index.search("deposit", owner_id=1)
+    db = session()
+    document = db.get(models.Document, 1)
+    assert document.chunk_count == len(chunk_ids)
+    assert set(json.loads(document.representative_chunks)) <= chunk_ids
+    db.close()
+
+    reindex.cleanup()
+    assert read_index_state()["previous"] is None
+    assert not os.path.exists(store.store(1).path)
+
+
+def test_switch_without_a_completed_shadow_changes_nothing(env):
+    reindex.switch()
+    assert read_index_state()["active"] == 1
+
+
+def test_abort_stops_dual_writes_and_deletes_the_shadow(env):
+    store, _ = env
+    reindex.start()
+    shadow_path = store.store(2).path
+    assert os.path.isdir(shadow_path)
+    reindex.abort()
+    state = read_index_state()
+    assert state["shadow"] is None and "2" not in state["specs"]
+    assert not os.path.exists(shadow_path) and not os.path.exists(reindex.REINDEX_PROGRESS_PATH)
+    store.add(1, ["doc9_chunk0"], [[1.0] + [0.0] * 63], ["new upload"], [{"doc_id": 9, "owner_id": 1}])
+    assert not os.path.exists(shadow_path)
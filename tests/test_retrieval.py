@@ -0,0 +1,88 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pydantic_settings")
+pytest.importorskip("langchain")
+from utils import retrieval, near_duplicates
+
+
+@pytest.fixture
+def duplicates_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(near_duplicates, "NEAR_DUPLICATES_PATH", str(tmp_path / "near_duplicates.db"))
+    monkeypatch.setattr(near_duplicates, "_connection", None)
+    yield near_duplicates
+    if near_duplicates._connection is not None:
+        near_duplicates._connection.close()
+
+
+def _dense(ids: list) -> dict:
+    return {"ids": [ids], "documents": [[f"text of {i}" for i in ids]], "metadatas": [[{"doc_id": 1} for _ in ids]]}
+
+
+def _sparse(ids: list) -> list:
+    return [{"id": i, "document": f"text of {i}", "metadata": {"doc_id": 1}} for i in ids]
+
+
+def test_rrf_rewards_chunks_found_by_both_rankings():
+    fused = retrieval.reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]])
+    assert fused[0] == "c"
+    assert set(fused) == {"a", "b", "c", "d"}
+    assert fused.index("a") < fused.index("d")
+
+
+def test_fuse_keeps_texts_of_keyword_only_hits(duplicates_index):
+    fused = retrieval._fuse(_dense(["a", "b"]), 0, _sparse(["k"]), n_results=3)
+    assert set(fused["ids"][0]) == {"a", "b", "k"}
+    assert fused["documents"][0][fused["ids"][0].index("k")] == "text of k"
+
+
+def test_fuse_collapses_near_duplicates_and_still_fills_n_results(duplicates_index):
+    text = "the tenant shall pay the monthly rent on the first day of each month by bank transfer"
+    meta = {"doc_id": 1, "owner_id": 7}
+    duplicates_index.add_chunks(["a", "a_copy"], [text, text + " please"], [meta, meta])
+
+    # Over-fetched candidates (n_results * COLLAPSE_OVERFETCH) leave enough after collapsing
+    fused = retrieval._fuse(_dense(["a", "a_copy", "b", "c"]), 0, [], n_results=3)
+    assert fused["ids"][0] == ["a", "b", "c"]
+
+
+class FakeReranker:
+    """Cross-encoder returning fixed logits per document text."""
+    def __init__(self, logits: dict):
+        self.logits = logits
+
+    def predict(self, pairs, batch_size=8):
+        return [self.logits[document] for _, document in pairs]
+
+
+def _pool(texts: list) -> dict:
+    return {"ids": [[f"c{i}" for i in range(len(texts))]], "documents": [texts], "metadatas": [[{"doc_id": 1} for _ in texts]]}
+
+
+# c0 and c1 say the same thing; c2 is relevant but different; c3 is off-topic
+TEXTS = ["rent is due monthly", "rent is due monthly!", "deposit is two months", "parking permits"]
+LOGITS = {TEXTS[0]: 9.0, TEXTS[1]: 8.9, TEXTS[2]: 6.0, TEXTS[3]: -5.0}
+EMBEDDINGS = {"c0": [1.0, 0.0, 0.0], "c1": [0.999, 0.04, 0.0], "c2": [0.1, 1.0, 0.0], "c3": [0.0, 0.0, 1.0]}
+
+
+def test_normalized_relevance_spans_zero_to_one():
+    assert retrieval._normalize_relevance([9.0, -5.0, 2.0]).tolist() == [1.0, 0.0, 0.5]
+    assert retrieval._normalize_relevance([3.0, 3.0]).tolist() == [1.0, 1.0]
+
+
+def test_rerank_with_mmr_does_not_pick_both_near_identical_chunks(monkeypatch):
+    monkeypatch.setattr(retrieval, "reranker_model", FakeReranker(LOGITS))
+    monkeypatch.setattr(retrieval, "_get_by_ids", lambda ids, include: {"ids": ids, "embeddings": [EMBEDDINGS[i] for i in ids]})
+    reranked = retrieval.rerank_with_mmr("when is rent due?", _pool(TEXTS), top_k=2, mmr_lambda=0.7)
+    assert reranked["ids"][0] == ["c0", "c2"]
+
+
+def test_rerank_pool_uses_the_same_normalized_relevance(monkeypatch):
+    embeddings = {chunk_id: retrieval.np.asarray(vector, dtype=retrieval.np.float32) for chunk_id, vector in EMBEDDINGS.items()}
+    monkeypatch.setattr(retrieval, "reranker_model", FakeReranker(LOGITS))
+    assert retrieval.rerank_pool("when is rent due?", None, _pool(TEXTS), embeddings, top_k=2)["ids"][0] == ["c0", "c2"]
+
+    monkeypatch.setattr(retrieval, "reranker_model", None)
+    # Cosine relevance: c1 leads, c0 is its near copy, c2 is next best
+    reranked = retrieval.rerank_pool("when is rent due?", [1.0, 0.6, 0.0], _pool(TEXTS), embeddings, top_k=2)
+    assert reranked["ids"][0] == ["c1", "c2"]
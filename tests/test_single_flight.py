@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_one_key_share_one_computation():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        same = await asyncio.gather(*(flights.do("key", compute) for _ in range(3)))
+        other = await flights.do("other", compute)
+        again = await flights.do("key", compute)
+        return same, other, again
+
+    same, other, again = asyncio.run(main())
+    assert same == ["result"] * 3 and other == again == "result"
+    # One shared call for the burst, then fresh ones once it finished
+    assert len(calls) == 3
+    assert flights.stats == {"started": 3, "coalesced": 2}
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_work():
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("key", compute))
+        second = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        results = await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+        assert flights._in_flight == {}
+        return results
+
+    assert [type(result) for result in asyncio.run(main())] == [ValueError, ValueError]
@@ -0,0 +1,125 @@
+import threading
+import numpy as np
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from utils import vector_store
+from utils.vector_store import NumpyVectorStore, encode_vectors, decode_vectors
+
+DIM = 32
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _add(store, owner_id: int, doc_id: int, vectors: np.ndarray, start: int = 0):
+    ids = [f"doc{doc_id}_chunk{i}" for i in range(start, start + len(vectors))]
+    store.add(owner_id, ids, vectors, [f"text of {chunk_id}" for chunk_id in ids], [{"doc_id": doc_id, "owner_id": owner_id} for _ in ids])
+    return ids
+
+
+@pytest.fixture
+def store(tmp_path):
+    return NumpyVectorStore(str(tmp_path / "store"), mode="float32")
+
+
+def test_query_returns_nearest_chunks_with_texts_and_metadata(store):
+    vectors = _vectors(20)
+    ids = _add(store, 1, 7, vectors)
+    result = store.query(1, vectors[3], 3)
+    assert result["ids"][0][0] == ids[3]
+    assert result["documents"][0][0] == f"text of {ids[3]}"
+    assert result["metadatas"][0][0] == {"doc_id": 7, "owner_id": 1}
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    # Partitioned by owner
+    assert store.query(2, vectors[3], 3)["ids"] == [[]]
+
+
+def test_get_by_ids_filter_and_page(store):
+    first = _add(store, 1, 1, _vectors(5))
+    second = _add(store, 1, 2, _vectors(5, seed=1))
+    assert store.get(1, ids=[second[1], "missing", first[0]])["ids"] == [second[1], first[0]]
+    assert store.get(1, where={"doc_id": 2})["ids"] == second
+    assert store.get(1, limit=3, offset=4)["ids"] == first[4:] + second[:2]
+    embeddings = store.get(1, ids=[first[2]], include=("embeddings",))["embeddings"]
+    assert np.allclose(embeddings[0], _vectors(5)[2], atol=1e-6)
+
+
+def test_delete_rewrites_shards_without_the_matching_rows(store):
+    kept = _add(store, 1, 1, _vectors(6))
+    _add(store, 1, 2, _vectors(6, seed=1))
+    store.query(1, _vectors(1)[0], 1)
+    store.delete(1, {"doc_id": 2})
+    assert store.get(1)["ids"] == kept
+    assert set(store.query(1, _vectors(6, seed=1)[0], 12)["ids"][0]) == set(kept)
+
+
+def test_concurrent_deletes_do_not_duplicate_kept_rows(store):
+    kept = _add(store, 1, 1, _vectors(10))
+    _add(store, 1, 2, _vectors(10, seed=1))
+    _add(store, 1, 3, _vectors(10, seed=2))
+    threads = [threading.Thread(target=store.delete, args=(1, {"doc_id": doc_id})) for doc_id in (2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(store.get(1)["ids"]) == sorted(kept)
+
+
+def test_adds_extend_the_loaded_index_without_copying_the_codes(store):
+    _add(store, 1, 1, _vectors(5))
+    before = store._index(1)
+    assert isinstance(before.codes.parts[0], np.memmap)
+    added = _add(store, 1, 1, _vectors(5, seed=1), start=5)
+    after = store._index(1)
+    assert after is not before and after.codes.parts[0] is before.codes.parts[0]
+    assert len(after.codes) == 10 and len(before.rows_by_doc[1]) == 5 and len(after.rows_by_doc[1]) == 10
+    assert store.query(1, _vectors(5, seed=1)[2], 1)["ids"][0] == [added[2]]
+
+
+@pytest.mark.parametrize("mode,dim", [("float16", 0), ("int8", 0), ("int8", 16)])
+def test_quantized_and_truncated_indexes_rescore_to_the_exact_neighbours(tmp_path, mode, dim):
+    vectors = _vectors(200)
+    exact = NumpyVectorStore(str(tmp_path / "exact"), mode="float32")
+    lossy = NumpyVectorStore(str(tmp_path / mode), mode=mode, dim=dim)
+    _add(exact, 1, 1, vectors)
+    _add(lossy, 1, 1, vectors)
+    probe = vectors[42] + 0.3 * _vectors(1, seed=9)[0]
+    found, expected = lossy.query(1, probe, 3), exact.query(1, probe, 3)
+    assert found["ids"][0][0] == expected["ids"][0][0]
+    # Re-scored with the float32 vectors, so the distance is exact too
+    assert found["distances"][0][0] == pytest.approx(expected["distances"][0][0], abs=1e-5)
+    assert lossy._index(1).codes.shape[1] == (dim or DIM)
+
+
+def test_int8_codes_round_trip_closely():
+    vectors = _vectors(50)
+    codes, scales = encode_vectors(vectors, "int8")
+    assert codes.dtype == np.int8
+    assert np.abs(decode_vectors(codes, scales) - vectors).max() < 0.01
+
+
+def test_large_owners_train_the_ivf_index_once_under_concurrent_queries(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "EXACT_SEARCH_MAX_VECTORS", 50)
+    monkeypatch.setattr(vector_store, "IVF_NPROBE", 100)
+    vectors = _vectors(300)
+    ids = _add(store, 1, 1, vectors)
+    trainings = []
+    train = vector_store._IVFIndex.train.__func__
+
+    def counting_train(cls, *args, **kwargs):
+        trainings.append(1)
+        return train(cls, *args, **kwargs)
+
+    monkeypatch.setattr(vector_store._IVFIndex, "train", classmethod(counting_train))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.query(1, vectors[11], 1)["ids"][0])) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[ids[11]]] * 4
+    assert len(trainings) == 1
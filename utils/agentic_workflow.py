@@ -1,14 +1,22 @@
 import os
+import json
 from typing import TypedDict, Literal
 from langgraph.graph import StateGraph, END
 
 from sources.database import SessionLocal
 from sources import models
-from utils.shared_models import llm, embedding_model, chroma_collection, transcription_model
+from utils.shared_models import llm, embedding_model, transcription_model
 from utils.ai_services import generate_summary, generate_report, audiolize_summary, transcribe_video
+from utils import keyword_index, answer_cache, prompts, element_store, near_duplicates
+from utils.retrieval import chunk_id_for, split_into_chunks
+from utils.vector_store import vector_store
+from utils.concurrency import llm_limiter
+from utils.clustering import representative_indices
 from sources.hashing import calculate_file_hash
 from unstructured.partition.auto import partition
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Representative chunks kept per document (the largest summary/report context budget)
+REPRESENTATIVE_CHUNKS = 12
 
 # --- 1. Define the State ---
 class AgentState(TypedDict):
@@ -34,31 +42,36 @@ def node_extract_and_embed(state: AgentState) -> dict:
         # Extract Content
         filepath = state['filepath']
         file_extension = os.path.splitext(filepath)[1].lower()
-        extracted_content = ""
+        elements = []
         
         if file_extension in [".pdf", ".docx", ".txt"]:
-            elements = partition(filename=filepath)
-            extracted_content = "\n\n".join([str(el) for el in elements])
+            elements = element_store.from_partition(partition(filename=filepath))
         elif file_extension in [".mp4", ".mov", ".avi"]:
-            extracted_content = transcribe_video(filepath)
+            elements = element_store.from_transcript(transcribe_video(filepath))
         elif file_extension in [".mp3", ".wav", ".m4a"]:
             result = transcription_model.transcribe(filepath, fp16=False)
-            extracted_content = result["text"]
+            elements = element_store.from_transcript(result["text"])
+        # Kept so re-chunking (utils/reindex) never re-runs extraction
+        element_store.save(state['doc_id'], elements)
+        extracted_content = element_store.to_text(elements)
         
         # Embed Content
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=20000, chunk_overlap=1000)
-        chunks = text_splitter.split_text(extracted_content)
-        embeddings = embedding_model.encode(chunks).tolist()
-        chunk_ids = [f"doc{state['doc_id']}_chunk{i}" for i in range(len(chunks))]
+        chunks = split_into_chunks(extracted_content)
+        embeddings = embedding_model.encode(chunks)
+        chunk_ids = [chunk_id_for(state['doc_id'], i) for i in range(len(chunks))]
         metadatas = [{"doc_id": state['doc_id'], "owner_id": state['owner_id'], "filename": state['filepath']} for _ in chunks]
-        chroma_collection.add(
-            ids=chunk_ids, 
-            embeddings=embeddings, 
-            documents=chunks, 
-            metadatas=metadatas
-        )
+        vector_store.add(state['owner_id'], chunk_ids, embeddings, chunks, metadatas)
+        keyword_index.add_chunks(chunk_ids, chunks, metadatas)
+        duplicates = near_duplicates.add_chunks(chunk_ids, chunks, metadatas)
+        if duplicates:
+            print(f"--- Agent: {duplicates}/{len(chunks)} chunk(s) near-duplicate existing library chunks ---")
+        answer_cache.invalidate(owner_id=state['owner_id'], doc_id=state['doc_id'])
         
         doc.content = extracted_content
+        doc.chunk_count = len(chunks)
+        # Precompute the chunks summaries/reports use, so generation needs no embedding or vector query
+        representative = representative_indices(embeddings, REPRESENTATIVE_CHUNKS)
+        doc.representative_chunks = json.dumps([chunk_ids[i] for i in representative])
         doc.status = "ready_for_chat"
         db.commit()
         
@@ -76,21 +89,11 @@ def node_classify_content(state: AgentState) -> dict:
     print(f"--- Agent [2/4]: Classifying Doc ID: {state['doc_id']} ---")
     content_preview = state['extracted_content'][:2000] # Use a preview
     
-    prompt = f"""You are a document classification expert. Analyze the following text preview and classify its primary purpose.
-    Your answer MUST be a single word from this list: [academic, business, legal_policy, generic].
-    
-    - 'academic': For research papers, dissertations, lectures, scholarly articles.
-    - 'business': For business reports, meeting notes, strategy documents, corporate memos.
-    - 'legal_policy': For insurance policies, legal contracts, claims, risk assessments, regulatory files.
-    - 'generic': For all other document types (articles, books, etc.).
-    
-    Text Preview:
-    ---
-    {content_preview}
-    ---
-    Classification:"""
+    prompt = prompts.render("classify", preview=content_preview)
     
-    response = llm.invoke(prompt)
+    with llm_limiter.limit_sync(state['owner_id']):
+        response = llm.invoke(prompt, template="classify")
+    prompts.record_usage("classify", getattr(response, "usage_metadata", None))
     classification = str(response.content).strip().lower()
     
     if classification not in ['academic', 'business', 'legal_policy', 'generic']:
@@ -106,7 +109,7 @@ def node_academic_agent(state: AgentState):
     print(f"--- Agent [3/4]: Running Academic Agent for Doc ID: {state['doc_id']} ---")
     db = SessionLocal()
     try:
-        summary_text = generate_summary(state['doc_id'], "short")
+        summary_text = generate_summary(state['doc_id'], "short", user_id=state['owner_id'])
         summary_audio = audiolize_summary(summary_text)
         db.add(models.Summary(
             content=summary_text, 
@@ -115,7 +118,7 @@ def node_academic_agent(state: AgentState):
             user_id=state['owner_id'], 
             document_id=state['doc_id']
         ))
-        report_text = generate_report(state['doc_id'], "academic")
+        report_text = generate_report(state['doc_id'], "academic", user_id=state['owner_id'])
         db.add(models.Report(
             content=report_text, 
             report_type="academic", 
@@ -134,12 +137,12 @@ def node_business_agent(state: AgentState):
     print(f"--- Agent [3/4]: Running Business Agent for Doc ID: {state['doc_id']} ---")
     db = SessionLocal()
     try:
-        summary_text = generate_summary(state['doc_id'], "short")
+        summary_text = generate_summary(state['doc_id'], "short", user_id=state['owner_id'])
         summary_audio = audiolize_summary(summary_text)
         db.add(models.Summary(
             content=summary_text, audio_path=summary_audio, summary_type="short", user_id=state['owner_id'], document_id=state['doc_id']
         ))
-        report_text = generate_report(state['doc_id'], "business_insights")
+        report_text = generate_report(state['doc_id'], "business_insights", user_id=state['owner_id'])
         db.add(models.Report(
             content=report_text, report_type="business_insights", user_id=state['owner_id'], document_id=state['doc_id']
         ))
@@ -155,12 +158,12 @@ def node_legal_policy_agent(state: AgentState):
     print(f"--- Agent [3/4]: Running Legal/Policy Agent for Doc ID: {state['doc_id']} ---")
     db = SessionLocal()
     try:
-        summary_text = generate_summary(state['doc_id'], "short") # "short" is good for key terms
+        summary_text = generate_summary(state['doc_id'], "short", user_id=state['owner_id']) # "short" is good for key terms
         summary_audio = audiolize_summary(summary_text)
         db.add(models.Summary(
             content=summary_text, audio_path=summary_audio, summary_type="short", user_id=state['owner_id'], document_id=state['doc_id']
         ))
-        report_text = generate_report(state['doc_id'], "risk_analysis")
+        report_text = generate_report(state['doc_id'], "risk_analysis", user_id=state['owner_id'])
         db.add(models.Report(
             content=report_text, report_type="risk_analysis", user_id=state['owner_id'], document_id=state['doc_id']
         ))
@@ -176,7 +179,7 @@ def node_generic_agent(state: AgentState):
     print(f"--- Agent [3/4]: Running Generic Agent for Doc ID: {state['doc_id']} ---")
     db = SessionLocal()
     try:
-        summary_text = generate_summary(state['doc_id'], "short")
+        summary_text = generate_summary(state['doc_id'], "short", user_id=state['owner_id'])
         summary_audio = audiolize_summary(summary_text)
         db.add(models.Summary(
             content=summary_text, audio_path=summary_audio, summary_type="short", user_id=state['owner_id'], document_id=state['doc_id']
@@ -1,4 +1,5 @@
 import os, subprocess
+import asyncio
 import uuid
 import torch
 from scipy.io.wavfile import write as write_wav
@@ -6,222 +7,109 @@ from utils.shared_models import (
     llm,
     tts_model,
     tts_tokenizer,
-    embedding_model,
-    chroma_collection,
     AUDIO_SAVE_DIRECTORY,
     transcription_model,
-    device
+    device,
+    fast_llm,
+    LLM_MODEL_ID,
+    LLM_SAMPLING_PARAMS
 )
-
-
-def get_llm_response(prompt: str) -> str:
-    try:
-        response = llm.invoke(prompt)
-        return str(response.content)
-    except Exception as e:
-        return f"Error while generating response: {str(e)}"
-
-def generate_summary(doc_id: int, summary_type: str) -> str:
-    dummy_question = "What is the main topic and key points of this document?"
-    question_embedding = embedding_model.encode(dummy_question).tolist()
+from utils.retrieval import retrieve_context, retrieve_context_many, document_context_chunks
+from utils.vector_partitions import owner_of_document
+from utils.vector_store import vector_store
+from utils import answer_cache, llm_cache, prompts, query_embeddings, conversations
+from utils.concurrency import llm_limiter, run_blocking
+from sources.config import settings
+from utils.context_builder import compress_to_budget, key_sentences, CONTEXT_TOKEN_BUDGETS
+from utils.llm_router import LLMUnavailableError, answered_by
+from utils import degradation
+
+NO_CONTEXT_ANSWER = "I couldn't find any relevant content in your documents to answer that."
+
+
+def _completion_cache_key(prompt: str) -> str:
+    return llm_cache.completion_key(LLM_MODEL_ID, LLM_SAMPLING_PARAMS, prompt)
+
+
+def _from_primary(response) -> bool:
+    # Completion cache keys name the primary model, so failover answers are never stored under them
+    return answered_by(response) == llm.primary
+
+
+def get_llm_response(prompt: str, use_cache: bool = False, template: str = None, user_id: int = None, refresh: bool = False) -> str:
+    """
+    With use_cache=True the completion is served from / stored in the persistent
+    completion cache (keyed by model id, sampling params and prompt hash); answers from
+    failover providers are returned but not stored; refresh=True skips the cached copy but
+    stores the new completion in its place.
+    `template` names the prompts.TEMPLATES entry the prompt was rendered from, for usage stats.
+    Raises LLMUnavailableError when every provider failed, so no error text is stored as a result.
+    The call takes a slot of the global and per-user LLM limits like the async path.
+    """
+    cache_key = _completion_cache_key(prompt) if use_cache else None
+    if cache_key and not refresh:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    with llm_limiter.limit_sync(user_id):
+        response = llm.invoke(prompt, template=template)
+    prompts.record_usage(template, getattr(response, "usage_metadata", None))
+    content = str(response.content)
+    if cache_key and _from_primary(response):
+        llm_cache.put(cache_key, content)
+    return content
+
+def prepare_summary_prompt(doc_id: int, summary_type: str) -> str:
+    """Builds the summary prompt for a document, or returns None when no content could be retrieved."""
+    # Small documents are used whole, in order; larger ones use the representative chunks picked
+    # at ingestion, and only documents without either fall back to similarity search
+    results = document_context_chunks(doc_id, budget=10)
+    if results is None:
+        question_embedding = query_embeddings.embed_query(query_embeddings.SUMMARY_QUERY)
+        results = vector_store.query(owner_of_document(doc_id), question_embedding, 10, where={"doc_id": doc_id})
     
-    results = chroma_collection.query(
-        query_embeddings=[question_embedding],
-        n_results=10,
-        where={"doc_id": doc_id}
-    )
-    
-    cited_context = _build_cited_context(results)
+    cited_context = _build_cited_context(results, max_tokens=CONTEXT_TOKEN_BUDGETS["summary"])
 
     if not cited_context:
-        return "Could not retrieve content for summary."
+        return None
 
-    summary_instruction = (
-        "Write a concise, one-paragraph summary of the provided content. "
-        "Include numbered citations like [1], [2], etc., that map directly to the 'reference list'."
-        if summary_type == "short"
-        else "Write a detailed, multi-paragraph summary of the provided content. "
-            "Use headings when appropriate and include numbered citations like [1], [2], etc., "
-            "that map directly to the reference list."
-    )
-    
-    prompt = f"""
-        <|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are a professional summarization assistant.  
-        Your task is to generate structured summaries with **numbered citations** matching the source content.
-
-        ### Summary Rules
-        1. Base your summary ONLY on the provided content.
-        2. Every major claim or sentence must include at least one citation using bracket format:  
-        **[1]**, **[2]**, **[3]**, etc.
-        3. Citations must correspond to the source chunks provided in the input.
-        4. After writing the summary, include a **References** section list where each number maps to:
-        - The filename  
-        - Section or part name (if provided in the chunk)  
-        Example:  
-        `[1] (FYP.pdf, Section: "Problem Statement")`
-        `[2] (FYP.pdf, Section: "Market Growth")`
-        5. Maintain a clean and natural writing style while preserving traceability.
-        6. For multi-paragraph summaries:
-        - Group related information together
-        - Use headings reflecting the document structure
-        - Still use numeric citations for each claim
-
-        ### Output Format (STRICT)
-        Your output must follow **this exact structure**:
-        
-        **Summary:**
-        SUMMARY TEXT WITH [1], [2], [3]...
-
-        **References:**
-        [1] (filename, section/part: "...")
-        [2] (...)
-        [3] (...)
-
-        ### Formatting Rules (STRICT)
-        - Each reference **must appear on its own line**.
-        - Do NOT merge references into a single paragraph.
-        - References must not be inline or comma-separated.
-        - No text is allowed after the References section.
+    return build_summary_prompt(cited_context, summary_type)
 
-        <|eot_id|><|start_header_id|>user<|end_header_id|>
+def build_summary_prompt(cited_context: str, summary_type: str) -> str:
+    return prompts.render("summary", instruction=prompts.summary_instruction(summary_type), context=cited_context)
 
-        {summary_instruction}
-
-        Here is the content. Each chunk includes source metadata:
-
-        --- CONTENT START ---
-        {cited_context}
-        --- CONTENT END ---
-
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>
-        """
+def generate_summary(doc_id: int, summary_type: str, use_cache: bool = True, user_id: int = None, refresh: bool = False) -> str:
+    prompt = prepare_summary_prompt(doc_id, summary_type)
+    if prompt is None:
+        return "Could not retrieve content for summary."
 
-    summary = get_llm_response(prompt)
+    summary = get_llm_response(prompt, use_cache=use_cache, template="summary", user_id=user_id, refresh=refresh)
     
     return summary
 
-def generate_report(doc_id: int, report_type: str) -> str:
-    dummy_question = "What are the main findings, analysis points, and conclusions in this document?"
-    question_embedding = embedding_model.encode(dummy_question).tolist()
+def prepare_report_prompt(doc_id: int, report_type: str) -> str:
+    """Builds the report prompt for a document, or returns None when no content could be retrieved."""
+    results = document_context_chunks(doc_id, budget=12)
+    if results is None:
+        question_embedding = query_embeddings.embed_query(query_embeddings.REPORT_QUERY)
+        results = vector_store.query(owner_of_document(doc_id), question_embedding, 12, where={"doc_id": doc_id})
     
-    results = chroma_collection.query(
-        query_embeddings=[question_embedding],
-        n_results=12, 
-        where={"doc_id": doc_id}
-    )
-    
-    cited_context = _build_cited_context(results)
+    cited_context = _build_cited_context(results, max_tokens=CONTEXT_TOKEN_BUDGETS["report"])
 
     if not cited_context:
-        return "Could not retrieve content for report generation."
-
-    if report_type == "formal":
-        report_instruction = """
-        Analyze the following content and structure it into a formal business report. The report must include the following sections:
-        1.  **Executive Summary:** A brief, high-level overview of the document's main points.
-        2.  **Key Findings:** A bulleted list of the most critical insights, data, and conclusions.
-        3.  **Detailed Analysis:** An in-depth exploration of the key topics.
-        4.  **Conclusion & Recommendations:** A summary of the analysis and actionable recommendations, if applicable.
-        Maintain a professional, objective, and clear tone throughout.
-        """
-    elif report_type == "academic":
-        report_instruction = """
-        Analyze the following content and structure it into a formal academic report. The report must include the following sections:
-        1.  **Abstract:** A concise summary of the document's purpose, methods, key findings, and conclusions.
-        2.  **Introduction:** An overview of the topic and the document's main arguments.
-        3.  **Discussion of Findings:** A detailed analysis and interpretation of the key points presented in the content.
-        4.  **Conclusion:** A summary of the main arguments and their implications.
-        Maintain a formal, scholarly tone and use precise language.
-        """
-    elif report_type == "business_insights":
-        report_instruction = """
-        Analyze the following business document and generate a Business Intelligence report. Focus on:
-        1. Key Performance Indicators (KPIs) mentioned or implied.
-        2. Strategic Opportunities or Threats.
-        3. Actionable Recommendations for management.
-        """
-    elif report_type == "risk_analysis":
-        report_instruction = """
-        Analyze the following policy, claim, or risk document and generate a structured Risk Analysis Brief. Extract:
-        1. Key Terms and Definitions.
-        2. A list of specific Exclusions or Limitations.
-        3. Underwriting Insights or potential Claim Triggers.
-        4. A final assessment of the overall risk level.
-        """
-    else:
-        report_instruction = f"Generate a general report based on the following text."
-
-    prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-    You are an expert report writer specializing in creating structured, well-cited analysis reports with precise references.  
-    Your task is to generate a clean, organized report using numbered citations that correspond to a References section.
-
-    ### Citation Rules
-    1. Every major statement, claim, insight, or conclusion must include at least one numbered citation: [1], [2], [3], etc.
-    2. Citations must reference the source chunks included in the input.
-    3. For each citation number, include a corresponding entry in the References section with:
-    - Filename
-    - Section/subsection/topic/page (when provided)
-
-    Example Reference Entries:
-    `[1] (FYP.pdf, section: "Methods", topic: "Data Analysis")`
-
-    ### Section-Specific Requirements
-    **Executive Summary**
-    - Provide a high-level overview.
-    - Each key point must include citations like [1], [2].
-    - When multiple sections contributed to the point, use multiple citations: [1][3].
-
-    **Key Findings**
-    - Present findings as clear bullet points or short paragraphs.
-    - Each finding must cite exact source sections or topics.
-
-    **Detailed Analysis**
-    - Organize the analysis to follow the structure of the original document.
-    - Cite specific subsections and topics for every analytical point.
-    - When synthesizing across documents or across sections, use multiple citations: [2][4][5].
-
-    **Recommendations**
-    - Each recommendation must link to the evidence that supports it.
-    - Use citations pointing to the relevant findings or data sources.
-
-    ### Output Format (STRICT)
-    Your final output must follow **exactly** this structure:
-
-    Executive Summary  
-    (Paragraphs with citations like [1], [2], [3]...)
-    
-    Key Findings  
-    - Finding 1 [1]  
-    - Finding 2 [2][3]  
-    - Finding 3 [4]
-
-    Detailed Analysis  
-    (Structured sections with citations)
-
-    Recommendations  
-    (Recommendations with citations)
-
-    References:
-    [1] (filename, section: "...", topic: "...")
-    [2] (filename, section: "...", topic: "...")
-    [3] (filename, section: "...", topic: "...")
+        return None
 
-    ### Reference Formatting Rules (STRICT)
-    - Each reference MUST appear on its own newline.
-    - References must NOT be inline, comma-separated, or merged.
-    - No text should appear after the References section.
-    - The number of reference entries must match all citation numbers used in the report.
+    return build_report_prompt(cited_context, report_type)
 
-    <|eot_id|><|start_header_id|>user<|end_header_id|>
-    {report_instruction}
+def build_report_prompt(cited_context: str, report_type: str) -> str:
+    return prompts.render("report", instruction=prompts.report_instruction(report_type), context=cited_context)
 
-    Here is the source content (each chunk is prefixed with its source):
-    --- CONTENT START ---
-    {cited_context}
-    --- CONTENT END ---<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
+def generate_report(doc_id: int, report_type: str, use_cache: bool = True, user_id: int = None, refresh: bool = False) -> str:
+    prompt = prepare_report_prompt(doc_id, report_type)
+    if prompt is None:
+        return "Could not retrieve content for report generation."
 
-    report = get_llm_response(prompt)
+    report = get_llm_response(prompt, use_cache=use_cache, template="report", user_id=user_id, refresh=refresh)
     return report
 
 
@@ -240,6 +128,33 @@ def audiolize_summary(text: str) -> str:
     return filepath
 
 
+# Match patterns like:
+# [1] (filename, section: "...")
+# [1] (./uploads\filename.docx, section: "...")
+CITATION_PATTERN = r'\[(\d+)\]\s*\(([^,\)]+)(?:,\s*section:\s*["\']?([^"\'\)]+)["\']?)?\)'
+
+
+def _parse_citations(references_text: str) -> list:
+    import re
+
+    citations = []
+    for match in re.findall(CITATION_PATTERN, references_text, re.MULTILINE):
+        number = int(match[0])
+        # Clean up filename (remove path prefixes like ./uploads\)
+        filename = match[1].strip()
+        filename = filename.replace('./uploads\\', '').replace('./uploads/', '')
+        filename = filename.replace('uploads\\', '').replace('uploads/', '')
+        
+        section = match[2].strip() if match[2] else None
+        
+        citations.append({
+            "number": number,
+            "filename": filename,
+            "section": section
+        })
+    return citations
+
+
 def _parse_answer_with_citations(raw_answer: str) -> dict:
     import re
     
@@ -255,28 +170,7 @@ def _parse_answer_with_citations(raw_answer: str) -> dict:
         references_text = ""
     
     # Parse citations from references section
-    citations = []
-    if references_text:
-        # Match patterns like:
-        # [1] (filename, section: "...")
-        # [1] (./uploads\filename.docx, section: "...")
-        citation_pattern = r'\[(\d+)\]\s*\(([^,\)]+)(?:,\s*section:\s*["\']?([^"\'\)]+)["\']?)?\)'
-        matches = re.findall(citation_pattern, references_text, re.MULTILINE)
-        
-        for match in matches:
-            number = int(match[0])
-            # Clean up filename (remove path prefixes like ./uploads\)
-            filename = match[1].strip()
-            filename = filename.replace('./uploads\\', '').replace('./uploads/', '')
-            filename = filename.replace('uploads\\', '').replace('uploads/', '')
-            
-            section = match[2].strip() if match[2] else None
-            
-            citations.append({
-                "number": number,
-                "filename": filename,
-                "section": section
-            })
+    citations = _parse_citations(references_text) if references_text else []
     
     # Reconstruct the full answer with formatted references for storage
     full_answer_with_citations = answer_text
@@ -290,7 +184,11 @@ def _parse_answer_with_citations(raw_answer: str) -> dict:
     }
 
 
-def _build_cited_context(results: dict) -> str:
+def _build_cited_context(results: dict, max_tokens: int = None, question: str = None, question_embedding: list = None) -> str:
+    """
+    Formats retrieved chunks with their SOURCE labels. With max_tokens set, chunks are
+    compressed to the token budget (keeping the sentences most relevant to the question).
+    """
     documents = results.get('documents', [])
     metadatas = results.get('metadatas', [])
     parts = []
@@ -310,92 +208,480 @@ def _build_cited_context(results: dict) -> str:
         for d, m in zip(documents, metadatas):
             flat_docs.append((d, m))
 
+    labelled_chunks = []
     for idx, (doc_text, meta) in enumerate(flat_docs):
         filename = meta.get('filename') if isinstance(meta, dict) else None
         doc_id = meta.get('doc_id') if isinstance(meta, dict) else None
         source_label = f"SOURCE: {filename or 'unknown'} (doc_id={doc_id})"
+        labelled_chunks.append((source_label, doc_text))
+
+    if max_tokens:
+        labelled_chunks = compress_to_budget(labelled_chunks, max_tokens, question, question_embedding)
+
+    for source_label, doc_text in labelled_chunks:
         parts.append(f"{source_label}\n{doc_text}")
 
     return "\n\n".join(parts)
 
 
-def get_rag_response(question: str, owner_id: int = None, doc_id: int = None, n_results: int = 8) -> dict:
-    question_embedding = embedding_model.encode(question).tolist()
+def _rag_context_budget(endpoint: str, doc_id: int = None) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(endpoint or ("document_chat" if doc_id is not None else "library_chat"))
 
-    where_filter = {}
-    if doc_id is not None:
-        where_filter['doc_id'] = doc_id
-    elif owner_id is not None:
-        where_filter['owner_id'] = owner_id
 
-    context_chunks = chroma_collection.query(
-        query_embeddings=[question_embedding],
-        n_results=n_results,
-        where=where_filter if where_filter else None
-    )
+def prepare_rag_context(question: str, question_embedding: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, allow_rerank: bool = True, max_context_tokens: int = None) -> tuple:
+    """Retrieves context for the question. Returns (retrieved chunks, cited context string)."""
+    # Dense + BM25 keyword retrieval fused with RRF, so exact ids/names/acronyms are not missed,
+    # optionally reranked by the cross-encoder with MMR dedup (see RERANK_SETTINGS)
+    context_chunks = retrieve_context(question, question_embedding, owner_id=owner_id, doc_id=doc_id, n_results=n_results, endpoint=endpoint, allow_rerank=allow_rerank)
     # DEBUGING
-    print(f"RAG Query - Filters: {where_filter}")
     print(f"Retrieved {len(context_chunks.get('documents', [[]])[0])} chunks")
 
-    cited_context = _build_cited_context(context_chunks)
+    budget = max_context_tokens or _rag_context_budget(endpoint, doc_id)
+    cited_context = _build_cited_context(context_chunks, max_tokens=budget, question=question, question_embedding=question_embedding)
     
     if cited_context:
         # TO CHECK CONTENT QUALITY 1st LOG
         first_chunk = cited_context.split("\n\n")[0] if "\n\n" in cited_context else cited_context
         print(f"First context chunk (preview): {first_chunk[:200]}...")
 
-    if not cited_context:
-        return "I couldn't find any relevant content in your documents to answer that."
+    return context_chunks, cited_context
 
-    prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are a reliable document-grounded Q&A assistant.  
-        Your role is to answer questions using ONLY the provided context chunks and to cite every factual statement with numbered citations.
 
-        ### Rules for Answering
-        1. Use ONLY the provided context chunks—never add outside knowledge.
-        2. Every factual statement must include at least one numbered citation: [1], [2], [3], etc.
-        3. When multiple documents support a statement, use multiple citations: [1][3][5].
-        4. If the documents contain contradictory information, clearly state this with citations.
-        5. If the answer cannot be fully answered from the context, say so explicitly.
-        6. Structure long answers using paragraphs or bullet points.
-        7. All citations must correspond to entries in a **References** section at the end.
+def prepare_rag_prompt(question: str, question_embedding: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None) -> str:
+    """Retrieves context for the question and builds the Q&A prompt, or returns None when nothing relevant was found."""
+    _, cited_context = prepare_rag_context(question, question_embedding, owner_id=owner_id, doc_id=doc_id, n_results=n_results, endpoint=endpoint)
+    if not cited_context:
+        return None
 
-        ### Output Format (STRICT)
-        Your response must follow this exact format:
+    return prompts.render("rag", context=cited_context, question=question)
 
-        Answer:
-        (Paragraphs or bullet points with citations like [1], [2][4], [3]...)
 
-        References:
-        [1] (filename, section: "..." if provided)
-        [2] (filename, section: "...")
-        [3] (...)
+def _extractive_answer(question: str, context_chunks: dict, max_chunks: int = 3, sentences_per_chunk: int = 2) -> dict:
+    """Last-resort answer without an LLM: the sentences of the top chunks that best match the question."""
+    documents = context_chunks.get("documents", [[]])[0][:max_chunks]
+    metadatas = context_chunks.get("metadatas", [[]])[0][:max_chunks]
 
-        ### Reference Formatting Rules (STRICT)
-        - Each reference MUST appear on its own line.
-        - Do NOT merge all references into a single sentence.
-        - The References list must include ALL citation numbers used.
-        - No content is allowed after the References section.
+    lines, references = [], []
+    for number, (text, meta) in enumerate(zip(documents, metadatas), start=1):
+        filename = meta.get("filename") if isinstance(meta, dict) else None
+        for sentence in key_sentences(question, text, sentences_per_chunk):
+            lines.append(f"- \"{sentence}\" [{number}]")
+        references.append(f"[{number}] ({filename or 'unknown'})")
 
-        <|eot_id|><|start_header_id|>user<|end_header_id|>
+    raw_answer = (
+        "Answer:\nA full answer could not be generated in time. These passages from your documents look most relevant:\n"
+        + "\n".join(lines) + "\n\nReferences:\n" + "\n".join(references)
+    )
+    return _parse_answer_with_citations(raw_answer)
 
-        Here are the context chunks (each prefixed with its SOURCE label):
 
-        --- CONTEXT START ---
-        {cited_context}
-        --- CONTEXT END ---
+def get_rag_response(question: str, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, use_cache: bool = True, user_id: int = None) -> dict:
+    question_embedding = query_embeddings.embed_query(question)
 
-        Question: {question}
+    # Repeated or paraphrased questions in the same scope are answered from the semantic cache
+    cache_scope = answer_cache.scope_for(owner_id=owner_id, doc_id=doc_id)
+    cache_version = answer_cache.version(cache_scope)
+    if use_cache:
+        cached_response = answer_cache.lookup(cache_scope, question_embedding)
+        if cached_response:
+            return cached_response
 
-        Please provide a detailed, citation-supported answer following the required structure.
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
+    prompt = prepare_rag_prompt(question, question_embedding, owner_id=owner_id, doc_id=doc_id, n_results=n_results, endpoint=endpoint)
+    if prompt is None:
+        return _parse_answer_with_citations(NO_CONTEXT_ANSWER)
 
-    answer = get_llm_response(prompt)
+    answer = get_llm_response(prompt, template="rag", user_id=user_id if user_id is not None else owner_id)
     
     # Parse the answer to extract citations
     parsed_response = _parse_answer_with_citations(answer)
+    if use_cache:
+        answer_cache.store(cache_scope, cache_version, question_embedding, parsed_response)
     return parsed_response
 
+# <--- ASYNC --->
+async def aget_llm_response(prompt: str, user_id: int = None, use_cache: bool = False, template: str = None, model=None, cache_key: str = None, refresh: bool = False) -> str:
+    """
+    Async counterpart of get_llm_response, bounded by the global and per-user LLM limits.
+    `model` overrides the default LLM router (e.g. the fast fallback model); it is not cached.
+    `cache_key` replaces the prompt-derived key (e.g. map partials keyed by chunk hash), and
+    refresh=True skips the cached copy but stores the new completion.
+    """
+    if use_cache and model is None:
+        cache_key = cache_key or _completion_cache_key(prompt)
+    else:
+        cache_key = None
+    if cache_key and not refresh:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    async with llm_limiter.limit(user_id):
+        response = await (model.ainvoke(prompt) if model is not None else llm.ainvoke(prompt, template=template))
+    prompts.record_usage(template, getattr(response, "usage_metadata", None))
+    content = str(response.content)
+    if cache_key and _from_primary(response):
+        llm_cache.put(cache_key, content)
+    return content
+
+
+async def agenerate_summary(doc_id: int, summary_type: str, user_id: int = None, use_cache: bool = True, refresh: bool = False) -> str:
+    prompt = await run_blocking(prepare_summary_prompt, doc_id, summary_type)
+    if prompt is None:
+        return "Could not retrieve content for summary."
+    return await aget_llm_response(prompt, user_id=user_id, use_cache=use_cache, template="summary", refresh=refresh)
+
+
+async def agenerate_report(doc_id: int, report_type: str, user_id: int = None, use_cache: bool = True, refresh: bool = False) -> str:
+    prompt = await run_blocking(prepare_report_prompt, doc_id, report_type)
+    if prompt is None:
+        return "Could not retrieve content for report generation."
+    return await aget_llm_response(prompt, user_id=user_id, use_cache=use_cache, template="report", refresh=refresh)
+
+
+async def _generate_within_deadline(prompt: str, deadline: degradation.Deadline, tier: str, user_id: int = None, template: str = "rag") -> tuple:
+    """
+    Runs the LLM step of a deadline-bound request. The primary LLM leaves time for the fast model;
+    a timeout or provider failure escalates a tier. Returns (answer or None, tier actually used).
+    """
+    if tier in (degradation.TIER_FULL, degradation.TIER_REDUCED):
+        reserve = degradation.FAST_MODEL_RESERVE_SECONDS if fast_llm is not None else 0.0
+        try:
+            answer = await asyncio.wait_for(
+                aget_llm_response(prompt, user_id=user_id, template=template),
+                timeout=max(deadline.remaining() - reserve, degradation.MIN_LLM_SECONDS)
+            )
+            return answer, tier
+        except (asyncio.TimeoutError, LLMUnavailableError) as e:
+            print(f"Primary LLM missed the deadline ({type(e).__name__}), degrading")
+        tier = degradation.TIER_FAST_MODEL if fast_llm is not None else degradation.TIER_EXTRACTIVE
+
+    if tier == degradation.TIER_FAST_MODEL and deadline.remaining() >= degradation.MIN_LLM_SECONDS:
+        try:
+            answer = await asyncio.wait_for(
+                aget_llm_response(prompt, user_id=user_id, template=template, model=fast_llm),
+                timeout=deadline.remaining()
+            )
+            return answer, tier
+        except Exception as e:
+            # The fast model is called directly (not through the router), so any failure ends here
+            print(f"Fast model missed the deadline ({type(e).__name__}), answering extractively")
+
+    return None, degradation.TIER_EXTRACTIVE
+
+
+_background_tasks = set()
+
+
+async def _update_conversation_summary(conversation: conversations.Conversation, turn: tuple, user_id: int = None):
+    """Folds a turn that left the recent window into the conversation's rolling summary."""
+    question, answer = turn
+    prompt = prompts.render(
+        "conversation_summary", summary=conversation.summary or "(none yet)", question=question,
+        answer=answer[:2 * conversations.RECENT_ANSWER_CHARS]
+    )
+    try:
+        conversation.summary = (await aget_llm_response(prompt, user_id=user_id, template="conversation_summary")).strip()
+    except Exception as e:
+        print(f"Conversation summary update failed ({e}); keeping the question only")
+        conversation.summary = f"{conversation.summary} The user asked: {question}".strip()
+
+
+async def _remember_turn(conversation: conversations.Conversation, question: str, response: dict, context_chunks: dict, user_id: int = None):
+    dropped = await run_blocking(conversations.remember_turn, conversation, question, response["answer"], context_chunks)
+    if dropped:
+        # Summarizing is off the request path; the next question may still see the previous summary
+        task = asyncio.ensure_future(_update_conversation_summary(conversation, dropped, user_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def aget_rag_response(question: str, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, use_cache: bool = True, user_id: int = None, deadline_seconds: float = None, conversation_id: str = None) -> dict:
+    """
+    Async counterpart of get_rag_response: embedding and retrieval run on the model executor.
+    The request runs against a deadline: retrieval depth, reranking and context shrink when the
+    budget runs low or the LLM slots are nearly full, and generation falls back to the fast model
+    or an extractive answer. The response carries the "degradation_tier" it was served at.
+    With a conversation_id, follow-up questions are answered from the previous turn's chunks plus
+    a small incremental retrieval, and the conversation history goes into the prompt.
+    """
+    deadline = degradation.Deadline(settings.CHAT_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    user_id = user_id if user_id is not None else owner_id
+    # Repeated questions skip the executor hop as well as the forward pass
+    question_embedding = query_embeddings.get(question) or await run_blocking(query_embeddings.compute, question)
+    conversation = await run_blocking(conversations.get_or_start, conversation_id, user_id, doc_id) if conversation_id else None
+    history = conversation.history() if conversation else ""
+
+    cache_scope = answer_cache.scope_for(owner_id=owner_id, doc_id=doc_id)
+    cache_version = answer_cache.version(cache_scope)
+    # A follow-up's meaning depends on its conversation, so only opening questions use the answer cache
+    use_cache = use_cache and not history
+    if use_cache:
+        cached_response = answer_cache.lookup(cache_scope, question_embedding)
+        if cached_response:
+            if conversation:
+                await _remember_turn(conversation, question, cached_response, None, user_id)
+            return {**cached_response, "degradation_tier": degradation.TIER_FULL}
+
+    tier = degradation.retrieval_tier(deadline)
+    params = degradation.retrieval_params(tier, n_results, _rag_context_budget(endpoint, doc_id))
+    context_chunks = None
+    if history:
+        context_chunks = await run_blocking(conversations.follow_up_context, conversation, question, question_embedding, params["n_results"])
+    if context_chunks is not None:
+        cited_context = await run_blocking(
+            _build_cited_context, context_chunks, max_tokens=params["max_context_tokens"], question=question, question_embedding=question_embedding
+        )
+    else:
+        context_chunks, cited_context = await run_blocking(
+            prepare_rag_context, question, question_embedding, owner_id=owner_id, doc_id=doc_id, endpoint=endpoint, **params
+        )
+    if not cited_context:
+        parsed_response = _parse_answer_with_citations(NO_CONTEXT_ANSWER)
+        if conversation:
+            await _remember_turn(conversation, question, parsed_response, None, user_id)
+        return {**parsed_response, "degradation_tier": tier}
+
+    tier = degradation.generation_tier(deadline, tier, llm.backends[0].latency_percentile(95, "rag"), fast_llm is not None)
+    answer = None
+    if tier != degradation.TIER_EXTRACTIVE:
+        if history:
+            template, prompt = "rag_conversation", prompts.render("rag_conversation", context=cited_context, history=history, question=question)
+        else:
+            template, prompt = "rag", prompts.render("rag", context=cited_context, question=question)
+        answer, tier = await _generate_within_deadline(prompt, deadline, tier, user_id, template)
+
+    if answer is None:
+        parsed_response = _extractive_answer(question, context_chunks)
+    else:
+        parsed_response = _parse_answer_with_citations(answer)
+        # Only full-quality answers are worth serving again from the cache
+        if use_cache and tier == degradation.TIER_FULL:
+            answer_cache.store(cache_scope, cache_version, question_embedding, parsed_response)
+
+    if conversation:
+        await _remember_turn(conversation, question, parsed_response, context_chunks, user_id)
+    return {**parsed_response, "degradation_tier": tier}
+
+
+def prepare_rag_contexts(questions: list, question_embeddings: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, allow_rerank: bool = True, max_context_tokens: int = None) -> list:
+    """prepare_rag_context for a batch of questions in one scope; returns a (chunks, cited context) pair per question."""
+    batch = retrieve_context_many(questions, question_embeddings, owner_id=owner_id, doc_id=doc_id, n_results=n_results, endpoint=endpoint, allow_rerank=allow_rerank)
+    budget = max_context_tokens or _rag_context_budget(endpoint, doc_id)
+    return [
+        (context_chunks, _build_cited_context(context_chunks, max_tokens=budget, question=question, question_embedding=embedding))
+        for question, embedding, context_chunks in zip(questions, question_embeddings, batch)
+    ]
+
+
+async def abatch_rag_responses(questions: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, user_id: int = None):
+    """
+    Answers a checklist of questions against one scope. All questions are embedded in one batch and
+    retrieved with one dense multi-query; the retrieval tier is picked once for the whole batch.
+    The LLM calls then run concurrently, at most MAX_CONCURRENT_LLM_CALLS_PER_USER at a time, and
+    each question's CHAT_DEADLINE_SECONDS deadline starts when it gets its turn, so questions
+    queued behind the rest of the checklist are not degraded for waiting.
+    Yields (index, response) pairs in completion order.
+    """
+    # Only decides the retrieval tier; generation gets a deadline per question
+    batch_deadline = degradation.Deadline(settings.CHAT_DEADLINE_SECONDS)
+    user_id = user_id if user_id is not None else owner_id
+    embeddings = await run_blocking(query_embeddings.embed_queries, questions)
+    cache_scope = answer_cache.scope_for(owner_id=owner_id, doc_id=doc_id)
+    cache_version = answer_cache.version(cache_scope)
+
+    responses, pending = {}, []
+    for index, embedding in enumerate(embeddings):
+        cached_response = answer_cache.lookup(cache_scope, embedding)
+        if cached_response:
+            responses[index] = {**cached_response, "degradation_tier": degradation.TIER_FULL}
+        else:
+            pending.append(index)
+    for index, response in responses.items():
+        yield index, response
+    if not pending:
+        return
+
+    retrieval_tier = degradation.retrieval_tier(batch_deadline)
+    params = degradation.retrieval_params(retrieval_tier, n_results, _rag_context_budget(endpoint, doc_id))
+    contexts = await run_blocking(
+        prepare_rag_contexts, [questions[i] for i in pending], [embeddings[i] for i in pending],
+        owner_id=owner_id, doc_id=doc_id, endpoint=endpoint, **params
+    )
+    # The batch's own share of the user's LLM slots; waiting for one does not count against a deadline
+    turns = asyncio.Semaphore(settings.MAX_CONCURRENT_LLM_CALLS_PER_USER)
+
+    async def answer(index: int, context_chunks: dict, cited_context: str) -> tuple:
+        question = questions[index]
+        if not cited_context:
+            return index, {**_parse_answer_with_citations(NO_CONTEXT_ANSWER), "degradation_tier": retrieval_tier}
+
+        async with turns:
+            deadline = degradation.Deadline(settings.CHAT_DEADLINE_SECONDS)
+            tier = degradation.generation_tier(deadline, retrieval_tier, llm.backends[0].latency_percentile(95, "rag"), fast_llm is not None)
+            generated = None
+            if tier != degradation.TIER_EXTRACTIVE:
+                prompt = prompts.render("rag", context=cited_context, question=question)
+                generated, tier = await _generate_within_deadline(prompt, deadline, tier, user_id, template="rag")
+        if generated is None:
+            return index, {**_extractive_answer(question, context_chunks), "degradation_tier": tier}
+        parsed_response = _parse_answer_with_citations(generated)
+        if tier == degradation.TIER_FULL:
+            answer_cache.store(cache_scope, cache_version, embeddings[index], parsed_response)
+        return index, {**parsed_response, "degradation_tier": tier}
+
+    tasks = [asyncio.ensure_future(answer(index, *context)) for index, context in zip(pending, contexts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client went away: answers nobody will read are not worth their LLM calls
+        for task in tasks:
+            task.cancel()
+
+
+# <--- STREAMING --->
+def stream_llm_response(prompt: str, template: str = None, answered: dict = None, user_id: int = None):
+    """
+    Yields the completion text piece by piece as the model produces it. `answered`, when given,
+    receives the streaming provider's name under "provider". The LLM slot is held until the
+    stream ends or the client goes away.
+    """
+    with llm_limiter.limit_sync(user_id):
+        for chunk in llm.stream(prompt, template=template):
+            if answered is not None:
+                answered["provider"] = answered_by(chunk)
+            # Usage arrives on the final chunk when the provider reports it
+            prompts.record_usage(template, getattr(chunk, "usage_metadata", None))
+            text = chunk if isinstance(chunk, str) else str(chunk.content)
+            if text:
+                yield text
+
+
+class StreamingCitationParser:
+    """
+    Parses citations out of a streamed answer incrementally: once the References
+    section has started, each reference line is parsed as soon as its newline arrives.
+    """
+    def __init__(self):
+        self.text = ""
+        self._parsed_upto = None
+
+    def feed(self, token: str) -> list:
+        import re
+
+        search_from = max(0, len(self.text) - len("References:"))
+        self.text += token
+        if self._parsed_upto is None:
+            header = re.compile(r'References?:', re.IGNORECASE).search(self.text, search_from)
+            if not header:
+                return []
+            self._parsed_upto = header.end()
+
+        complete_upto = self.text.rfind("\n") + 1
+        if complete_upto <= self._parsed_upto:
+            return []
+        citations = _parse_citations(self.text[self._parsed_upto:complete_upto])
+        self._parsed_upto = complete_upto
+        return citations
+
+    def finish(self) -> list:
+        if self._parsed_upto is None:
+            return []
+        citations = _parse_citations(self.text[self._parsed_upto:])
+        self._parsed_upto = len(self.text)
+        return citations
+
+
+def _stream_generation(prompt: str, parser: StreamingCitationParser, template: str = None, answered: dict = None, user_id: int = None):
+    """Yields token and citation events for a prompt; the full text accumulates in parser.text."""
+    for token in stream_llm_response(prompt, template, answered, user_id):
+        yield {"type": "token", "text": token}
+        for citation in parser.feed(token):
+            yield {"type": "citation", "citation": citation}
+    for citation in parser.finish():
+        yield {"type": "citation", "citation": citation}
+
+
+def _stream_static(text: str, citations: list = ()):
+    yield {"type": "token", "text": text}
+    for citation in citations:
+        yield {"type": "citation", "citation": citation}
+
+
+def stream_rag_response(question: str, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, use_cache: bool = True, user_id: int = None):
+    """
+    Streaming counterpart of get_rag_response. Yields {"type": "token"}, {"type": "citation"} and,
+    on success, a final {"type": "done", "response": ...} event (or {"type": "error"}).
+    """
+    question_embedding = query_embeddings.embed_query(question)
+
+    cache_scope = answer_cache.scope_for(owner_id=owner_id, doc_id=doc_id)
+    cache_version = answer_cache.version(cache_scope)
+    if use_cache:
+        cached_response = answer_cache.lookup(cache_scope, question_embedding)
+        if cached_response:
+            yield from _stream_static(cached_response["answer"], cached_response["citations"])
+            yield {"type": "done", "response": cached_response}
+            return
+
+    prompt = prepare_rag_prompt(question, question_embedding, owner_id=owner_id, doc_id=doc_id, n_results=n_results, endpoint=endpoint)
+    if prompt is None:
+        parsed_response = _parse_answer_with_citations(NO_CONTEXT_ANSWER)
+        yield from _stream_static(parsed_response["answer"])
+        yield {"type": "done", "response": parsed_response}
+        return
+
+    parser = StreamingCitationParser()
+    try:
+        yield from _stream_generation(prompt, parser, template="rag", user_id=user_id if user_id is not None else owner_id)
+    except Exception as e:
+        yield {"type": "error", "detail": f"Error while generating response: {str(e)}"}
+        return
+
+    parsed_response = _parse_answer_with_citations(parser.text)
+    if use_cache:
+        answer_cache.store(cache_scope, cache_version, question_embedding, parsed_response)
+    yield {"type": "done", "response": parsed_response}
+
+
+def _stream_document_generation(prompt: str, empty_message: str, use_cache: bool = True, template: str = None, user_id: int = None, refresh: bool = False):
+    if prompt is None:
+        yield {"type": "error", "detail": empty_message}
+        return
+
+    cache_key = _completion_cache_key(prompt) if use_cache else None
+    cached = llm_cache.get(cache_key) if cache_key and not refresh else None
+    if cached is not None:
+        parsed = _parse_answer_with_citations(cached)
+        yield from _stream_static(cached, parsed["citations"])
+        yield {"type": "done", "text": cached}
+        return
+
+    parser = StreamingCitationParser()
+    answered = {}
+    try:
+        yield from _stream_generation(prompt, parser, template, answered, user_id)
+    except Exception as e:
+        yield {"type": "error", "detail": f"Error while generating response: {str(e)}"}
+        return
+    if cache_key and answered.get("provider") == llm.primary:
+        llm_cache.put(cache_key, parser.text)
+    yield {"type": "done", "text": parser.text}
+
+
+def stream_summary(doc_id: int, summary_type: str, use_cache: bool = True, prompt: str = None, user_id: int = None, refresh: bool = False):
+    """
+    Streaming counterpart of generate_summary; the final "done" event carries the full text.
+    A precomputed prompt (e.g. from map-reduce) can be passed instead of retrieving context.
+    """
+    prompt = prompt if prompt is not None else prepare_summary_prompt(doc_id, summary_type)
+    yield from _stream_document_generation(prompt, "Could not retrieve content for summary.", use_cache, template="summary", user_id=user_id, refresh=refresh)
+
+
+def stream_report(doc_id: int, report_type: str, use_cache: bool = True, prompt: str = None, user_id: int = None, refresh: bool = False):
+    """Streaming counterpart of generate_report; the final "done" event carries the full text."""
+    prompt = prompt if prompt is not None else prepare_report_prompt(doc_id, report_type)
+    yield from _stream_document_generation(prompt, "Could not retrieve content for report generation.", use_cache, template="report", user_id=user_id, refresh=refresh)
+
 def transcribe_video(video_path: str) -> str:
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video file not found at: {video_path}")
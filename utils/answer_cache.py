@@ -0,0 +1,132 @@
+import time
+import sqlite3
+import threading
+import numpy as np
+
+# A new question reuses a stored answer when its embedding is this close to a cached question
+SIMILARITY_THRESHOLD = 0.95
+MAX_ENTRIES_PER_SCOPE = 256
+ENTRY_TTL_SECONDS = 24 * 60 * 60
+# Corpus versions are shared by every worker process: an invalidation in one must reach the
+# answers cached by all of them. The "*" row is bumped by clear() and counts for every scope.
+ANSWER_CACHE_VERSIONS_PATH = "./answer_cache_versions.db"
+ALL_SCOPES = "*"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS corpus_versions (
+    scope TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+)
+"""
+
+_lock = threading.Lock()
+_connection = None
+_entries = {}           # (scope, version) -> list of entries, oldest first
+stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def scope_for(owner_id: int = None, doc_id: int = None) -> tuple:
+    """Single-document chats and library chats are cached separately."""
+    if doc_id is not None:
+        return ("doc", doc_id)
+    return ("owner", owner_id)
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(ANSWER_CACHE_VERSIONS_PATH, timeout=30, check_same_thread=False)
+        _connection.execute(_SCHEMA)
+        _connection.commit()
+    return _connection
+
+
+def _scope_key(scope: tuple) -> str:
+    return f"{scope[0]}:{scope[1]}"
+
+
+def _current_version(scope: tuple) -> int:
+    # Both counters only grow, so their sum changes whenever either one is bumped
+    row = _get_connection().execute(
+        "SELECT COALESCE(SUM(version), 0) FROM corpus_versions WHERE scope IN (?, ?)", (_scope_key(scope), ALL_SCOPES)
+    ).fetchone()
+    return row[0]
+
+
+def _bump(scope_keys: list):
+    conn = _get_connection()
+    conn.executemany(
+        "INSERT INTO corpus_versions (scope, version) VALUES (?, 1) ON CONFLICT(scope) DO UPDATE SET version = version + 1",
+        [(key,) for key in scope_keys],
+    )
+    conn.commit()
+
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def version(scope: tuple) -> int:
+    """
+    The scope's corpus version. Callers take it before retrieval and pass it to store(), so an
+    answer built from a corpus that was invalidated mid-request is never cached.
+    """
+    with _lock:
+        return _current_version(scope)
+
+
+def lookup(scope: tuple, question_embedding) -> dict:
+    """Returns the stored response for the most similar cached question in scope, or None."""
+    query = _unit(question_embedding)
+    now = time.time()
+    with _lock:
+        key = (scope, _current_version(scope))
+        # Entries of older versions were invalidated, possibly by another worker
+        for stale in [stale for stale in _entries if stale[0] == scope and stale != key]:
+            del _entries[stale]
+        entries = [e for e in _entries.get(key, []) if now - e["created_at"] < ENTRY_TTL_SECONDS]
+        _entries[key] = entries
+        if entries:
+            similarities = np.stack([e["embedding"] for e in entries]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= SIMILARITY_THRESHOLD:
+                stats["hits"] += 1
+                return dict(entries[best]["response"], cache_hit=True)
+        stats["misses"] += 1
+    return None
+
+
+def store(scope: tuple, corpus_version: int, question_embedding, response: dict):
+    with _lock:
+        if corpus_version != _current_version(scope):
+            return
+        key = (scope, corpus_version)
+        entries = _entries.setdefault(key, [])
+        entries.append({"embedding": _unit(question_embedding), "response": response, "created_at": time.time()})
+        del entries[:-MAX_ENTRIES_PER_SCOPE]
+
+
+def invalidate(owner_id: int = None, doc_id: int = None):
+    """
+    Called whenever a document is added, re-ingested or deleted: bumps the shared corpus version
+    of the document scope and its owner's library scope and drops their cached answers. Other
+    workers drop theirs on their next lookup in those scopes.
+    """
+    scopes = [scope_for(owner_id=owner_id)]
+    if doc_id is not None:
+        scopes.append(scope_for(doc_id=doc_id))
+    with _lock:
+        _bump([_scope_key(scope) for scope in scopes])
+        for scope in scopes:
+            for key in [key for key in _entries if key[0] == scope]:
+                del _entries[key]
+        stats["invalidations"] += 1
+
+
+def clear():
+    """Drops every cached answer (the vector index was switched to another generation)."""
+    with _lock:
+        _bump([ALL_SCOPES])
+        _entries.clear()
+        stats["invalidations"] += 1
@@ -0,0 +1,136 @@
+import bisect
+import hashlib
+import threading
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from chromadb.errors import NotFoundError
+
+# Points per server on the hash ring; more points spread partitions more evenly
+VIRTUAL_NODES = 128
+LOCAL_NODE = "local"
+
+
+def _ring_hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hashing: adding or removing a server only moves the partitions next to its points."""
+    def __init__(self, nodes: list, virtual_nodes: int = VIRTUAL_NODES):
+        self._points = sorted((_ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in self._points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class ChromaCluster:
+    """
+    Chroma clients by partition. With no servers configured everything lives in the local
+    PersistentClient; otherwise each partition (collection) is placed on one of the
+    `host:port` servers by consistent hashing. One HttpClient per server is created lazily and
+    reused by every request in the process, so its HTTP connections are kept alive.
+    """
+    def __init__(self, servers: str, path: str):
+        self.servers = [server.strip() for server in servers.split(",") if server.strip()]
+        self.path = path
+        self.ring = HashRing(self.servers or [LOCAL_NODE])
+        self._clients = {}
+        self._batch_sizes = {}
+        self._lock = threading.Lock()
+
+    def _client(self, node: str):
+        with self._lock:
+            client = self._clients.get(node)
+            if client is None:
+                if node == LOCAL_NODE:
+                    client = chromadb.PersistentClient(path=self.path)
+                else:
+                    host, _, port = node.rpartition(":")
+                    client = chromadb.HttpClient(host=host, port=int(port), settings=ChromaSettings(anonymized_telemetry=False))
+                self._clients[node] = client
+            return client
+
+    def node_for(self, partition: str) -> str:
+        return self.ring.node_for(partition)
+
+    def client_for(self, partition: str):
+        return self._client(self.node_for(partition))
+
+    def _has_collection(self, node: str, name: str) -> bool:
+        try:
+            self._client(node).get_collection(name)
+            return True
+        except NotFoundError:
+            return False
+
+    def locate(self, partition: str) -> str:
+        """
+        The node serving a partition: its place on the ring, unless a rebalance has not copied it
+        there yet and another configured server still holds it (then that one, until the move is done).
+        """
+        node = self.node_for(partition)
+        if len(self.servers) < 2 or self._has_collection(node, partition):
+            return node
+        return next((other for other in self.servers if other != node and self._has_collection(other, partition)), node)
+
+    def collection(self, partition: str):
+        return self._client(self.locate(partition)).get_or_create_collection(name=partition)
+
+    def clients(self) -> list:
+        return [self._client(node) for node in (self.servers or [LOCAL_NODE])]
+
+    def max_batch_size(self, partition: str) -> int:
+        """Largest add/upsert the partition's server accepts in one call."""
+        node = self.node_for(partition)
+        if node not in self._batch_sizes:
+            self._batch_sizes[node] = self._client(node).get_max_batch_size()
+        return self._batch_sizes[node]
+
+    def rebalance(self, servers: list = None, delete_source: bool = True, batch_size: int = 500):
+        """
+        Copies every collection to the server the ring over `servers` (default: this cluster's)
+        places it on, then deletes the source unless `delete_source` is off. Safe to re-run:
+        copies are upserts. Change servers in this order (README):
+          1. rebalance(new servers, delete_source=False) while the workers still run the old list,
+          2. restart the workers with the new CHROMA_SERVERS,
+          3. rebalance() under the new list, which copies what the old workers wrote meanwhile and
+             deletes the sources.
+        Workers restarted before a partition was copied keep reading it where it still is (locate()).
+        """
+        target_servers = self.servers if servers is None else servers
+        ring = HashRing(target_servers or [LOCAL_NODE])
+        moved = 0
+        for node in dict.fromkeys((self.servers or [LOCAL_NODE]) + list(target_servers)):
+            client = self._client(node)
+            for entry in client.list_collections():
+                name = getattr(entry, "name", entry)
+                target_node = ring.node_for(name)
+                if target_node == node:
+                    continue
+                source = client.get_collection(name)
+                target = self._client(target_node).get_or_create_collection(name=name)
+                offset = 0
+                while True:
+                    batch = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+                    if not batch["ids"]:
+                        break
+                    target.upsert(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"], metadatas=batch["metadatas"])
+                    offset += len(batch["ids"])
+                if delete_source:
+                    client.delete_collection(name)
+                moved += 1
+                print(f"{'Moved' if delete_source else 'Copied'} collection '{name}' ({offset} chunks) from {node} to {target_node}")
+        print(f"Rebalance done: {moved} collection(s) {'moved' if delete_source else 'copied; restart the workers, then run it again without --servers'}.")
+
+if __name__ == "__main__":
+    # python -m utils.chroma_cluster --servers host:port,...  (before restarting the workers: copy to the new placement)
+    # python -m utils.chroma_cluster                          (after restarting them with the new CHROMA_SERVERS: finish the move)
+    import sys
+    from utils.shared_models import chroma_cluster
+    if "--servers" in sys.argv:
+        servers = sys.argv[sys.argv.index("--servers") + 1]
+        chroma_cluster.rebalance([server.strip() for server in servers.split(",") if server.strip()], delete_source=False)
+    else:
+        chroma_cluster.rebalance()
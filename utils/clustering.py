@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def _squared_distances(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return (
+        (vectors ** 2).sum(axis=1)[:, None]
+        - 2 * vectors @ centroids.T
+        + (centroids ** 2).sum(axis=1)[None, :]
+    )
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 25, seed: int = 0) -> tuple:
+    """Plain NumPy k-means with k-means++ seeding. Returns (centroids, labels)."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+
+    centroids = vectors[[rng.integers(n)]]
+    for _ in range(1, k):
+        distances = np.clip(_squared_distances(vectors, centroids).min(axis=1), 0, None)
+        total = distances.sum()
+        next_index = rng.choice(n, p=distances / total) if total > 0 else rng.integers(n)
+        centroids = np.vstack([centroids, vectors[next_index]])
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = _squared_distances(vectors, centroids).argmin(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = vectors[labels == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return centroids, labels
+
+
+def representative_indices(embeddings, k: int) -> list:
+    """
+    Clusters chunk embeddings and returns, per cluster, the chunk closest to the centroid
+    (a medoid-like representative), ordered by cluster size so the best-covering chunks come first.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    k = min(k, len(vectors))
+
+    centroids, labels = kmeans(vectors, k)
+
+    representatives = []
+    for cluster in range(k):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        closest = members[np.argmin(_squared_distances(vectors[members], centroids[[cluster]])[:, 0])]
+        representatives.append((len(members), int(closest)))
+
+    representatives.sort(key=lambda item: (-item[0], item[1]))
+    return [index for _, index in representatives]
@@ -0,0 +1,102 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sources.config import settings
+
+# CPU-bound model work (embedding, retrieval, TTS) runs here instead of Starlette's shared threadpool
+model_executor = ThreadPoolExecutor(max_workers=settings.MODEL_EXECUTOR_WORKERS, thread_name_prefix="model")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the model executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(model_executor, functools.partial(func, *args, **kwargs))
+
+
+class LLMConcurrencyLimiter:
+    """
+    Caps in-flight LLM calls with one global semaphore plus one semaphore per user, so a
+    single user cannot take every slot. Waiters are parked on the event loop, not on threads;
+    calls made from worker threads take the same slots through limit_sync().
+    """
+    def __init__(self, max_in_flight: int, max_per_user: int):
+        self.max_per_user = max_per_user
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._per_user = {}
+        self._waiting = {}
+        self._loop = None
+        self.in_flight = 0
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """The event loop the semaphores live on (set at startup; limit() records it too)."""
+        self._loop = loop
+
+    async def _acquire(self, user_id: int = None):
+        user_semaphore = None
+        if user_id is not None:
+            user_semaphore = self._per_user.setdefault(user_id, asyncio.Semaphore(self.max_per_user))
+            self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            if user_semaphore is not None:
+                await user_semaphore.acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                if user_semaphore is not None:
+                    user_semaphore.release()
+                raise
+        except BaseException:
+            self._forget(user_id)
+            raise
+        self.in_flight += 1
+
+    def _release(self, user_id: int = None):
+        self.in_flight -= 1
+        self._global.release()
+        if user_id is not None:
+            self._per_user[user_id].release()
+        self._forget(user_id)
+
+    def _forget(self, user_id: int = None):
+        if user_id is not None:
+            self._waiting[user_id] -= 1
+            # Drop idle per-user semaphores so the dict does not grow with every user ever seen
+            if self._waiting[user_id] == 0:
+                del self._waiting[user_id]
+                self._per_user.pop(user_id, None)
+
+    @asynccontextmanager
+    async def limit(self, user_id: int = None):
+        self._loop = asyncio.get_running_loop()
+        await self._acquire(user_id)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    @contextmanager
+    def limit_sync(self, user_id: int = None):
+        """
+        Blocking counterpart of limit() for LLM calls made on worker threads (streaming responses,
+        background ingestion): the slot is taken and given back on the event loop, so sync and
+        async calls share one budget. Without a running loop nothing else competes for the slots.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            yield
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            raise RuntimeError("limit_sync() would block the event loop; use limit() there")
+        asyncio.run_coroutine_threadsafe(self._acquire(user_id), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self._release, user_id)
+
+
+llm_limiter = LLMConcurrencyLimiter(settings.MAX_CONCURRENT_LLM_CALLS, settings.MAX_CONCURRENT_LLM_CALLS_PER_USER)
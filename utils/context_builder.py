@@ -0,0 +1,147 @@
+import re
+import numpy as np
+from utils.shared_models import embedding_model
+
+# Prompt context budgets (tokens of retrieved content, excluding the fixed instructions)
+CONTEXT_TOKEN_BUDGETS = {
+    "document_chat": 6000,
+    "library_chat": 6000,
+    "summary": 12000,
+    "report": 14000,
+}
+# Sentences embedded per compression: only the best matches by word overlap with the question are
+# re-scored with the embedding model (a CPU forward pass each), the rest keep their lexical rank
+MAX_SENTENCES_TO_EMBED = 64
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+_WORD = re.compile(r'\w+')
+
+
+def count_tokens(texts: list) -> list:
+    """Token counts from the embedding model's tokenizer (a close proxy for the LLM's)."""
+    if not texts:
+        return []
+    encoded = embedding_model.tokenizer(texts, add_special_tokens=False)["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def _allocate(sizes: list, budget: int) -> list:
+    """Water-filling: chunks under their fair share keep everything, the rest split what is left."""
+    allowances = [0] * len(sizes)
+    remaining_budget = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        fair_share = remaining_budget // (len(sizes) - position)
+        allowances[i] = min(sizes[i], fair_share)
+        remaining_budget -= allowances[i]
+    return allowances
+
+
+def _lexical_overlap(question: str, sentence: str) -> float:
+    question_words = set(_WORD.findall(question.lower()))
+    sentence_words = set(_WORD.findall(sentence.lower()))
+    return len(question_words & sentence_words) / (len(sentence_words) ** 0.5 + 1)
+
+
+def _sentence_scores(sentences: list, question: str = None, question_embedding=None) -> np.ndarray:
+    """
+    Query-focused: sentences are ranked by word overlap with the question, and the top
+    MAX_SENTENCES_TO_EMBED of them are re-scored by cosine similarity to the question vector
+    (always above the lexically ranked rest). Without a question (summaries/reports) earlier
+    sentences are preferred (lead bias).
+    """
+    if question_embedding is None:
+        return -np.arange(len(sentences), dtype=np.float32)
+
+    order = sorted(range(len(sentences)), key=lambda i: _lexical_overlap(question or "", sentences[i]), reverse=True)
+    scores = np.empty(len(sentences), dtype=np.float32)
+    # Below any cosine similarity (>= -1), in lexical order
+    scores[order] = -2.0 - np.arange(len(sentences), dtype=np.float32)
+
+    candidates = order[:MAX_SENTENCES_TO_EMBED]
+    query = np.asarray(question_embedding, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    vectors = embedding_model.encode([sentences[i] for i in candidates], normalize_embeddings=True, batch_size=64)
+    scores[candidates] = np.asarray(vectors, dtype=np.float32) @ query
+    return scores
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest word prefix of `text` within `max_tokens`, found by binary search over the word count."""
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens([" ".join(words[:middle])])[0] <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+
+def _select_sentences(sentences: list, token_counts: list, scores: np.ndarray, allowance: int) -> str:
+    ranked = [int(i) for i in np.argsort(-scores, kind="stable") if np.isfinite(scores[i])]
+    chosen, used = [], 0
+    for i in ranked:
+        if used + token_counts[i] <= allowance:
+            chosen.append(i)
+            used += token_counts[i]
+    chosen.sort()
+
+    # Tables, lists and transcripts split into few long "sentences" that may all exceed the
+    # allowance: keep the start of the best one rather than leaving the chunk empty
+    if not chosen and ranked and allowance > 0:
+        truncated = _truncate_to_tokens(sentences[ranked[0]], allowance)
+        return f"{truncated} [...]" if truncated else ""
+
+    # Keep document order and mark the gaps left by dropped sentences
+    pieces = []
+    for position, i in enumerate(chosen):
+        if position > 0 and i != chosen[position - 1] + 1:
+            pieces.append("[...]")
+        pieces.append(sentences[i])
+    return " ".join(pieces)
+
+
+def compress_to_budget(labelled_chunks: list, max_tokens: int, question: str = None, question_embedding=None) -> list:
+    """
+    Fits [(source_label, text), ...] into `max_tokens`. Chunks that do not fit their share keep
+    only their highest-scoring sentences (see _sentence_scores); source labels are always kept so
+    citations still resolve. Returns the list in the same shape and order.
+    """
+    if not labelled_chunks:
+        return labelled_chunks
+
+    label_tokens = count_tokens([label for label, _ in labelled_chunks])
+    text_tokens = count_tokens([text for _, text in labelled_chunks])
+    total = sum(label_tokens) + sum(text_tokens)
+    if total <= max_tokens:
+        return labelled_chunks
+
+    allowances = _allocate(text_tokens, max(max_tokens - sum(label_tokens), 0))
+    over_budget = [i for i, (size, allowance) in enumerate(zip(text_tokens, allowances)) if size > allowance]
+
+    # Split and score the sentences of every over-budget chunk in one batch
+    split = {i: [s for s in _SENTENCE_SPLIT.split(labelled_chunks[i][1]) if s.strip()] for i in over_budget}
+    all_sentences = [sentence for i in over_budget for sentence in split[i]]
+    all_counts = count_tokens(all_sentences)
+    all_scores = _sentence_scores(all_sentences, question, question_embedding)
+
+    compressed = list(labelled_chunks)
+    offset = 0
+    for i in over_budget:
+        n = len(split[i])
+        label = labelled_chunks[i][0]
+        compressed[i] = (label, _select_sentences(split[i], all_counts[offset:offset + n], all_scores[offset:offset + n], allowances[i]))
+        offset += n
+    return compressed
+
+
+def key_sentences(question: str, text: str, max_sentences: int) -> list:
+    """
+    The sentences of `text` sharing the most words with the question, in document order.
+    Lexical only, so it stays cheap enough for the extractive fallback at the end of a deadline.
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip()]
+    ranked = sorted(range(len(sentences)), key=lambda i: _lexical_overlap(question, sentences[i]), reverse=True)
+    return [sentences[i] for i in sorted(ranked[:max_sentences])]
@@ -0,0 +1,153 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+from sources.database import SessionLocal
+from sources import models
+from utils.retrieval import hybrid_search, fetch_embeddings, rerank_pool
+
+# Conversations are kept in process memory and dropped after this long without a message
+CONVERSATION_TTL_SECONDS = 30 * 60
+MAX_CONVERSATIONS = 1024
+# Turns quoted verbatim in the prompt (answers clipped); older ones live on in the rolling summary
+RECENT_TURNS = 2
+RECENT_ANSWER_CHARS = 600
+# A question counts as a follow-up when it is at least this similar (cosine) to a chunk of the
+# previous turn's pool; it is then answered from that pool plus this many freshly retrieved chunks.
+# bge-m3 puts unrelated questions and passages of the same library at about 0.3-0.55, so the bar
+# sits above that band
+FOLLOW_UP_MIN_RELEVANCE = 0.6
+FOLLOW_UP_NEW_RESULTS = 3
+# ... unless a freshly retrieved chunk beats the pool's best by this much: the question moved on to
+# material the previous turn never touched, so it gets a full retrieval
+FOLLOW_UP_TOPIC_SHIFT_MARGIN = 0.1
+
+_lock = threading.Lock()
+_conversations = OrderedDict()
+stats = {"started": 0, "resumed": 0, "follow_ups": 0, "full_retrievals": 0, "expired": 0}
+
+
+class Conversation:
+    """One chat session: recent turns, a rolling summary of older ones and the last turn's retrieved chunks."""
+    def __init__(self, conversation_id: str, owner_id: int, doc_id: int = None):
+        self.id = conversation_id
+        self.owner_id = owner_id
+        self.doc_id = doc_id
+        self.summary = ""
+        self.turns = deque()
+        self.pool = None            # Chroma-shaped chunks the previous answer was grounded in
+        self.pool_embeddings = {}   # their embeddings by chunk id
+        self.updated_at = time.monotonic()
+
+    def history(self) -> str:
+        """Prompt block: the rolling summary followed by the most recent turns, or "" for a new conversation."""
+        parts = [f"Summary of earlier turns: {self.summary}"] if self.summary else []
+        for question, answer in self.turns:
+            clipped = answer if len(answer) <= RECENT_ANSWER_CHARS else answer[:RECENT_ANSWER_CHARS] + "..."
+            parts.append(f"User: {question}\nAssistant: {clipped}")
+        return "\n\n".join(parts)
+
+
+def new_conversation_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _load_recent_turns(conversation: Conversation):
+    # A conversation started in another worker, or expired here, keeps its latest turns from the chat history
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(models.ChatHistory)
+            .filter(models.ChatHistory.conversation_id == conversation.id)
+            .filter(models.ChatHistory.user_id == conversation.owner_id)
+            .filter(models.ChatHistory.document_id == conversation.doc_id)
+            .order_by(models.ChatHistory.id.desc())
+            .limit(RECENT_TURNS)
+            .all()
+        )
+        for row in reversed(rows):
+            conversation.turns.append((row.question, row.answer))
+    finally:
+        db.close()
+
+
+def get_or_start(conversation_id: str, owner_id: int, doc_id: int = None) -> Conversation:
+    """The live conversation for this id and scope, or a new one (resumed from the chat history when it has turns)."""
+    now = time.monotonic()
+    with _lock:
+        for key in [key for key, conversation in _conversations.items() if now - conversation.updated_at > CONVERSATION_TTL_SECONDS]:
+            del _conversations[key]
+            stats["expired"] += 1
+        # Keyed by scope too: an id sent by another user or for another document never reaches this one
+        key = (conversation_id, owner_id, doc_id)
+        conversation = _conversations.get(key)
+        if conversation is not None:
+            _conversations.move_to_end(key)
+            conversation.updated_at = now
+            return conversation
+
+    conversation = Conversation(conversation_id, owner_id, doc_id)
+    _load_recent_turns(conversation)
+    stats["resumed" if conversation.turns else "started"] += 1
+    with _lock:
+        _conversations[key] = conversation
+        while len(_conversations) > MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+    return conversation
+
+
+def _best_relevance(question_embedding: list, embeddings) -> float:
+    """Highest cosine similarity between the question and any of the chunk embeddings."""
+    query = np.asarray(question_embedding, dtype=np.float32)
+    vectors = np.stack(list(embeddings))
+    relevance = (vectors @ query) / np.clip(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12, None)
+    return float(relevance.max())
+
+
+def follow_up_context(conversation: Conversation, question: str, question_embedding: list, n_results: int) -> dict:
+    """
+    Chunks for a follow-up question: the previous turn's pool plus a small incremental retrieval,
+    re-ranked together. Returns None when the question does not relate to the pool (a new topic),
+    so the caller runs a full retrieval instead.
+    """
+    if not conversation.pool or not conversation.pool_embeddings:
+        return None
+    pool_relevance = _best_relevance(question_embedding, conversation.pool_embeddings.values())
+    if pool_relevance < FOLLOW_UP_MIN_RELEVANCE:
+        stats["full_retrievals"] += 1
+        return None
+
+    fresh = hybrid_search(question, question_embedding, owner_id=conversation.owner_id if conversation.doc_id is None else None,
+                          doc_id=conversation.doc_id, n_results=FOLLOW_UP_NEW_RESULTS)
+    new_ids = [chunk_id for chunk_id in fresh["ids"][0] if chunk_id not in conversation.pool_embeddings]
+    new_embeddings = fetch_embeddings(new_ids) if new_ids else {}
+    if new_embeddings and _best_relevance(question_embedding, new_embeddings.values()) > pool_relevance + FOLLOW_UP_TOPIC_SHIFT_MARGIN:
+        stats["full_retrievals"] += 1
+        return None
+
+    candidates = {field: [list(conversation.pool[field][0])] for field in ("ids", "documents", "metadatas")}
+    for chunk_id, text, meta in zip(fresh["ids"][0], fresh["documents"][0], fresh["metadatas"][0]):
+        if chunk_id not in conversation.pool_embeddings:
+            candidates["ids"][0].append(chunk_id)
+            candidates["documents"][0].append(text)
+            candidates["metadatas"][0].append(meta)
+    embeddings = {**conversation.pool_embeddings, **new_embeddings}
+
+    stats["follow_ups"] += 1
+    return rerank_pool(question, question_embedding, candidates, embeddings, n_results)
+
+
+def remember_turn(conversation: Conversation, question: str, answer: str, context_chunks: dict) -> tuple:
+    """
+    Records a finished turn and keeps its chunks (with embeddings) as the pool for the next question.
+    Returns the turn that dropped out of the recent window, for the rolling summary, or None.
+    """
+    ids = context_chunks.get("ids", [[]])[0] if context_chunks else []
+    if ids:
+        embeddings = fetch_embeddings(ids)
+        conversation.pool = {field: [list(context_chunks[field][0])] for field in ("ids", "documents", "metadatas")}
+        conversation.pool_embeddings = embeddings
+    conversation.turns.append((question, answer))
+    conversation.updated_at = time.monotonic()
+    return conversation.turns.popleft() if len(conversation.turns) > RECENT_TURNS else None
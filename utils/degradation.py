@@ -0,0 +1,62 @@
+import time
+from sources.config import settings
+from utils.concurrency import llm_limiter
+
+# Degradation tiers, best first. Every chat response reports the tier it was served at.
+TIER_FULL = "full"                # requested retrieval depth, reranking, full context, primary LLM
+TIER_REDUCED = "reduced"          # fewer chunks, no reranking, half the context budget, primary LLM
+TIER_FAST_MODEL = "fast_model"    # reduced retrieval answered by the fast fallback model
+TIER_EXTRACTIVE = "extractive"    # no LLM: the most relevant sentences of the top chunks, cited
+
+# Retrieval is reduced once less than this share of the budget is left after embedding
+REDUCE_BELOW_FRACTION = 0.6
+# The system counts as overloaded when this share of the global LLM slots is in use
+OVERLOAD_FRACTION = 0.8
+# Expected primary-LLM latency until the router has measured its p95 (a full-length answer)
+DEFAULT_LLM_SECONDS = 20.0
+# Time kept back for the fast model when the primary LLM runs late, and the least worth trying an LLM with
+FAST_MODEL_RESERVE_SECONDS = 4.0
+MIN_LLM_SECONDS = 1.5
+
+
+class Deadline:
+    """Wall-clock budget for one request, started on creation."""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.seconds - self.elapsed())
+
+    def fraction_remaining(self) -> float:
+        return self.remaining() / self.seconds if self.seconds else 0.0
+
+
+def is_overloaded() -> bool:
+    return llm_limiter.in_flight >= settings.MAX_CONCURRENT_LLM_CALLS * OVERLOAD_FRACTION
+
+
+def retrieval_tier(deadline: Deadline) -> str:
+    """Full retrieval unless the embedding stage ate into the budget or the LLM slots are nearly full."""
+    if is_overloaded() or deadline.fraction_remaining() < REDUCE_BELOW_FRACTION:
+        return TIER_REDUCED
+    return TIER_FULL
+
+
+def retrieval_params(tier: str, n_results: int, context_budget: int) -> dict:
+    if tier == TIER_FULL:
+        return {"n_results": n_results, "allow_rerank": True, "max_context_tokens": context_budget}
+    return {"n_results": max(3, n_results // 2), "allow_rerank": False, "max_context_tokens": context_budget // 2}
+
+
+def generation_tier(deadline: Deadline, tier: str, expected_llm_seconds: float, has_fast_model: bool) -> str:
+    """Escalates to the fast model when the primary is not expected to finish in time, or to extractive."""
+    remaining = deadline.remaining()
+    if remaining < MIN_LLM_SECONDS:
+        return TIER_EXTRACTIVE
+    if remaining < (expected_llm_seconds or DEFAULT_LLM_SECONDS) and has_fast_model:
+        return TIER_FAST_MODEL
+    return tier
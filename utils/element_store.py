@@ -0,0 +1,96 @@
+import os
+import gzip
+import json
+
+ELEMENTS_DIRECTORY = "./elements"
+# One gzipped JSON file per document holding its extraction elements column by column
+# (type, page, section, text), so re-chunking never has to run unstructured or Whisper again
+COLUMNS = ("type", "page", "section", "text")
+FORMAT_VERSION = 1
+TRANSCRIPT_TYPE = "Transcript"
+
+
+def _path(doc_id: int) -> str:
+    return os.path.join(ELEMENTS_DIRECTORY, f"doc_{doc_id}.json.gz")
+
+
+def from_partition(elements: list) -> list:
+    """unstructured elements -> element dicts; the section is the text of the latest Title element."""
+    rows, section = [], None
+    for element in elements:
+        text = str(element)
+        category = getattr(element, "category", type(element).__name__)
+        if category == "Title":
+            section = text
+        metadata = getattr(element, "metadata", None)
+        rows.append({"type": category, "page": getattr(metadata, "page_number", None), "section": section, "text": text})
+    return rows
+
+
+def from_transcript(text: str) -> list:
+    return [{"type": TRANSCRIPT_TYPE, "page": None, "section": None, "text": text}]
+
+
+def to_text(elements: list) -> str:
+    """The flattened text stored in Document.content (and chunked at ingestion)."""
+    return "\n\n".join(element["text"] for element in elements)
+
+
+def save(doc_id: int, elements: list):
+    os.makedirs(ELEMENTS_DIRECTORY, exist_ok=True)
+    payload = {"version": FORMAT_VERSION, "columns": {column: [element[column] for element in elements] for column in COLUMNS}}
+    tmp = f"{_path(doc_id)}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp, _path(doc_id))
+
+
+def load(doc_id: int) -> list:
+    """The document's elements, or None when it was extracted before they were stored."""
+    if not os.path.exists(_path(doc_id)):
+        return None
+    with gzip.open(_path(doc_id), "rt", encoding="utf-8") as f:
+        columns = json.load(f)["columns"]
+    return [dict(zip(COLUMNS, row)) for row in zip(*(columns[column] for column in COLUMNS))]
+
+
+def delete(doc_id: int):
+    if os.path.exists(_path(doc_id)):
+        os.remove(_path(doc_id))
+
+
+def backfill():
+    """
+    Stores elements for documents extracted before they were kept: documents are partitioned
+    again from their upload, transcripts are taken from Document.content.
+    """
+    from unstructured.partition.auto import partition
+    from sources.database import SessionLocal
+    from sources import models
+    from repo.documents import UPLOAD_DIRECTORY
+
+    db = SessionLocal()
+    try:
+        stored, skipped = 0, 0
+        for doc in db.query(models.Document).filter(models.Document.content.isnot(None)).order_by(models.Document.id):
+            if os.path.exists(_path(doc.id)):
+                continue
+            filepath = os.path.join(UPLOAD_DIRECTORY, doc.filename)
+            extension = os.path.splitext(doc.filename)[1].lower()
+            if extension in [".pdf", ".docx", ".txt"] and os.path.exists(filepath):
+                elements = from_partition(partition(filename=filepath))
+            elif extension in [".mp4", ".mov", ".avi", ".mp3", ".wav", ".m4a"]:
+                elements = from_transcript(doc.content)
+            else:
+                skipped += 1
+                continue
+            save(doc.id, elements)
+            stored += 1
+        print(f"Stored elements for {stored} document(s), {skipped} skipped (source file missing or unsupported).")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # python -m utils.element_store  (keeps elements for documents extracted before they were stored)
+    backfill()
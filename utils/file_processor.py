@@ -4,6 +4,7 @@ from unstructured.partition.auto import partition
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from utils.shared_models import embedding_model ,chroma_collection, transcription_model
 from utils.ai_services import generate_summary, generate_report, audiolize_summary, transcribe_video
+from utils.llm_router import LLMUnavailableError
 import os
 
 def process_document_ingestion(doc_id: int, filepath: str, file_hash: str):
@@ -99,6 +100,10 @@ def process_document_ingestion(doc_id: int, filepath: str, file_hash: str):
         doc.status = "complete"
         db.commit()"""
 
+    except LLMUnavailableError as e:
+        # Extraction and embedding succeeded, so the document stays usable for chat;
+        # only the automatic summary/report is missing and can be requested again later
+        print(f"LLM unavailable while processing document {doc_id}, skipping generation: {e}")
     except Exception as e:
         print(f"Error processing document {doc_id}: {e}")
         if 'doc' in locals():
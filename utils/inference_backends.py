@@ -0,0 +1,138 @@
+import os
+import torch
+import numpy as np
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+from transformers import VitsModel
+
+ONNX_EXPORT_DIRECTORY = "./onnx_models"
+EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
+TTS_MODEL_NAME = "facebook/mms-tts-eng"
+
+EMBEDDING_BACKENDS = {"torch", "torch_int8", "onnx", "onnx_int8"}
+TTS_BACKENDS = {"torch", "int8"}
+
+
+def load_embedding_model(model_name: str, backend: str = "torch", quantization_config: str = "avx2") -> SentenceTransformer:
+    """
+    Loads the sentence embedding model on the selected CPU inference backend:
+    - torch:      eager fp32 PyTorch (original behaviour)
+    - torch_int8: PyTorch with dynamic int8 quantization of the Linear layers
+    - onnx:       ONNX Runtime (exported on first load)
+    - onnx_int8:  ONNX Runtime with a dynamically int8-quantized graph (exported once into ONNX_EXPORT_DIRECTORY)
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of: {', '.join(sorted(EMBEDDING_BACKENDS))}")
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+
+    if backend == "torch_int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+
+    # onnx_int8: export and quantize once, then reuse the local copy on every start-up
+    local_dir = os.path.join(ONNX_EXPORT_DIRECTORY, model_name.replace("/", "__"))
+    quantized_file = f"onnx/model_qint8_{quantization_config}.onnx"
+    if not os.path.exists(os.path.join(local_dir, quantized_file)):
+        print(f"Exporting {model_name} to int8 ONNX ({quantization_config}) in {local_dir}...")
+        onnx_model = SentenceTransformer(model_name, backend="onnx")
+        onnx_model.save_pretrained(local_dir)
+        export_dynamic_quantized_onnx_model(onnx_model, quantization_config, local_dir)
+
+    return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": quantized_file})
+
+
+def load_tts_model(model_name: str, backend: str = "torch") -> VitsModel:
+    """
+    Loads the VITS text-to-speech model. The 'int8' backend applies dynamic int8
+    quantization to the Linear layers (text encoder and duration predictor); the
+    convolutional vocoder stays in fp32. VITS is not exported to ONNX because its
+    duration-dependent output length does not survive tracing reliably.
+    """
+    if backend not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{backend}'. Choose one of: {', '.join(sorted(TTS_BACKENDS))}")
+
+    model = VitsModel.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+# <--- PARITY CHECKS --->
+PARITY_TEXTS = [
+    "What is the main topic and key points of this document?",
+    "The policyholder must notify the insurer within 30 days of any claim under clause 4.2.",
+    "Quarterly revenue grew by 12% driven by strong demand in the APAC region.",
+    "This dissertation investigates transformer models for low-resource speech recognition.",
+]
+
+
+def check_embedding_parity(reference: SentenceTransformer, candidate: SentenceTransformer, texts: list = None, min_cosine: float = 0.99) -> dict:
+    """Compares candidate embeddings against the fp32 reference, text by text."""
+    texts = texts or PARITY_TEXTS
+    ref = reference.encode(texts, normalize_embeddings=True)
+    cand = candidate.encode(texts, normalize_embeddings=True)
+    cosines = np.sum(ref * cand, axis=1)
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "passed": bool(cosines.min() >= min_cosine),
+    }
+
+
+def _log_spectrum(waveform: np.ndarray, frame: int = 1024, hop: int = 256) -> np.ndarray:
+    if len(waveform) < frame:
+        waveform = np.pad(waveform, (0, frame - len(waveform)))
+    window = np.hanning(frame)
+    frames = [waveform[i:i + frame] * window for i in range(0, len(waveform) - frame + 1, hop)]
+    return np.log(np.abs(np.fft.rfft(np.stack(frames), axis=1)) + 1e-6)
+
+
+def check_tts_parity(reference: VitsModel, candidate: VitsModel, tokenizer, text: str = None, max_duration_drift: float = 0.1, max_spectral_distance: float = 1.0) -> dict:
+    """
+    Synthesizes the same text with both models under the same seed and compares
+    the output length and the mean log-spectral distance of the waveforms.
+    """
+    text = text or PARITY_TEXTS[1]
+    inputs = tokenizer(text, return_tensors="pt")
+
+    waveforms = []
+    for model in (reference, candidate):
+        torch.manual_seed(0)
+        with torch.no_grad():
+            waveforms.append(model(**inputs).waveform.squeeze().cpu().float().numpy())
+    ref_wave, cand_wave = waveforms
+
+    duration_drift = abs(len(cand_wave) - len(ref_wave)) / max(len(ref_wave), 1)
+    ref_spec, cand_spec = _log_spectrum(ref_wave), _log_spectrum(cand_wave)
+    n_frames = min(len(ref_spec), len(cand_spec))
+    spectral_distance = float(np.sqrt(np.mean((ref_spec[:n_frames] - cand_spec[:n_frames]) ** 2)))
+
+    return {
+        "duration_drift": float(duration_drift),
+        "spectral_distance": spectral_distance,
+        "passed": bool(duration_drift <= max_duration_drift and spectral_distance <= max_spectral_distance),
+    }
+
+
+if __name__ == "__main__":
+    # python -m utils.inference_backends
+    from transformers import AutoTokenizer
+    from sources.config import settings
+
+    print(f"Embedding parity: torch vs {settings.EMBEDDING_BACKEND}")
+    print(check_embedding_parity(
+        load_embedding_model(settings.EMBEDDING_MODEL, "torch"),
+        load_embedding_model(settings.EMBEDDING_MODEL, settings.EMBEDDING_BACKEND, settings.ONNX_QUANTIZATION_CONFIG),
+    ))
+
+    print(f"TTS parity: torch vs {settings.TTS_BACKEND}")
+    print(check_tts_parity(
+        load_tts_model(TTS_MODEL_NAME, "torch"),
+        load_tts_model(TTS_MODEL_NAME, settings.TTS_BACKEND),
+        AutoTokenizer.from_pretrained(TTS_MODEL_NAME),
+    ))
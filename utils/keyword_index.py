@@ -0,0 +1,204 @@
+import re
+import sqlite3
+import threading
+
+KEYWORD_INDEX_PATH = "./keyword_index.db"
+
+# Chunk ids and filters live in an ordinary indexed table whose ids are the FTS rowids, so
+# deletes and doc/owner filters are index lookups instead of scans of UNINDEXED FTS columns.
+# '-' and '_' are kept inside tokens so ids like "POL-2023-117" or "clause_4" match whole;
+# dotted ids like "4.2" are matched as adjacent-token phrases instead.
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS chunk_meta{0} (id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE, doc_id INTEGER, owner_id INTEGER, filename TEXT)",
+    "CREATE INDEX IF NOT EXISTS chunk_meta{0}_doc ON chunk_meta{0} (doc_id)",
+    "CREATE INDEX IF NOT EXISTS chunk_meta{0}_owner ON chunk_meta{0} (owner_id)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text{0} USING fts5(content, tokenize = \"unicode61 tokenchars '-_'\")",
+]
+# Tables a reindex builds the next generation's index into (see build_shadow)
+SHADOW = "_shadow"
+_TERM_PATTERN = re.compile(r"[\w\-]+(?:\.[\w\-]+)*")
+
+_lock = threading.Lock()
+_connection = None
+
+
+def _migrate_legacy(conn: sqlite3.Connection):
+    """Moves an index from the single-table layout (ids as UNINDEXED FTS columns) into the current one."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks'").fetchone():
+        return
+    conn.execute("INSERT OR IGNORE INTO chunk_meta (id, chunk_id, doc_id, owner_id, filename) SELECT rowid, chunk_id, doc_id, owner_id, filename FROM chunks")
+    conn.execute("INSERT INTO chunk_text (rowid, content) SELECT rowid, content FROM chunks WHERE rowid IN (SELECT rowid FROM chunk_meta)")
+    conn.execute("DROP TABLE chunks")
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(KEYWORD_INDEX_PATH, check_same_thread=False)
+        for statement in _SCHEMA:
+            _connection.execute(statement.format(""))
+        _migrate_legacy(_connection)
+        _connection.commit()
+    return _connection
+
+
+def _delete_rows(conn: sqlite3.Connection, rowids: list, suffix: str = ""):
+    conn.executemany(f"DELETE FROM chunk_text{suffix} WHERE rowid = ?", [(rowid,) for rowid in rowids])
+    conn.executemany(f"DELETE FROM chunk_meta{suffix} WHERE rowid = ?", [(rowid,) for rowid in rowids])
+
+
+def _add_chunks(conn: sqlite3.Connection, ids: list, documents: list, metadatas: list, suffix: str = ""):
+    replaced = [
+        row[0] for chunk_id in ids
+        for row in conn.execute(f"SELECT rowid FROM chunk_meta{suffix} WHERE chunk_id = ?", (chunk_id,))
+    ]
+    _delete_rows(conn, replaced, suffix)
+    for chunk_id, text, meta in zip(ids, documents, metadatas):
+        rowid = conn.execute(
+            f"INSERT INTO chunk_meta{suffix} (chunk_id, doc_id, owner_id, filename) VALUES (?, ?, ?, ?)",
+            (chunk_id, meta.get("doc_id"), meta.get("owner_id"), meta.get("filename")),
+        ).lastrowid
+        conn.execute(f"INSERT INTO chunk_text{suffix} (rowid, content) VALUES (?, ?)", (rowid, text))
+
+
+def _delete_document(conn: sqlite3.Connection, doc_id: int, suffix: str = ""):
+    _delete_rows(conn, [row[0] for row in conn.execute(f"SELECT rowid FROM chunk_meta{suffix} WHERE doc_id = ?", (doc_id,))], suffix)
+
+
+def _has_shadow(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"chunk_meta{SHADOW}",)).fetchone() is not None
+
+
+def add_chunks(ids: list, documents: list, metadatas: list):
+    """Indexes chunks under the same ids (and metadata) that were written to Chroma."""
+    with _lock:
+        conn = _get_connection()
+        _add_chunks(conn, ids, documents, metadatas)
+        conn.commit()
+
+
+def replace_document(doc_id: int, ids: list, documents: list, metadatas: list):
+    """Swaps a document's chunks for a re-chunked set in one transaction, so searches never see it half-indexed."""
+    with _lock:
+        conn = _get_connection()
+        _delete_document(conn, doc_id)
+        _add_chunks(conn, ids, documents, metadatas)
+        conn.commit()
+
+
+def delete_document(doc_id: int):
+    with _lock:
+        conn = _get_connection()
+        _delete_document(conn, doc_id)
+        # A reindex's shadow tables must not bring a deleted document back when they replace these
+        if _has_shadow(conn):
+            _delete_document(conn, doc_id, SHADOW)
+        conn.commit()
+
+
+def chunk_ids_of(doc_id: int) -> set:
+    with _lock:
+        return {row[0] for row in _get_connection().execute("SELECT chunk_id FROM chunk_meta WHERE doc_id = ?", (doc_id,))}
+
+
+def build_shadow(batches):
+    """Indexes get()-shaped chunk batches (a shadow vector generation) into shadow tables; searches keep using the live ones."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute(f"DROP TABLE IF EXISTS chunk_meta{SHADOW}")
+        conn.execute(f"DROP TABLE IF EXISTS chunk_text{SHADOW}")
+        for statement in _SCHEMA:
+            conn.execute(statement.format(SHADOW))
+        conn.commit()
+    for batch in batches:
+        with _lock:
+            conn = _get_connection()
+            _add_chunks(conn, batch["ids"], batch["documents"], batch["metadatas"], SHADOW)
+            conn.commit()
+
+
+def promote_shadow():
+    """Replaces the live tables with the shadow ones in one transaction."""
+    with _lock:
+        conn = _get_connection()
+        if not _has_shadow(conn):
+            return
+        conn.execute("BEGIN")
+        for table in ("chunk_meta", "chunk_text"):
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {table}{SHADOW} RENAME TO {table}")
+        # Renamed tables keep their index names; give them the live ones
+        for index in ("chunk_meta_doc", "chunk_meta_owner"):
+            conn.execute(f"DROP INDEX IF EXISTS {index.replace('chunk_meta', 'chunk_meta' + SHADOW)}")
+        for statement in _SCHEMA:
+            conn.execute(statement.format(""))
+        conn.commit()
+
+
+def _to_match_query(text: str) -> str:
+    terms = {term.lower() for term in _TERM_PATTERN.findall(text) if len(term) > 1 or term.isdigit()}
+    # Quote every term so FTS5 operators/punctuation in user questions are never interpreted
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in sorted(terms))
+
+
+def search(query: str, n_results: int = 8, doc_id: int = None, owner_id: int = None) -> list:
+    """
+    BM25 search over the indexed chunks. Returns a best-first list of
+    {"id", "document", "metadata", "score"} dicts under the same doc/owner filter as the vector query.
+    """
+    match_query = _to_match_query(query)
+    if not match_query:
+        return []
+
+    sql = (
+        "SELECT chunk_meta.chunk_id, chunk_meta.doc_id, chunk_meta.owner_id, chunk_meta.filename, chunk_text.content, "
+        "bm25(chunk_text) AS score FROM chunk_text JOIN chunk_meta ON chunk_meta.rowid = chunk_text.rowid "
+        "WHERE chunk_text MATCH ?"
+    )
+    params = [match_query]
+    if doc_id is not None:
+        sql += " AND chunk_meta.doc_id = ?"
+        params.append(doc_id)
+    elif owner_id is not None:
+        sql += " AND chunk_meta.owner_id = ?"
+        params.append(owner_id)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(n_results)
+
+    with _lock:
+        try:
+            rows = _get_connection().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Keyword index query failed: {e}")
+            return []
+
+    return [
+        {
+            "id": chunk_id,
+            "document": content,
+            "metadata": {"doc_id": row_doc_id, "owner_id": row_owner_id, "filename": filename},
+            "score": score,
+        }
+        for chunk_id, row_doc_id, row_owner_id, filename, content, score in rows
+    ]
+
+
+def rebuild(batches):
+    """Re-creates the keyword index from get()-shaped chunk batches (e.g. vector_store.scan())."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM chunk_text")
+        conn.execute("DELETE FROM chunk_meta")
+        conn.commit()
+
+    total = 0
+    for batch in batches:
+        add_chunks(batch["ids"], batch["documents"], batch["metadatas"])
+        total += len(batch["ids"])
+    print(f"Keyword index rebuilt with {total} chunks.")
+
+
+if __name__ == "__main__":
+    # python -m utils.keyword_index  (backfills the index for documents ingested before it existed)
+    from utils.vector_store import vector_store
+    rebuild(vector_store.scan())
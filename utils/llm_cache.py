@@ -0,0 +1,75 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+LLM_CACHE_PATH = "./llm_cache.db"
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+MAX_ENTRIES = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+_lock = threading.Lock()
+_connection = None
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        _connection.execute(_SCHEMA)
+        _connection.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions (last_access)")
+        _connection.commit()
+    return _connection
+
+
+def completion_key(model_id: str, params: dict, prompt: str) -> str:
+    """Fingerprint of everything that determines a completion: model id, sampling params and prompt."""
+    fingerprint = json.dumps({"model": model_id, "params": params}, sort_keys=True) + "\n" + prompt
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> str:
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > CACHE_TTL_SECONDS:
+            if row is not None:
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                conn.commit()
+            stats["misses"] += 1
+            return None
+        conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        stats["hits"] += 1
+        return row[0]
+
+
+def put(key: str, value: str):
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO completions (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, now, now)
+        )
+        # Size bound: drop expired entries first, then the least recently used ones
+        conn.execute("DELETE FROM completions WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+        overflow = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - MAX_ENTRIES
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+            stats["evictions"] += overflow
+        conn.commit()
@@ -0,0 +1,297 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Attempts per provider before moving on, and the jittered exponential backoff between them
+MAX_RETRIES = 2
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+# Consecutive failures that open a provider's circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN_SECONDS = 30.0
+# Latency samples kept per provider and prompt template (a chat answer and a long report have very
+# different latencies); below MIN_LATENCY_SAMPLES the default hedge delay is used
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 5
+HEDGE_PERCENTILE = 95
+# response_metadata key naming the provider that produced a router response or stream chunk
+PROVIDER_METADATA_KEY = "llm_provider"
+
+# Threads for the sync path, where a hedged call has to run next to the one it hedges
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+class LLMUnavailableError(Exception):
+    """Raised when every provider failed or has an open circuit."""
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After CIRCUIT_FAILURE_THRESHOLD consecutive failures it opens and
+    rejects calls for the cooldown; then one trial call is let through (half-open) per cooldown.
+    """
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, cooldown: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Let a single trial through; restarting the clock keeps the others out meanwhile
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class LLMBackend:
+    """One provider: the LangChain model plus its circuit breaker and latency/error metrics."""
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.template_latencies = {}    # template name -> deque of its own samples
+        self.stats = {"calls": 0, "errors": 0, "retries": 0, "hedges": 0, "wins": 0}
+
+    def latency_percentile(self, percentile: float, template: str = None) -> float:
+        """Latency percentile of the calls for `template` (of all calls when None), or None with too few samples."""
+        samples = self.latencies if template is None else self.template_latencies.get(template, ())
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def record(self, started: float, error: Exception = None, template: str = None):
+        self.stats["calls"] += 1
+        if error is None:
+            elapsed = time.monotonic() - started
+            self.latencies.append(elapsed)
+            if template is not None:
+                self.template_latencies.setdefault(template, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+            self.breaker.record_success()
+        else:
+            self.stats["errors"] += 1
+            self.breaker.record_failure()
+            print(f"LLM provider '{self.name}' failed: {error}")
+
+
+def _as_message(result, backend: LLMBackend, chunk: bool = False):
+    # Completion-style models (OllamaLLM) return plain strings; callers expect chat messages
+    if not hasattr(result, "content"):
+        result = (AIMessageChunk if chunk else AIMessage)(content=str(result))
+    result.response_metadata[PROVIDER_METADATA_KEY] = backend.name
+    return result
+
+
+def answered_by(message) -> str:
+    """Name of the provider that produced a router response or stream chunk (None for other models)."""
+    return (getattr(message, "response_metadata", None) or {}).get(PROVIDER_METADATA_KEY)
+
+
+def _backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class LLMRouter:
+    """
+    Drop-in for a LangChain chat model (invoke / ainvoke / stream) over an ordered list of providers.
+    Each provider is retried with jittered backoff; when the current provider has not answered within
+    its p95 latency a hedged request goes to the next one, and the first success wins. Providers whose
+    circuit is open are skipped. Raises LLMUnavailableError when every provider failed.
+    `template` names the prompt template of a call: latencies, and so hedge delays, are kept per template.
+    """
+    def __init__(self, backends: list, default_hedge_delay: float):
+        self.backends = [LLMBackend(name, model) for name, model in backends]
+        self.default_hedge_delay = default_hedge_delay
+
+    @property
+    def primary(self) -> str:
+        """Name of the first provider; responses from the others are failover answers."""
+        return self.backends[0].name
+
+    def _candidates(self) -> list:
+        candidates = [backend for backend in self.backends if backend.breaker.state != "open"]
+        if not candidates:
+            raise LLMUnavailableError("All LLM providers are unavailable (circuits open)")
+        return candidates
+
+    def _hedge_delay(self, backend: LLMBackend, template: str = None) -> float:
+        p95 = backend.latency_percentile(HEDGE_PERCENTILE, template)
+        return p95 if p95 is not None else self.default_hedge_delay
+
+    def _call(self, backend: LLMBackend, prompt, stop: threading.Event, template: str = None):
+        # `stop` is set once another call of the same request won: no further attempts are made
+        last_error = None
+        for attempt in range(MAX_RETRIES + 1):
+            if stop.is_set() or not backend.breaker.allow():
+                break
+            if attempt:
+                backend.stats["retries"] += 1
+            started = time.monotonic()
+            try:
+                result = _as_message(backend.model.invoke(prompt), backend)
+                backend.record(started, template=template)
+                return result
+            except Exception as e:
+                backend.record(started, e)
+                last_error = e
+            if attempt < MAX_RETRIES and stop.wait(_backoff(attempt)):
+                break
+        raise last_error or LLMUnavailableError(f"LLM provider '{backend.name}' circuit is open")
+
+    async def _acall(self, backend: LLMBackend, prompt, template: str = None):
+        last_error = None
+        for attempt in range(MAX_RETRIES + 1):
+            if not backend.breaker.allow():
+                break
+            if attempt:
+                backend.stats["retries"] += 1
+            started = time.monotonic()
+            try:
+                result = _as_message(await backend.model.ainvoke(prompt), backend)
+                backend.record(started, template=template)
+                return result
+            except Exception as e:
+                backend.record(started, e)
+                last_error = e
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+        raise last_error or LLMUnavailableError(f"LLM provider '{backend.name}' circuit is open")
+
+    def invoke(self, prompt, template: str = None):
+        candidates = self._candidates()
+        pending, errors = {}, []
+        stop = threading.Event()
+
+        def launch(hedge: bool):
+            backend = candidates[len(pending) + len(errors)]
+            if hedge:
+                backend.stats["hedges"] += 1
+            pending[_hedge_executor.submit(self._call, backend, prompt, stop, template)] = backend
+
+        launch(hedge=False)
+        try:
+            while pending:
+                can_hedge = len(pending) + len(errors) < len(candidates)
+                newest = list(pending.values())[-1]
+                done, _ = wait(pending, timeout=self._hedge_delay(newest, template) if can_hedge else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    launch(hedge=True)
+                    continue
+                for future in done:
+                    backend = pending.pop(future)
+                    if future.exception() is None:
+                        backend.stats["wins"] += 1
+                        return future.result()
+                    errors.append(f"{backend.name}: {future.exception()}")
+                if not pending and len(errors) < len(candidates):
+                    launch(hedge=False)
+        finally:
+            # Losers: queued calls are cancelled and running ones make no further attempts.
+            # A provider request already on the wire cannot be interrupted; its result is dropped.
+            stop.set()
+            for future in pending:
+                future.cancel()
+        raise LLMUnavailableError("All LLM providers failed: " + "; ".join(errors))
+
+    async def ainvoke(self, prompt, template: str = None):
+        candidates = self._candidates()
+        pending, errors = {}, []
+
+        def launch(hedge: bool):
+            backend = candidates[len(pending) + len(errors)]
+            if hedge:
+                backend.stats["hedges"] += 1
+            pending[asyncio.ensure_future(self._acall(backend, prompt, template))] = backend
+
+        launch(hedge=False)
+        try:
+            while pending:
+                can_hedge = len(pending) + len(errors) < len(candidates)
+                newest = list(pending.values())[-1]
+                done, _ = await asyncio.wait(pending, timeout=self._hedge_delay(newest, template) if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch(hedge=True)
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        backend.stats["wins"] += 1
+                        return task.result()
+                    errors.append(f"{backend.name}: {task.exception()}")
+                if not pending and len(errors) < len(candidates):
+                    launch(hedge=False)
+        finally:
+            for task in pending:
+                task.cancel()
+        raise LLMUnavailableError("All LLM providers failed: " + "; ".join(errors))
+
+    def stream(self, prompt, template: str = None):
+        """
+        Streams from the first provider that starts answering. A stream cannot be hedged or retried
+        once tokens were sent, so failover only happens before the first chunk.
+        """
+        errors = []
+        for backend in self._candidates():
+            if not backend.breaker.allow():
+                continue
+            started = time.monotonic()
+            try:
+                chunks = iter(backend.model.stream(prompt))
+                first = next(chunks, None)
+            except Exception as e:
+                backend.record(started, e)
+                errors.append(f"{backend.name}: {e}")
+                continue
+            backend.stats["wins"] += 1
+            try:
+                if first is not None:
+                    yield _as_message(first, backend, chunk=True)
+                for chunk in chunks:
+                    yield _as_message(chunk, backend, chunk=True)
+            except Exception as e:
+                backend.record(started, e)
+                raise
+            backend.record(started, template=template)
+            return
+        raise LLMUnavailableError("All LLM providers failed: " + "; ".join(errors))
+
+    @property
+    def stats(self) -> dict:
+        """Per-provider calls, errors, retries, hedges, wins, p50/p95 latency (p95 also per template) and circuit state."""
+        return {
+            backend.name: {
+                **backend.stats,
+                "latency_p50": backend.latency_percentile(50),
+                "latency_p95": backend.latency_percentile(95),
+                "latency_p95_by_template": {template: backend.latency_percentile(95, template) for template in backend.template_latencies},
+                "circuit": backend.breaker.state,
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+from utils.shared_models import LLM_MODEL_ID, LLM_SAMPLING_PARAMS
+from utils.ai_services import aget_llm_response, build_summary_prompt, build_report_prompt
+from utils.retrieval import all_document_chunks
+from utils.concurrency import run_blocking
+from utils import llm_cache, prompts
+from utils.llm_router import LLMUnavailableError
+
+# Map calls per generation in flight at once (the per-user LLM limit still applies on top)
+MAP_CONCURRENCY = 8
+# Partial summaries combined per reduce step; larger documents are reduced hierarchically
+REDUCE_GROUP_SIZE = 12
+
+
+async def _cached_completion(cache_key: str, prompt: str, semaphore: asyncio.Semaphore, user_id: int = None, template: str = None, use_cache: bool = True) -> str:
+    # Bypassing the cache regenerates the part and refreshes its cached copy
+    cached = llm_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        return cached
+    try:
+        async with semaphore:
+            return await aget_llm_response(prompt, user_id=user_id, use_cache=True, template=template, cache_key=cache_key, refresh=True)
+    except LLMUnavailableError as e:
+        # A failed part is dropped rather than failing the whole generation
+        print(f"Map-reduce call failed: {e}")
+        return None
+
+
+async def _map_chunk(chunk: str, semaphore: asyncio.Semaphore, user_id: int = None, use_cache: bool = True) -> str:
+    # Keyed by chunk hash (not prompt) so every summary/report type reuses the same partial summaries
+    chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+    # The template version is part of the key so a changed map prompt does not reuse old partial summaries
+    template = prompts.get_template("map")
+    cache_key = llm_cache.completion_key(LLM_MODEL_ID, LLM_SAMPLING_PARAMS, f"{template.version}:{chunk_hash}")
+    return await _cached_completion(cache_key, template.render(chunk=chunk), semaphore, user_id, "map", use_cache)
+
+
+async def _reduce_group(partials: list, semaphore: asyncio.Semaphore, user_id: int = None, use_cache: bool = True) -> str:
+    prompt = prompts.render("reduce", partials="\n\n".join(f"Part {i + 1}:\n{text}" for i, text in enumerate(partials)))
+    cache_key = llm_cache.completion_key(LLM_MODEL_ID, LLM_SAMPLING_PARAMS, prompt)
+    return await _cached_completion(cache_key, prompt, semaphore, user_id, "reduce", use_cache)
+
+
+async def _gather(coroutines: list, phase: str, progress=None) -> list:
+    """asyncio.gather that reports {"phase", "done", "total"} to `progress` as each call finishes."""
+    if progress is None:
+        return await asyncio.gather(*coroutines)
+    finished = 0
+
+    async def tracked(coroutine):
+        nonlocal finished
+        result = await coroutine
+        finished += 1
+        progress({"phase": phase, "done": finished, "total": len(coroutines)})
+        return result
+
+    return await asyncio.gather(*[tracked(coroutine) for coroutine in coroutines])
+
+
+async def map_reduce_context(doc_id: int, user_id: int = None, use_cache: bool = True, progress=None) -> str:
+    """
+    Map: summarize every chunk of the document concurrently (capped by MAP_CONCURRENCY).
+    Reduce: combine the partial summaries in groups until at most REDUCE_GROUP_SIZE remain.
+    Returns them as a cited context (one SOURCE label per part), or None when nothing was produced.
+    `progress`, when given, is called with {"phase": "map" | "reduce", "done", "total"} per finished call.
+    """
+    results = await run_blocking(all_document_chunks, doc_id)
+    chunks = results["documents"][0]
+    metadatas = results["metadatas"][0]
+    if not chunks:
+        return None
+
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    partials = await _gather([_map_chunk(chunk, semaphore, user_id, use_cache) for chunk in chunks], "map", progress)
+    failed = sum(1 for partial in partials if partial is None)
+    if failed:
+        print(f"Map-reduce doc {doc_id}: {failed}/{len(partials)} map calls failed; continuing with the rest")
+
+    filename = metadatas[0].get("filename") if isinstance(metadatas[0], dict) else None
+    total = len(chunks)
+    entries = [((i, i), partial) for i, partial in enumerate(partials) if partial is not None]
+
+    while len(entries) > REDUCE_GROUP_SIZE:
+        groups = [entries[i:i + REDUCE_GROUP_SIZE] for i in range(0, len(entries), REDUCE_GROUP_SIZE)]
+        reduced = await _gather([_reduce_group([text for _, text in group], semaphore, user_id, use_cache) for group in groups], "reduce", progress)
+        entries = [
+            ((group[0][0][0], group[-1][0][1]), text)
+            for group, text in zip(groups, reduced) if text is not None
+        ]
+
+    parts = []
+    for (first, last), text in entries:
+        part = f"part {first + 1}" if first == last else f"parts {first + 1}-{last + 1}"
+        parts.append(f"SOURCE: {filename or 'unknown'} (doc_id={doc_id}, {part} of {total})\n{text}")
+    return "\n\n".join(parts) or None
+
+
+async def map_reduce_summary_prompt(doc_id: int, summary_type: str, user_id: int = None, use_cache: bool = True, progress=None) -> str:
+    cited_context = await map_reduce_context(doc_id, user_id, use_cache, progress)
+    return build_summary_prompt(cited_context, summary_type) if cited_context else None
+
+
+async def map_reduce_report_prompt(doc_id: int, report_type: str, user_id: int = None, use_cache: bool = True, progress=None) -> str:
+    cited_context = await map_reduce_context(doc_id, user_id, use_cache, progress)
+    return build_report_prompt(cited_context, report_type) if cited_context else None
+
+
+async def map_reduce_summary(doc_id: int, summary_type: str, user_id: int = None, use_cache: bool = True, refresh: bool = False) -> str:
+    """Full-coverage summary: map-reduce over every chunk instead of the top retrieved ones."""
+    prompt = await map_reduce_summary_prompt(doc_id, summary_type, user_id, use_cache and not refresh)
+    if prompt is None:
+        return "Could not retrieve content for summary."
+    return await aget_llm_response(prompt, user_id=user_id, use_cache=use_cache, template="summary", refresh=refresh)
+
+
+async def map_reduce_report(doc_id: int, report_type: str, user_id: int = None, use_cache: bool = True, refresh: bool = False) -> str:
+    """Full-coverage report: map-reduce over every chunk instead of the top retrieved ones."""
+    prompt = await map_reduce_report_prompt(doc_id, report_type, user_id, use_cache and not refresh)
+    if prompt is None:
+        return "Could not retrieve content for report generation."
+    return await aget_llm_response(prompt, user_id=user_id, use_cache=use_cache, template="report", refresh=refresh)
@@ -0,0 +1,249 @@
+import re
+import zlib
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+NEAR_DUPLICATES_PATH = "./near_duplicates.db"
+
+# MinHash over word 5-gram shingles; LSH with 16 bands of 8 rows puts chunks above ~0.7 Jaccard
+# similarity in a shared bucket with high probability, and candidates are then confirmed on the
+# estimated similarity
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // LSH_BANDS
+DUPLICATE_THRESHOLD = 0.8
+
+# Universal hashing (a * x + b) mod p of 32-bit shingle hashes; p is the smallest prime above 2**32,
+# so every product stays inside uint64
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(42)
+_A = _rng.integers(1, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint64)
+
+_SCHEMA = [
+    # cluster: the chunk every near-duplicate of it points to (its own id for the first of a cluster)
+    "CREATE TABLE IF NOT EXISTS signatures{0} (chunk_id TEXT PRIMARY KEY, doc_id INTEGER, owner_id INTEGER, signature BLOB, cluster TEXT)",
+    "CREATE INDEX IF NOT EXISTS signatures{0}_doc ON signatures{0} (doc_id)",
+    "CREATE INDEX IF NOT EXISTS signatures{0}_cluster ON signatures{0} (cluster)",
+    "CREATE TABLE IF NOT EXISTS bands{0} (owner_id INTEGER, key TEXT, chunk_id TEXT)",
+    "CREATE INDEX IF NOT EXISTS bands{0}_lookup ON bands{0} (owner_id, key)",
+]
+# Tables a reindex builds the next generation's index into (see build_shadow)
+SHADOW = "_shadow"
+_WORD_PATTERN = re.compile(r"\w+")
+
+_lock = threading.Lock()
+_connection = None
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(NEAR_DUPLICATES_PATH, check_same_thread=False)
+        for statement in _SCHEMA:
+            _connection.execute(statement.format(""))
+        _connection.commit()
+    return _connection
+
+
+def signature(text: str) -> np.ndarray:
+    """MinHash signature (NUM_PERMUTATIONS uint32 values) of the text's word shingles, or None for empty text."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(a == b))
+
+
+def _band_keys(sig: np.ndarray) -> list:
+    return [
+        f"{band}:{hashlib.md5(sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()).hexdigest()[:16]}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+def _find_cluster(conn: sqlite3.Connection, owner_id: int, sig: np.ndarray, keys: list, suffix: str = "") -> str:
+    """Cluster of the most similar chunk in the owner's library above DUPLICATE_THRESHOLD, or None."""
+    placeholders = ",".join("?" * len(keys))
+    rows = conn.execute(
+        f"SELECT s.signature, s.cluster FROM signatures{suffix} s WHERE s.chunk_id IN "
+        f"(SELECT DISTINCT chunk_id FROM bands{suffix} WHERE owner_id IS ? AND key IN ({placeholders}))",
+        [owner_id, *keys],
+    ).fetchall()
+    best, best_cluster = DUPLICATE_THRESHOLD, None
+    for stored, cluster in rows:
+        score = similarity(sig, np.frombuffer(stored, dtype=np.uint32))
+        if score >= best:
+            best, best_cluster = score, cluster
+    return best_cluster
+
+
+def _add_chunks(conn: sqlite3.Connection, ids: list, documents: list, metadatas: list, suffix: str = "") -> int:
+    signatures = [signature(text) for text in documents]
+    duplicates = 0
+    for chunk_id, sig, meta in zip(ids, signatures, metadatas):
+        if sig is None:
+            continue
+        owner_id = meta.get("owner_id")
+        keys = _band_keys(sig)
+        conn.execute(f"DELETE FROM bands{suffix} WHERE chunk_id = ?", (chunk_id,))
+        conn.execute(f"DELETE FROM signatures{suffix} WHERE chunk_id = ?", (chunk_id,))
+        cluster = _find_cluster(conn, owner_id, sig, keys, suffix)
+        duplicates += cluster is not None
+        conn.execute(
+            f"INSERT INTO signatures{suffix} (chunk_id, doc_id, owner_id, signature, cluster) VALUES (?, ?, ?, ?, ?)",
+            (chunk_id, meta.get("doc_id"), owner_id, sig.tobytes(), cluster or chunk_id),
+        )
+        conn.executemany(f"INSERT INTO bands{suffix} (owner_id, key, chunk_id) VALUES (?, ?, ?)", [(owner_id, key, chunk_id) for key in keys])
+    return duplicates
+
+
+def _delete_document(conn: sqlite3.Connection, doc_id: int, suffix: str = ""):
+    removed = [row[0] for row in conn.execute(f"SELECT chunk_id FROM signatures{suffix} WHERE doc_id = ?", (doc_id,))]
+    conn.execute(f"DELETE FROM signatures{suffix} WHERE doc_id = ?", (doc_id,))
+    conn.executemany(f"DELETE FROM bands{suffix} WHERE chunk_id = ?", [(chunk_id,) for chunk_id in removed])
+    for chunk_id in removed:
+        heir = conn.execute(f"SELECT chunk_id FROM signatures{suffix} WHERE cluster = ? ORDER BY rowid LIMIT 1", (chunk_id,)).fetchone()
+        if heir:
+            conn.execute(f"UPDATE signatures{suffix} SET cluster = ? WHERE cluster = ?", (heir[0], chunk_id))
+
+
+def _has_shadow(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"signatures{SHADOW}",)).fetchone() is not None
+
+
+def add_chunks(ids: list, documents: list, metadatas: list) -> int:
+    """
+    Indexes chunks at ingestion (same ids as the vector store) and assigns each to the cluster of
+    a near-duplicate already in its owner's library. Returns how many chunks were near-duplicates.
+    """
+    with _lock:
+        conn = _get_connection()
+        duplicates = _add_chunks(conn, ids, documents, metadatas)
+        conn.commit()
+    return duplicates
+
+
+def delete_document(doc_id: int):
+    """Removes a document's chunks; clusters they headed are taken over by their oldest remaining member."""
+    with _lock:
+        conn = _get_connection()
+        _delete_document(conn, doc_id)
+        # A reindex's shadow tables must not bring a deleted document back when they replace these
+        if _has_shadow(conn):
+            _delete_document(conn, doc_id, SHADOW)
+        conn.commit()
+
+
+def replace_document(doc_id: int, ids: list, documents: list, metadatas: list):
+    delete_document(doc_id)
+    add_chunks(ids, documents, metadatas)
+
+
+def chunk_ids_of(doc_id: int) -> set:
+    with _lock:
+        return {row[0] for row in _get_connection().execute("SELECT chunk_id FROM signatures WHERE doc_id = ?", (doc_id,))}
+
+
+def build_shadow(batches):
+    """Indexes get()-shaped chunk batches (a shadow vector generation) into shadow tables; searches keep using the live ones."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute(f"DROP TABLE IF EXISTS signatures{SHADOW}")
+        conn.execute(f"DROP TABLE IF EXISTS bands{SHADOW}")
+        for statement in _SCHEMA:
+            conn.execute(statement.format(SHADOW))
+        conn.commit()
+
+    for batch in batches:
+        with _lock:
+            conn = _get_connection()
+            _add_chunks(conn, batch["ids"], batch["documents"], batch["metadatas"], SHADOW)
+            conn.commit()
+
+
+def promote_shadow():
+    """Replaces the live tables with the shadow ones in one transaction."""
+    with _lock:
+        conn = _get_connection()
+        if not _has_shadow(conn):
+            return
+        conn.execute("BEGIN")
+        for table in ("signatures", "bands"):
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {table}{SHADOW} RENAME TO {table}")
+        # Renamed tables keep their index names; give them the live ones
+        for index in ("signatures_doc", "signatures_cluster", "bands_lookup"):
+            conn.execute(f"DROP INDEX IF EXISTS {index.replace('_', SHADOW + '_', 1)}")
+        for statement in _SCHEMA:
+            conn.execute(statement.format(""))
+        conn.commit()
+
+
+def clusters_of(ids: list) -> dict:
+    """chunk id -> cluster id for the indexed ones among `ids`."""
+    if not ids:
+        return {}
+    with _lock:
+        conn = _get_connection()
+        rows = conn.execute(f"SELECT chunk_id, cluster FROM signatures WHERE chunk_id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    return dict(rows)
+
+
+def collapse(ids: list) -> list:
+    """Best-first chunk ids with only the best-ranked chunk of each near-duplicate cluster kept."""
+    clusters = clusters_of(ids)
+    kept, seen = [], set()
+    for chunk_id in ids:
+        cluster = clusters.get(chunk_id, chunk_id)
+        if cluster not in seen:
+            seen.add(cluster)
+            kept.append(chunk_id)
+    return kept
+
+
+def dedup_stats(owner_id: int = None) -> dict:
+    """Chunks, distinct clusters and the share of chunks that are near-duplicates (dedup ratio)."""
+    where, params = ("WHERE owner_id = ?", (owner_id,)) if owner_id is not None else ("", ())
+    with _lock:
+        conn = _get_connection()
+        chunks, clusters = conn.execute(f"SELECT COUNT(*), COUNT(DISTINCT cluster) FROM signatures {where}", params).fetchone()
+    return {
+        "chunks": chunks,
+        "clusters": clusters,
+        "duplicates": chunks - clusters,
+        "dedup_ratio": round((chunks - clusters) / chunks, 4) if chunks else 0.0,
+    }
+
+
+def rebuild(batches):
+    """Re-creates the index from get()-shaped chunk batches (e.g. vector_store.scan())."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM signatures")
+        conn.execute("DELETE FROM bands")
+        conn.commit()
+
+    for batch in batches:
+        add_chunks(batch["ids"], batch["documents"], batch["metadatas"])
+    print(f"Near-duplicate index rebuilt: {dedup_stats()}")
+
+
+if __name__ == "__main__":
+    # python -m utils.near_duplicates [owner_id]  (dedup ratio)
+    # python -m utils.near_duplicates rebuild     (backfills the index from the vector store)
+    import sys
+    if sys.argv[1:2] == ["rebuild"]:
+        from utils.vector_store import vector_store
+        rebuild(vector_store.scan())
+    else:
+        print(dedup_stats(int(sys.argv[1]) if len(sys.argv) > 1 else None))
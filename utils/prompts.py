@@ -0,0 +1,303 @@
+import hashlib
+import threading
+
+# Every template is a byte-stable static prefix (instructions, rules, output format) followed by the
+# variable part (instruction variant, retrieved context, question). Providers cache prompt prefixes,
+# so nothing request-specific may appear in the prefix, and the prefix text must never be rebuilt
+# from indented f-strings. Bump a template's version whenever its prefix or layout changes.
+
+USER_TURN = "\n\n<|eot_id|><|start_header_id|>user<|end_header_id|>\n\n"
+ASSISTANT_TURN = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
+
+
+class PromptTemplate:
+    def __init__(self, name: str, version: str, static_prefix: str, variable_part: str):
+        self.name = name
+        self.version = version
+        self.static_prefix = static_prefix
+        self.variable_part = variable_part
+        self.prefix_hash = hashlib.sha256(static_prefix.encode("utf-8")).hexdigest()[:12]
+
+    def render(self, **variables) -> str:
+        # Only the variable part is formatted, so braces in the static rules are never interpreted
+        return self.static_prefix + self.variable_part.format(**variables)
+
+
+SUMMARY_SYSTEM = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are a professional summarization assistant.
+Your task is to generate structured summaries with **numbered citations** matching the source content.
+
+### Summary Rules
+1. Base your summary ONLY on the provided content.
+2. Every major claim or sentence must include at least one citation using bracket format:
+**[1]**, **[2]**, **[3]**, etc.
+3. Citations must correspond to the source chunks provided in the input.
+4. After writing the summary, include a **References** section list where each number maps to:
+- The filename
+- Section or part name (if provided in the chunk)
+Example:
+`[1] (FYP.pdf, Section: "Problem Statement")`
+`[2] (FYP.pdf, Section: "Market Growth")`
+5. Maintain a clean and natural writing style while preserving traceability.
+6. For multi-paragraph summaries:
+- Group related information together
+- Use headings reflecting the document structure
+- Still use numeric citations for each claim
+
+### Output Format (STRICT)
+Your output must follow **this exact structure**:
+
+**Summary:**
+SUMMARY TEXT WITH [1], [2], [3]...
+
+**References:**
+[1] (filename, section/part: "...")
+[2] (...)
+[3] (...)
+
+### Formatting Rules (STRICT)
+- Each reference **must appear on its own line**.
+- Do NOT merge references into a single paragraph.
+- References must not be inline or comma-separated.
+- No text is allowed after the References section."""
+
+REPORT_SYSTEM = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are an expert report writer specializing in creating structured, well-cited analysis reports with precise references.
+Your task is to generate a clean, organized report using numbered citations that correspond to a References section.
+
+### Citation Rules
+1. Every major statement, claim, insight, or conclusion must include at least one numbered citation: [1], [2], [3], etc.
+2. Citations must reference the source chunks included in the input.
+3. For each citation number, include a corresponding entry in the References section with:
+- Filename
+- Section/subsection/topic/page (when provided)
+
+Example Reference Entries:
+`[1] (FYP.pdf, section: "Methods", topic: "Data Analysis")`
+
+### Section-Specific Requirements
+**Executive Summary**
+- Provide a high-level overview.
+- Each key point must include citations like [1], [2].
+- When multiple sections contributed to the point, use multiple citations: [1][3].
+
+**Key Findings**
+- Present findings as clear bullet points or short paragraphs.
+- Each finding must cite exact source sections or topics.
+
+**Detailed Analysis**
+- Organize the analysis to follow the structure of the original document.
+- Cite specific subsections and topics for every analytical point.
+- When synthesizing across documents or across sections, use multiple citations: [2][4][5].
+
+**Recommendations**
+- Each recommendation must link to the evidence that supports it.
+- Use citations pointing to the relevant findings or data sources.
+
+### Output Format (STRICT)
+Your final output must follow **exactly** this structure:
+
+Executive Summary
+(Paragraphs with citations like [1], [2], [3]...)
+
+Key Findings
+- Finding 1 [1]
+- Finding 2 [2][3]
+- Finding 3 [4]
+
+Detailed Analysis
+(Structured sections with citations)
+
+Recommendations
+(Recommendations with citations)
+
+References:
+[1] (filename, section: "...", topic: "...")
+[2] (filename, section: "...", topic: "...")
+[3] (filename, section: "...", topic: "...")
+
+### Reference Formatting Rules (STRICT)
+- Each reference MUST appear on its own newline.
+- References must NOT be inline, comma-separated, or merged.
+- No text should appear after the References section.
+- The number of reference entries must match all citation numbers used in the report."""
+
+RAG_SYSTEM = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are a reliable document-grounded Q&A assistant.
+Your role is to answer questions using ONLY the provided context chunks and to cite every factual statement with numbered citations.
+
+### Rules for Answering
+1. Use ONLY the provided context chunks—never add outside knowledge.
+2. Every factual statement must include at least one numbered citation: [1], [2], [3], etc.
+3. When multiple documents support a statement, use multiple citations: [1][3][5].
+4. If the documents contain contradictory information, clearly state this with citations.
+5. If the answer cannot be fully answered from the context, say so explicitly.
+6. Structure long answers using paragraphs or bullet points.
+7. All citations must correspond to entries in a **References** section at the end.
+
+### Output Format (STRICT)
+Your response must follow this exact format:
+
+Answer:
+(Paragraphs or bullet points with citations like [1], [2][4], [3]...)
+
+References:
+[1] (filename, section: "..." if provided)
+[2] (filename, section: "...")
+[3] (...)
+
+### Reference Formatting Rules (STRICT)
+- Each reference MUST appear on its own line.
+- Do NOT merge all references into a single sentence.
+- The References list must include ALL citation numbers used.
+- No content is allowed after the References section."""
+
+CLASSIFY_INSTRUCTIONS = """You are a document classification expert. Analyze the following text preview and classify its primary purpose.
+Your answer MUST be a single word from this list: [academic, business, legal_policy, generic].
+
+- 'academic': For research papers, dissertations, lectures, scholarly articles.
+- 'business': For business reports, meeting notes, strategy documents, corporate memos.
+- 'legal_policy': For insurance policies, legal contracts, claims, risk assessments, regulatory files.
+- 'generic': For all other document types (articles, books, etc.)."""
+
+SUMMARY_INSTRUCTIONS = {
+    "short": (
+        "Write a concise, one-paragraph summary of the provided content. "
+        "Include numbered citations like [1], [2], etc., that map directly to the 'reference list'."
+    ),
+    "long": (
+        "Write a detailed, multi-paragraph summary of the provided content. "
+        "Use headings when appropriate and include numbered citations like [1], [2], etc., "
+        "that map directly to the reference list."
+    ),
+}
+
+REPORT_INSTRUCTIONS = {
+    "formal": """Analyze the following content and structure it into a formal business report. The report must include the following sections:
+1.  **Executive Summary:** A brief, high-level overview of the document's main points.
+2.  **Key Findings:** A bulleted list of the most critical insights, data, and conclusions.
+3.  **Detailed Analysis:** An in-depth exploration of the key topics.
+4.  **Conclusion & Recommendations:** A summary of the analysis and actionable recommendations, if applicable.
+Maintain a professional, objective, and clear tone throughout.""",
+    "academic": """Analyze the following content and structure it into a formal academic report. The report must include the following sections:
+1.  **Abstract:** A concise summary of the document's purpose, methods, key findings, and conclusions.
+2.  **Introduction:** An overview of the topic and the document's main arguments.
+3.  **Discussion of Findings:** A detailed analysis and interpretation of the key points presented in the content.
+4.  **Conclusion:** A summary of the main arguments and their implications.
+Maintain a formal, scholarly tone and use precise language.""",
+    "business_insights": """Analyze the following business document and generate a Business Intelligence report. Focus on:
+1. Key Performance Indicators (KPIs) mentioned or implied.
+2. Strategic Opportunities or Threats.
+3. Actionable Recommendations for management.""",
+    "risk_analysis": """Analyze the following policy, claim, or risk document and generate a structured Risk Analysis Brief. Extract:
+1. Key Terms and Definitions.
+2. A list of specific Exclusions or Limitations.
+3. Underwriting Insights or potential Claim Triggers.
+4. A final assessment of the overall risk level.""",
+}
+DEFAULT_REPORT_INSTRUCTION = "Generate a general report based on the following text."
+
+TEMPLATES = {
+    template.name: template for template in [
+        PromptTemplate(
+            "summary", "summary-v2",
+            SUMMARY_SYSTEM + USER_TURN,
+            "{instruction}\n\nHere is the content. Each chunk includes source metadata:\n\n"
+            "--- CONTENT START ---\n{context}\n--- CONTENT END ---\n\n" + ASSISTANT_TURN,
+        ),
+        PromptTemplate(
+            "report", "report-v2",
+            REPORT_SYSTEM + USER_TURN,
+            "{instruction}\n\nHere is the source content (each chunk is prefixed with its source):\n"
+            "--- CONTENT START ---\n{context}\n--- CONTENT END ---" + ASSISTANT_TURN,
+        ),
+        PromptTemplate(
+            "rag", "rag-v2",
+            RAG_SYSTEM + USER_TURN + "Here are the context chunks (each prefixed with its SOURCE label):\n\n--- CONTEXT START ---\n",
+            "{context}\n--- CONTEXT END ---\n\nQuestion: {question}\n\n"
+            "Please provide a detailed, citation-supported answer following the required structure.\n" + ASSISTANT_TURN,
+        ),
+        PromptTemplate(
+            # Same static prefix as "rag", so conversation turns share its provider-side prefix cache
+            "rag_conversation", "rag-conversation-v1",
+            RAG_SYSTEM + USER_TURN + "Here are the context chunks (each prefixed with its SOURCE label):\n\n--- CONTEXT START ---\n",
+            "{context}\n--- CONTEXT END ---\n\n"
+            "Conversation so far (use it only to understand what the question refers to; cite the context chunks, never the conversation):\n"
+            "{history}\n\nQuestion: {question}\n\n"
+            "Please provide a detailed, citation-supported answer following the required structure.\n" + ASSISTANT_TURN,
+        ),
+        PromptTemplate(
+            "conversation_summary", "conversation-summary-v1",
+            "Update the running summary of a conversation about the user's documents. Keep it under 150 words.\n"
+            "Keep what the user is trying to find out, the topics covered and the key facts given in answers\n"
+            "(names, figures, dates, numbered points) so later questions like \"expand on point 2\" can be resolved.\n\n",
+            "Current summary:\n{summary}\n\nNew exchange:\nUser: {question}\nAssistant: {answer}\n\nUpdated summary:",
+        ),
+        PromptTemplate(
+            "classify", "classify-v2",
+            CLASSIFY_INSTRUCTIONS + "\n\nText Preview:\n---\n",
+            "{preview}\n---\nClassification:",
+        ),
+        PromptTemplate(
+            "map", "map-v1",
+            "You are summarizing one part of a longer document.\n"
+            "Write a dense, factual summary of this part in at most 250 words. Keep names, figures, dates,\n"
+            "defined terms and clause or section identifiers exactly as written. Do not add outside knowledge.\n\n"
+            "--- PART START ---\n",
+            "{chunk}\n--- PART END ---\n\nSummary of this part:",
+        ),
+        PromptTemplate(
+            "reduce", "reduce-v1",
+            "Combine the following partial summaries of consecutive parts of one document\n"
+            "into a single dense, factual summary of at most 400 words. Keep names, figures, dates and\n"
+            "section identifiers. Do not add outside knowledge.\n\n",
+            "{partials}\n\nCombined summary:",
+        ),
+    ]
+}
+
+_lock = threading.Lock()
+# Per template: calls, prompt (input) tokens, of which served from the provider's prefix cache, output tokens
+stats = {}
+
+
+def get_template(name: str) -> PromptTemplate:
+    return TEMPLATES[name]
+
+
+def render(name: str, **variables) -> str:
+    return TEMPLATES[name].render(**variables)
+
+
+def summary_instruction(summary_type: str) -> str:
+    return SUMMARY_INSTRUCTIONS["short" if summary_type == "short" else "long"]
+
+
+def report_instruction(report_type: str) -> str:
+    return REPORT_INSTRUCTIONS.get(report_type, DEFAULT_REPORT_INSTRUCTION)
+
+
+def record_usage(template_name: str, usage: dict):
+    """
+    Records the token usage a provider reported for one call (LangChain usage_metadata:
+    input_tokens, output_tokens and input_token_details.cache_read). Missing usage is ignored.
+    """
+    if not usage:
+        return
+    template = TEMPLATES.get(template_name)
+    key = f"{template_name}@{template.version}" if template else (template_name or "untemplated")
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    with _lock:
+        entry = stats.setdefault(key, {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0})
+        entry["calls"] += 1
+        entry["input_tokens"] += usage.get("input_tokens") or 0
+        entry["cached_tokens"] += cached_tokens
+        entry["output_tokens"] += usage.get("output_tokens") or 0
+
+
+def cache_hit_ratio(template_name: str) -> float:
+    """Share of prompt tokens served from the provider's prefix cache, across all versions of a template."""
+    with _lock:
+        entries = [entry for key, entry in stats.items() if key.split("@")[0] == template_name]
+    input_tokens = sum(entry["input_tokens"] for entry in entries)
+    return sum(entry["cached_tokens"] for entry in entries) / input_tokens if input_tokens else 0.0
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+from utils.shared_models import embedding_model
+
+# In-process LRU of question embeddings, keyed by whitespace/case-normalized text
+MAX_ENTRIES = 4096
+
+# Fixed retrieval queries of summaries and reports; embedded once at load and never evicted
+SUMMARY_QUERY = "What is the main topic and key points of this document?"
+REPORT_QUERY = "What are the main findings, analysis points, and conclusions in this document?"
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _key(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+_pinned = {_key(text): embedding_model.encode(text).tolist() for text in (SUMMARY_QUERY, REPORT_QUERY)}
+
+
+def get(text: str) -> list:
+    """The cached embedding of `text`, or None (lets async callers skip the executor on a hit)."""
+    key = _key(text)
+    with _lock:
+        embedding = _pinned.get(key)
+        if embedding is None:
+            embedding = _entries.get(key)
+            if embedding is not None:
+                _entries.move_to_end(key)
+        stats["hits" if embedding is not None else "misses"] += 1
+    return embedding
+
+
+def compute(text: str) -> list:
+    """Runs the embedding model for `text` (after a get() miss) and caches the result."""
+    embedding = embedding_model.encode(text).tolist()
+    with _lock:
+        _entries[_key(text)] = embedding
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            stats["evictions"] += 1
+    return embedding
+
+
+def compute_many(texts: list) -> list:
+    """compute() for several texts in one batched forward pass."""
+    if not texts:
+        return []
+    embeddings = embedding_model.encode(texts).tolist()
+    with _lock:
+        for text, embedding in zip(texts, embeddings):
+            _entries[_key(text)] = embedding
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            stats["evictions"] += 1
+    return embeddings
+
+
+def embed_queries(texts: list) -> list:
+    """Embeddings of several questions; the cache misses are encoded together."""
+    embeddings = [get(text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    for i, embedding in zip(missing, compute_many([texts[i] for i in missing])):
+        embeddings[i] = embedding
+    return embeddings
+
+
+def embed_query(text: str) -> list:
+    """Embedding of a question as a list, computed at most once per normalized text while it stays cached."""
+    embedding = get(text)
+    return embedding if embedding is not None else compute(text)
+
+
+def hit_ratio() -> float:
+    total = stats["hits"] + stats["misses"]
+    return stats["hits"] / total if total else 0.0
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+from sources.config import settings
+from sources.database import SessionLocal
+from sources import models
+from utils.shared_models import embedding_model
+from utils import keyword_index, element_store, near_duplicates
+from utils.retrieval import chunk_id_for, split_into_chunks
+from utils.clustering import representative_indices
+from utils.agentic_workflow import REPRESENTATIVE_CHUNKS
+from utils.vector_store import vector_store, index_spec, read_index_state, write_index_state
+from repo.documents import UPLOAD_DIRECTORY
+
+# Zero-downtime reindex: documents are re-chunked and re-embedded from their stored extraction
+# elements (utils/element_store; Document.content for older documents) into a shadow index
+# generation while the active one keeps serving; new uploads are dual-written (see
+# GenerationalVectorStore). The switch is one atomic rename of the index state file.
+REINDEX_PROGRESS_PATH = "./reindex_progress.json"
+# Documents whose chunks are searchable
+INDEXED_STATUSES = ("ready_for_chat", "processing_ai", "complete")
+# Time for API processes to notice the shadow before the build starts; adds that were already
+# under way are picked up by the catch-up pass
+DUAL_WRITE_GRACE_SECONDS = 5.0
+
+
+def _read_progress() -> dict:
+    if not os.path.exists(REINDEX_PROGRESS_PATH):
+        return None
+    with open(REINDEX_PROGRESS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_progress(progress: dict):
+    tmp = f"{REINDEX_PROGRESS_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(tmp, REINDEX_PROGRESS_PATH)
+
+
+def _new_progress(generation: int) -> dict:
+    return {"generation": generation, "last_doc_id": 0, "documents": 0, "chunks": 0,
+            "started_at": time.time(), "completed": False, "layouts": {}}
+
+
+def _indexed_documents(db, after_id: int = 0, limit: int = None) -> list:
+    query = db.query(models.Document).filter(
+        models.Document.id > after_id,
+        models.Document.status.in_(INDEXED_STATUSES),
+        models.Document.content.isnot(None),
+    ).order_by(models.Document.id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def _index_document(store, doc) -> dict:
+    """Re-chunks and re-embeds one document into `store`; returns its layout (chunk count, representatives)."""
+    # A resumed run may already have written part of this document
+    store.delete(doc.owner_id, where={"doc_id": doc.id})
+    elements = element_store.load(doc.id)
+    chunks = split_into_chunks(element_store.to_text(elements) if elements is not None else doc.content)
+    if not chunks:
+        return {"chunk_count": 0, "representative_chunks": []}
+    embeddings = embedding_model.encode(chunks)
+    chunk_ids = [chunk_id_for(doc.id, i) for i in range(len(chunks))]
+    filepath = os.path.join(UPLOAD_DIRECTORY, doc.filename)
+    metadatas = [{"doc_id": doc.id, "owner_id": doc.owner_id, "filename": filepath} for _ in chunks]
+    store.add(doc.owner_id, chunk_ids, embeddings, chunks, metadatas)
+    representative = representative_indices(embeddings, REPRESENTATIVE_CHUNKS)
+    return {"chunk_count": len(chunks), "representative_chunks": [chunk_ids[i] for i in representative]}
+
+
+def _catch_up(store, progress: dict) -> list:
+    """
+    Indexes documents the build skipped: not ready when it passed them, or added before dual
+    writes began (or, after a switch, by processes still on the previous spec). Returns their ids.
+    """
+    db = SessionLocal()
+    try:
+        indexed = []
+        for doc in _indexed_documents(db):
+            if str(doc.id) in progress["layouts"]:
+                continue
+            if store.get(doc.owner_id, ids=[chunk_id_for(doc.id, 0)], include=[])["ids"]:
+                continue  # dual-written by the upload itself, which also recorded its layout
+            progress["layouts"][str(doc.id)] = _index_document(store, doc)
+            indexed.append(doc.id)
+        return indexed
+    finally:
+        db.close()
+
+
+def _align_documents(store, layouts: dict, reindexed: list):
+    """
+    Records the generation's chunk layouts on the documents and brings the keyword and
+    near-duplicate indexes in line with it: documents re-chunked in `reindexed`, and any whose
+    chunks changed after the sparse indexes were built (uploads and deletes during the switch).
+    """
+    reindexed = set(reindexed)
+    db = SessionLocal()
+    try:
+        for doc in _indexed_documents(db):
+            layout = layouts.get(str(doc.id))
+            if layout is not None:
+                doc.chunk_count = layout["chunk_count"]
+                doc.representative_chunks = json.dumps(layout["representative_chunks"])
+        db.commit()
+        for doc in _indexed_documents(db):
+            ids = set(store.get(doc.owner_id, where={"doc_id": doc.id}, include=[])["ids"])
+            if doc.id not in reindexed and ids == keyword_index.chunk_ids_of(doc.id) and ids == near_duplicates.chunk_ids_of(doc.id):
+                continue
+            chunks = store.get(doc.owner_id, where={"doc_id": doc.id}, include=["documents", "metadatas"])
+            keyword_index.replace_document(doc.id, chunks["ids"], chunks["documents"], chunks["metadatas"])
+            near_duplicates.replace_document(doc.id, chunks["ids"], chunks["documents"], chunks["metadatas"])
+    finally:
+        db.close()
+
+
+def start(switch_when_done: bool = False):
+    """Builds (or resumes building) the shadow generation, throttled; switches at the end on request."""
+    state = read_index_state()
+    progress = _read_progress()
+    spec = index_spec()
+
+    if state["shadow"] is None:
+        generation = max([state["active"], state.get("previous") or 0] + [int(key) for key in state["specs"]]) + 1
+        state["shadow"] = generation
+        state["specs"][str(generation)] = spec
+        write_index_state(state)
+        progress = _new_progress(generation)
+        _write_progress(progress)
+        print(f"Building shadow index generation {generation} ({spec}); new uploads are dual-written.")
+        time.sleep(DUAL_WRITE_GRACE_SECONDS)
+    elif state["specs"].get(str(state["shadow"])) != spec:
+        print(
+            f"Shadow generation {state['shadow']} is being built with {state['specs'].get(str(state['shadow']))}, "
+            f"not the current settings ({spec}). Run `python -m utils.reindex abort` first."
+        )
+        return
+    else:
+        if not progress or progress["generation"] != state["shadow"]:
+            progress = _new_progress(state["shadow"])
+        print(f"Resuming shadow index generation {state['shadow']} after document {progress['last_doc_id']}.")
+
+    store = vector_store.store(state["shadow"])
+    db = SessionLocal()
+    try:
+        total = len(_indexed_documents(db))
+        while True:
+            batch = _indexed_documents(db, progress["last_doc_id"], settings.REINDEX_BATCH_DOCUMENTS)
+            if not batch:
+                break
+            for doc in batch:
+                layout = _index_document(store, doc)
+                progress["layouts"][str(doc.id)] = layout
+                progress["last_doc_id"] = doc.id
+                progress["documents"] += 1
+                progress["chunks"] += layout["chunk_count"]
+            # Documents deleted while being reindexed: the delete may have reached the shadow before our add
+            remaining = {doc_id for (doc_id,) in db.query(models.Document.id).filter(models.Document.id.in_([doc.id for doc in batch]))}
+            for doc in batch:
+                if doc.id not in remaining:
+                    store.delete(doc.owner_id, where={"doc_id": doc.id})
+                    progress["layouts"].pop(str(doc.id), None)
+            _write_progress(progress)
+            print(f"Reindexed {progress['documents']}/{total} documents ({progress['chunks']} chunks)")
+            db.expire_all()
+            time.sleep(settings.REINDEX_THROTTLE_SECONDS)
+    finally:
+        db.close()
+
+    caught_up = _catch_up(store, progress)
+    progress["completed"] = True
+    _write_progress(progress)
+    print(f"Shadow generation {state['shadow']} is complete ({len(caught_up)} document(s) caught up).")
+    if switch_when_done:
+        switch()
+    else:
+        print("Run `python -m utils.reindex switch` to serve reads from it.")
+
+
+def switch():
+    """
+    Makes the completed shadow generation the active one. Its keyword and near-duplicate indexes
+    are built into shadow tables first and swapped in right after the state change, so searches
+    never mix generations for longer than that.
+    """
+    state = read_index_state()
+    progress = _read_progress()
+    if state["shadow"] is None or not progress or not progress["completed"]:
+        print("No completed shadow generation to switch to; run `python -m utils.reindex start` first.")
+        return
+
+    store = vector_store.store(state["shadow"])
+    # Uploads that finished since the build completed without being dual-written
+    _catch_up(store, progress)
+    _write_progress(progress)
+    keyword_index.build_shadow(store.scan())
+    near_duplicates.build_shadow(store.scan())
+    print("Keyword and near-duplicate indexes built for the new generation.")
+
+    state["previous"], state["active"], state["shadow"] = state["active"], state["shadow"], None
+    write_index_state(state)
+    keyword_index.promote_shadow()
+    near_duplicates.promote_shadow()
+    print(f"Switched reads to index generation {state['active']} (generation {state['previous']} is kept until `cleanup`).")
+
+    # Uploads that finished between the catch-up and the state change without being dual-written
+    caught_up = _catch_up(store, progress)
+    _align_documents(store, progress["layouts"], caught_up)
+    os.remove(REINDEX_PROGRESS_PATH)
+    print(f"Document layouts, keyword and near-duplicate indexes updated ({len(caught_up)} document(s) caught up).")
+
+
+def abort():
+    """Stops dual writes and deletes the shadow generation."""
+    state = read_index_state()
+    if state["shadow"] is None:
+        print("No shadow generation is being built.")
+        return
+    shadow = state["shadow"]
+    state["shadow"] = None
+    state["specs"].pop(str(shadow), None)
+    write_index_state(state)
+    vector_store.store(shadow).drop()
+    if os.path.exists(REINDEX_PROGRESS_PATH):
+        os.remove(REINDEX_PROGRESS_PATH)
+    print(f"Shadow generation {shadow} aborted and deleted.")
+
+
+def cleanup():
+    """
+    Deletes the generation that was active before the last switch. Run it once every process
+    uses the new settings: documents that processes on the old spec added to the previous
+    generation after the switch are indexed into the active one first.
+    """
+    state = read_index_state()
+    if not state.get("previous"):
+        print("No previous generation to delete.")
+        return
+    store = vector_store.store(state["active"])
+    layouts = {}
+    caught_up = _catch_up(store, {"layouts": layouts})
+    if caught_up:
+        _align_documents(store, layouts, caught_up)
+        print(f"Indexed {len(caught_up)} document(s) added under the previous settings into generation {state['active']}.")
+    previous = state["previous"]
+    state["previous"] = None
+    state["specs"].pop(str(previous), None)
+    write_index_state(state)
+    vector_store.store(previous).drop()
+    print(f"Index generation {previous} deleted.")
+
+
+def status():
+    state = read_index_state()
+    progress = _read_progress()
+    print(f"Active generation: {state['active']} {state['specs'].get(str(state['active'])) or ''}")
+    if state.get("previous"):
+        print(f"Previous generation (no longer written, delete with `cleanup`): {state['previous']}")
+    if state["shadow"] is None:
+        print("No reindex in progress.")
+        return
+    db = SessionLocal()
+    try:
+        total = len(_indexed_documents(db))
+    finally:
+        db.close()
+    elapsed = time.time() - progress["started_at"]
+    rate = progress["documents"] / elapsed if elapsed > 0 else 0.0
+    eta = (total - progress["documents"]) / rate if rate and not progress["completed"] else 0.0
+    print(
+        f"Shadow generation {state['shadow']} {state['specs'].get(str(state['shadow']))}: "
+        f"{progress['documents']}/{total} documents, {progress['chunks']} chunks, "
+        f"{'complete' if progress['completed'] else f'about {eta / 60:.0f} min left'}"
+    )
+
+
+if __name__ == "__main__":
+    # python -m utils.reindex start [--switch] | status | switch | abort | cleanup
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "start":
+        start(switch_when_done="--switch" in sys.argv)
+    elif command in ("status", "switch", "abort", "cleanup"):
+        {"status": status, "switch": switch, "abort": abort, "cleanup": cleanup}[command]()
+    else:
+        print(f"Unknown command '{command}' (expected start, status, switch, abort or cleanup)")
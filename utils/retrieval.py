@@ -0,0 +1,348 @@
+import time
+import json
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from sources.config import settings
+from sources.database import SessionLocal
+from sources import models
+from utils.shared_models import reranker_model
+from utils import keyword_index, near_duplicates
+from utils.vector_partitions import owner_of_document
+from utils.vector_store import vector_store
+
+RRF_K = 60
+# Candidates fetched per requested result, so collapsing near-duplicates still leaves n_results chunks
+COLLAPSE_OVERFETCH = 2
+
+# Second-stage settings per endpoint: over-fetch `fetch_k` candidates, rescore them with the
+# cross-encoder and keep the `top_k` most relevant yet distinct chunks (MMR with `mmr_lambda`).
+RERANK_SETTINGS = {
+    "document_chat": {"enabled": True, "fetch_k": 24, "top_k": 5, "mmr_lambda": 0.7, "batch_size": 8},
+    "library_chat": {"enabled": True, "fetch_k": 32, "top_k": 6, "mmr_lambda": 0.6, "batch_size": 8},
+}
+
+
+def split_into_chunks(text: str) -> list:
+    """Ingestion chunking (CHUNK_SIZE / CHUNK_OVERLAP characters); the reindex job uses the same."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP)
+    return splitter.split_text(text)
+
+
+def chunk_id_for(doc_id: int, index: int) -> str:
+    return f"doc{doc_id}_chunk{index}"
+
+
+def chunk_index_of(chunk_id: str) -> int:
+    return int(chunk_id.rsplit("_chunk", 1)[-1])
+
+
+def document_id_of(chunk_id: str) -> int:
+    return int(chunk_id.split("_chunk", 1)[0][len("doc"):])
+
+
+def _get_by_ids(ids: list, include: list) -> dict:
+    """vector_store.get(ids=...) across partitions: ids are grouped by the owner of their document."""
+    groups = {}
+    for chunk_id in ids:
+        groups.setdefault(owner_of_document(document_id_of(chunk_id)), []).append(chunk_id)
+
+    merged = {"ids": [], **{field: [] for field in include}}
+    for owner_id, group_ids in groups.items():
+        stored = vector_store.get(owner_id, ids=group_ids, include=include)
+        merged["ids"].extend(stored["ids"])
+        for field in include:
+            merged[field].extend(stored[field])
+    return merged
+
+
+def document_layout(doc_id: int) -> tuple:
+    """
+    (chunk_count, representative_chunk_ids) recorded at ingestion; either is None for
+    documents ingested before it was tracked.
+    """
+    db = SessionLocal()
+    try:
+        doc = db.query(models.Document).filter(models.Document.id == doc_id).first()
+        if not doc:
+            return None, None
+        representatives = json.loads(doc.representative_chunks) if doc.representative_chunks else None
+        return doc.chunk_count, representatives
+    finally:
+        db.close()
+
+
+def document_chunk_count(doc_id: int) -> int:
+    """Chunk count recorded at ingestion, or None for documents ingested before it was tracked."""
+    return document_layout(doc_id)[0]
+
+
+def fetch_document_chunks(doc_id: int, chunk_count: int) -> dict:
+    """Fetches every chunk of a document by id, in document order, as a Chroma-shaped result."""
+    return fetch_chunks_by_id([chunk_id_for(doc_id, i) for i in range(chunk_count)])
+
+
+def fetch_chunks_by_id(ids: list) -> dict:
+    """Fetches chunks by id as a Chroma-shaped result, keeping the order of `ids`."""
+    stored = _get_by_ids(ids, ["documents", "metadatas"])
+    by_id = {chunk_id: (text, meta) for chunk_id, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"])}
+    ordered_ids = [chunk_id for chunk_id in ids if chunk_id in by_id]
+    return {
+        "ids": [ordered_ids],
+        "documents": [[by_id[chunk_id][0] for chunk_id in ordered_ids]],
+        "metadatas": [[by_id[chunk_id][1] for chunk_id in ordered_ids]],
+    }
+
+
+def all_document_chunks(doc_id: int) -> dict:
+    """Every chunk of a document in document order (by recorded chunk count, else by id suffix)."""
+    chunk_count = document_chunk_count(doc_id)
+    if chunk_count:
+        return fetch_document_chunks(doc_id, chunk_count)
+
+    stored = vector_store.get(owner_of_document(doc_id), where={"doc_id": doc_id}, include=["documents", "metadatas"])
+    order = sorted(range(len(stored["ids"])), key=lambda i: chunk_index_of(stored["ids"][i]))
+    return {
+        "ids": [[stored["ids"][i] for i in order]],
+        "documents": [[stored["documents"][i] for i in order]],
+        "metadatas": [[stored["metadatas"][i] for i in order]],
+    }
+
+
+def small_document_chunks(doc_id: int, budget: int) -> dict:
+    """
+    Fast path for documents that fit the chunk budget entirely: returns all their chunks in
+    document order (no embedding call or ANN query), or None when similarity search is needed.
+    """
+    chunk_count = document_chunk_count(doc_id)
+    if not chunk_count or chunk_count > budget:
+        return None
+    return fetch_document_chunks(doc_id, chunk_count)
+
+
+def document_context_chunks(doc_id: int, budget: int) -> dict:
+    """
+    Context for single-document summaries and reports without a vector query: all chunks of a
+    small document, otherwise the representative chunks picked at ingestion (best-covering first,
+    presented in document order). Returns None when neither is recorded.
+    """
+    chunk_count, representatives = document_layout(doc_id)
+    if chunk_count and chunk_count <= budget:
+        return fetch_document_chunks(doc_id, chunk_count)
+    if representatives:
+        selected = sorted(representatives[:budget], key=chunk_index_of)
+        return fetch_chunks_by_id(selected)
+    return None
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """Fuses several best-first lists of chunk ids into one best-first list (score = sum of 1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _where_filter(owner_id: int = None, doc_id: int = None) -> dict:
+    where_filter = {}
+    if doc_id is not None:
+        where_filter['doc_id'] = doc_id
+    elif owner_id is not None:
+        where_filter['owner_id'] = owner_id
+    return where_filter
+
+
+def _fuse(dense: dict, row: int, sparse: list, n_results: int) -> dict:
+    """Fuses row `row` of a dense query result with keyword hits (RRF), collapsing near-duplicates."""
+    chunks = {}
+    dense_ids = dense["ids"][row] if dense.get("ids") else []
+    for chunk_id, text, meta in zip(dense_ids, dense["documents"][row], dense["metadatas"][row]):
+        chunks[chunk_id] = (text, meta)
+    for hit in sparse:
+        chunks.setdefault(hit["id"], (hit["document"], hit["metadata"]))
+
+    fused_ids = near_duplicates.collapse(reciprocal_rank_fusion([dense_ids, [hit["id"] for hit in sparse]]))[:n_results]
+    return {
+        "ids": [fused_ids],
+        "documents": [[chunks[chunk_id][0] for chunk_id in fused_ids]],
+        "metadatas": [[chunks[chunk_id][1] for chunk_id in fused_ids]],
+    }
+
+
+def hybrid_search(question: str, question_embedding: list, owner_id: int = None, doc_id: int = None, n_results: int = 8) -> dict:
+    """
+    Runs the dense Chroma query and the BM25 keyword query under the same doc/owner
+    filter and fuses both rankings with reciprocal rank fusion. Near-duplicate chunks
+    (drafts, versions, templates) are collapsed to their best-ranked one.
+    Returns a Chroma-shaped result ({"ids": [[...]], "documents": [[...]], "metadatas": [[...]]}).
+    """
+    where_filter = _where_filter(owner_id, doc_id)
+
+    # Only the owner's partition is searched, so latency follows one user's corpus size
+    partition_owner = owner_of_document(doc_id) if doc_id is not None else owner_id
+    fetch = n_results * COLLAPSE_OVERFETCH
+    dense = vector_store.query(partition_owner, question_embedding, fetch, where=where_filter)
+    sparse = keyword_index.search(question, n_results=fetch, doc_id=doc_id, owner_id=owner_id)
+    return _fuse(dense, 0, sparse, n_results)
+
+
+def hybrid_search_many(questions: list, question_embeddings: list, owner_id: int = None, doc_id: int = None, n_results: int = 8) -> list:
+    """hybrid_search for several questions in one scope, with a single multi-query dense request."""
+    where_filter = _where_filter(owner_id, doc_id)
+    partition_owner = owner_of_document(doc_id) if doc_id is not None else owner_id
+    fetch = n_results * COLLAPSE_OVERFETCH
+    dense = vector_store.query_many(partition_owner, question_embeddings, fetch, where=where_filter)
+    return [
+        _fuse(dense, row, keyword_index.search(question, n_results=fetch, doc_id=doc_id, owner_id=owner_id), n_results)
+        for row, question in enumerate(questions)
+    ]
+
+
+def _normalize_relevance(scores) -> np.ndarray:
+    """
+    Min-max scales relevance over the candidate pool to [0, 1], the range of the cosine redundancy
+    MMR subtracts; raw cross-encoder logits (about -10..10) would otherwise drown it out.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    spread = float(scores.max() - scores.min()) if len(scores) else 0.0
+    return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+
+def _cross_encoder_relevance(question: str, documents: list, batch_size: int = 8) -> np.ndarray:
+    return _normalize_relevance(reranker_model.predict([(question, doc) for doc in documents], batch_size=batch_size))
+
+
+def _mmr_select(relevance: np.ndarray, embeddings: np.ndarray, top_k: int, mmr_lambda: float) -> list:
+    """Greedy maximal-marginal-relevance selection over [0, 1] relevance; returns candidate indices in selection order."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.clip(norms, 1e-12, None)
+    similarity = unit @ unit.T
+
+    selected = []
+    remaining = list(range(len(relevance)))
+    while remaining and len(selected) < top_k:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        mmr_scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = remaining[int(np.argmax(mmr_scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def rerank_with_mmr(question: str, results: dict, top_k: int, mmr_lambda: float = 0.7, batch_size: int = 8) -> dict:
+    """
+    Rescores Chroma-shaped candidates with the cross-encoder (in batches) and applies MMR
+    over their stored embeddings so only the best `top_k` distinct chunks are kept.
+    """
+    ids = results["ids"][0]
+    if len(ids) <= 1:
+        return results
+
+    documents = results["documents"][0]
+    metadatas = results["metadatas"][0]
+
+    relevance = _cross_encoder_relevance(question, documents, batch_size)
+
+    stored = _get_by_ids(ids, ["embeddings"])
+    embedding_by_id = dict(zip(stored["ids"], stored["embeddings"]))
+    embeddings = np.asarray([embedding_by_id[chunk_id] for chunk_id in ids], dtype=np.float32)
+
+    order = _mmr_select(relevance, embeddings, top_k, mmr_lambda)
+    return {
+        "ids": [[ids[i] for i in order]],
+        "documents": [[documents[i] for i in order]],
+        "metadatas": [[metadatas[i] for i in order]],
+    }
+
+
+def fetch_embeddings(ids: list) -> dict:
+    """chunk id -> stored embedding for the stored ones among `ids`."""
+    stored = _get_by_ids(ids, ["embeddings"])
+    return {chunk_id: np.asarray(embedding, dtype=np.float32) for chunk_id, embedding in zip(stored["ids"], stored["embeddings"])}
+
+
+def rerank_pool(question: str, question_embedding: list, candidates: dict, embeddings: dict, top_k: int, mmr_lambda: float = 0.7) -> dict:
+    """
+    Picks the `top_k` most relevant yet distinct chunks of an already retrieved pool (Chroma-shaped,
+    with embeddings by id): cross-encoder relevance when reranking is enabled, cosine otherwise, then MMR.
+    """
+    ids = [chunk_id for chunk_id in candidates["ids"][0] if chunk_id in embeddings]
+    position = {chunk_id: i for i, chunk_id in enumerate(candidates["ids"][0])}
+    documents = [candidates["documents"][0][position[chunk_id]] for chunk_id in ids]
+    metadatas = [candidates["metadatas"][0][position[chunk_id]] for chunk_id in ids]
+    if not ids:
+        return {"ids": [[]], "documents": [[]], "metadatas": [[]]}
+
+    vectors = np.stack([embeddings[chunk_id] for chunk_id in ids])
+    if reranker_model is not None:
+        relevance = _cross_encoder_relevance(question, documents)
+    else:
+        query = np.asarray(question_embedding, dtype=np.float32)
+        relevance = _normalize_relevance((vectors @ query) / np.clip(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12, None))
+
+    order = _mmr_select(relevance, vectors, top_k, mmr_lambda)
+    return {
+        "ids": [[ids[i] for i in order]],
+        "documents": [[documents[i] for i in order]],
+        "metadatas": [[metadatas[i] for i in order]],
+    }
+
+
+def retrieve_context(question: str, question_embedding: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, allow_rerank: bool = True) -> dict:
+    """
+    First stage: hybrid dense + BM25 retrieval. Optional second stage (per endpoint): cross-encoder
+    reranking with MMR dedup, skipped when allow_rerank is False (degraded requests).
+    Stage timings are returned under "timings" (milliseconds).
+    """
+    endpoint = endpoint or ("document_chat" if doc_id is not None else "library_chat")
+    rerank = RERANK_SETTINGS.get(endpoint, {})
+    use_rerank = allow_rerank and reranker_model is not None and rerank.get("enabled", False)
+
+    timings = {}
+    started = time.perf_counter()
+    if doc_id is not None:
+        results = small_document_chunks(doc_id, budget=rerank["top_k"] if use_rerank else n_results)
+        if results is not None:
+            timings["fast_path_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            results["timings"] = timings
+            return results
+
+    results = hybrid_search(
+        question, question_embedding, owner_id=owner_id, doc_id=doc_id,
+        n_results=rerank["fetch_k"] if use_rerank else n_results
+    )
+    timings["first_stage_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    if use_rerank:
+        started = time.perf_counter()
+        results = rerank_with_mmr(question, results, rerank["top_k"], rerank["mmr_lambda"], rerank["batch_size"])
+        timings["rerank_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    results["timings"] = timings
+    return results
+
+
+def retrieve_context_many(questions: list, question_embeddings: list, owner_id: int = None, doc_id: int = None, n_results: int = 8, endpoint: str = None, allow_rerank: bool = True) -> list:
+    """retrieve_context for a batch of questions: one dense multi-query, or one fetch for small documents."""
+    endpoint = endpoint or ("document_chat" if doc_id is not None else "library_chat")
+    rerank = RERANK_SETTINGS.get(endpoint, {})
+    use_rerank = allow_rerank and reranker_model is not None and rerank.get("enabled", False)
+
+    if doc_id is not None:
+        results = small_document_chunks(doc_id, budget=rerank["top_k"] if use_rerank else n_results)
+        if results is not None:
+            return [results for _ in questions]
+
+    batch = hybrid_search_many(
+        questions, question_embeddings, owner_id=owner_id, doc_id=doc_id,
+        n_results=rerank["fetch_k"] if use_rerank else n_results
+    )
+    if use_rerank:
+        batch = [
+            rerank_with_mmr(question, results, rerank["top_k"], rerank["mmr_lambda"], rerank["batch_size"])
+            for question, results in zip(questions, batch)
+        ]
+    return batch
@@ -1,11 +1,13 @@
 import os
-import chromadb
 import torch
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, CrossEncoder
 from langchain.chat_models.base import init_chat_model
 from transformers import VitsModel, AutoTokenizer
 import whisper
 from sources.config import settings
+from utils.inference_backends import load_embedding_model, load_tts_model, TTS_MODEL_NAME
+from utils.llm_router import LLMRouter
+from utils.chroma_cluster import ChromaCluster
 
 from transformers import BarkModel, AutoProcessor
 from langchain_ollama.llms import OllamaLLM
@@ -17,26 +19,65 @@ os.environ["HF_TOKEN"] = settings.HF_TOKEN
 CHROMA_DB_PATH = "./chroma_db"
 CHROMA_COLLECTION_NAME = "documents"
 
-embedding_model = SentenceTransformer("BAAI/bge-m3")
-chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+embedding_model = load_embedding_model(settings.EMBEDDING_MODEL, settings.EMBEDDING_BACKEND, settings.ONNX_QUANTIZATION_CONFIG)
+# Local PersistentClient, or Chroma servers (CHROMA_SERVERS) with partitions placed by consistent hashing
+chroma_cluster = ChromaCluster(settings.CHROMA_SERVERS, CHROMA_DB_PATH)
+chroma_client = chroma_cluster.client_for(CHROMA_COLLECTION_NAME)
 chroma_collection = chroma_client.get_or_create_collection(name=CHROMA_COLLECTION_NAME)
 
+# <--- RERANKER CONFIG --->
+RERANKER_MODEL_NAME = "BAAI/bge-reranker-v2-m3"
+reranker_model = CrossEncoder(RERANKER_MODEL_NAME) if settings.RERANK_ENABLED else None
+
 # <--- LLM CONFIG --->
 #llm = Llama(model_path=LLM_MODEL_PATH, n_ctx=4096, verbose=False)
-#llm = OllamaLLM(model="llama3.1", n_ctx=4096, verbose=False)
-#llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
 
 OPEN_ROUTER_KEY = settings.OPEN_ROUTER_KEY
-llm = init_chat_model(
-    model="openai/gpt-oss-20b:free",
+# Completion cache keys use the primary model id; answers from failover providers are not cached
+LLM_MODEL_ID = "openai/gpt-oss-20b:free"
+GEMINI_MODEL_ID = "gemini-2.5-flash"
+LLM_SAMPLING_PARAMS = {"temperature": 0.1, "max_tokens": 4096, "top_p": 0.95}
+openrouter_llm = init_chat_model(
+    model=LLM_MODEL_ID,
     model_provider="openai",
     base_url="https://openrouter.ai/api/v1",
     api_key = OPEN_ROUTER_KEY,
-    temperature=0.1,
-    max_tokens=4096,
-    model_kwargs={"top_p" : 0.95}
+    temperature=LLM_SAMPLING_PARAMS["temperature"],
+    max_tokens=LLM_SAMPLING_PARAMS["max_tokens"],
+    model_kwargs={"top_p" : LLM_SAMPLING_PARAMS["top_p"]},
+    # Report token usage (incl. prefix-cache reads) on streamed responses too
+    stream_usage=True
     )
 
+# Providers in failover order: OpenRouter, then Gemini and a local Ollama model when configured
+llm_backends = [("openrouter", openrouter_llm)]
+if settings.GOOGLE_API_KEY:
+    llm_backends.append(("gemini", ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL_ID,
+        google_api_key=settings.GOOGLE_API_KEY,
+        temperature=LLM_SAMPLING_PARAMS["temperature"],
+        max_output_tokens=LLM_SAMPLING_PARAMS["max_tokens"],
+        top_p=LLM_SAMPLING_PARAMS["top_p"]
+    )))
+if settings.OLLAMA_MODEL:
+    llm_backends.append(("ollama", OllamaLLM(
+        model=settings.OLLAMA_MODEL,
+        base_url=settings.OLLAMA_BASE_URL,
+        temperature=LLM_SAMPLING_PARAMS["temperature"],
+        num_predict=LLM_SAMPLING_PARAMS["max_tokens"],
+        top_p=LLM_SAMPLING_PARAMS["top_p"]
+    )))
+llm = LLMRouter(llm_backends, default_hedge_delay=settings.LLM_HEDGE_DELAY_SECONDS)
+
+# Fast fallback for chat requests about to miss their deadline (see utils/degradation.py)
+FAST_LLM_MODEL_ID = "gemini-2.5-flash-lite"
+fast_llm = ChatGoogleGenerativeAI(
+    model=FAST_LLM_MODEL_ID,
+    google_api_key=settings.GOOGLE_API_KEY,
+    temperature=LLM_SAMPLING_PARAMS["temperature"],
+    max_output_tokens=1024
+) if settings.GOOGLE_API_KEY else None
+
 # <--- STT CONFIG --->
 transcription_model = whisper.load_model("small")
 
@@ -45,8 +86,8 @@ AUDIO_SAVE_DIRECTORY = "./audio_summaries"
 os.makedirs(AUDIO_SAVE_DIRECTORY, exist_ok=True)
 device = "cuda:0" if torch.cuda.is_available() else "cpu" 
 
-tts_tokenizer = AutoTokenizer.from_pretrained("facebook/mms-tts-eng")
-tts_model = VitsModel.from_pretrained("facebook/mms-tts-eng")
+tts_tokenizer = AutoTokenizer.from_pretrained(TTS_MODEL_NAME)
+tts_model = load_tts_model(TTS_MODEL_NAME, settings.TTS_BACKEND)
 
 # Bark model and processor once
 #tts_processor = AutoProcessor.from_pretrained("suno/bark")
@@ -0,0 +1,26 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical async computations: while one call for a key is in
+    flight, later callers with the same key await the same task instead of starting their own.
+    """
+    def __init__(self):
+        self._in_flight = {}
+        self.stats = {"started": 0, "coalesced": 0}
+
+    async def do(self, key, func):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats["started"] += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # shield: a caller that disconnects must not cancel the work other waiters share
+        return await asyncio.shield(task)
+
+
+generation_flights = SingleFlight()
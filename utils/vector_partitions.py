@@ -0,0 +1,151 @@
+import hashlib
+import threading
+from sources.config import settings
+from sources.database import SessionLocal
+from sources import models
+from utils.shared_models import chroma_cluster, chroma_collection, CHROMA_COLLECTION_NAME
+
+# Vectors live in one Chroma collection per owner ("owner"), per hashed owner shard ("shard"),
+# or in the single legacy collection ("none"). Owner filters are still applied inside a
+# partition, so shards shared by several owners stay isolated.
+PARTITION_PREFIX = CHROMA_COLLECTION_NAME
+
+_lock = threading.Lock()
+_collections = {}
+_document_owners = {}
+
+
+def generation_prefix(generation: int = 1) -> str:
+    """Collection name prefix of an index generation (utils/reindex builds generations 2, 3, ...)."""
+    return PARTITION_PREFIX if generation == 1 else f"{PARTITION_PREFIX}_g{generation}"
+
+
+def partition_name(owner_id: int, generation: int = 1) -> str:
+    prefix = generation_prefix(generation)
+    if settings.VECTOR_PARTITIONING == "owner":
+        return f"{prefix}_owner_{owner_id}"
+    if settings.VECTOR_PARTITIONING == "shard":
+        # Stable across processes (unlike hash()), so every worker routes an owner to the same shard
+        shard = int(hashlib.sha1(str(owner_id).encode("utf-8")).hexdigest(), 16) % settings.VECTOR_SHARDS
+        return f"{prefix}_shard_{shard:03d}"
+    return prefix
+
+
+def _collection(name: str):
+    with _lock:
+        collection = _collections.get(name)
+        if collection is None:
+            collection = chroma_cluster.collection(name)
+            _collections[name] = collection
+        return collection
+
+
+def forget_collection(name: str):
+    """Drops a cached handle (its collection was moved to another server or deleted)."""
+    with _lock:
+        _collections.pop(name, None)
+
+
+def collection_for_owner(owner_id: int, generation: int = 1):
+    return _collection(partition_name(owner_id, generation))
+
+
+def owner_of_document(doc_id: int) -> int:
+    """Owner of a document (looked up once; a document never changes owner)."""
+    owner_id = _document_owners.get(doc_id)
+    if owner_id is None:
+        db = SessionLocal()
+        try:
+            doc = db.query(models.Document).filter(models.Document.id == doc_id).first()
+            owner_id = doc.owner_id if doc else None
+        finally:
+            db.close()
+        if owner_id is not None:
+            _document_owners[doc_id] = owner_id
+    return owner_id
+
+
+def collection_for_document(doc_id: int):
+    owner_id = owner_of_document(doc_id)
+    return collection_for_owner(owner_id) if owner_id is not None else chroma_collection
+
+
+def collection_for_scope(owner_id: int = None, doc_id: int = None, generation: int = 1):
+    """The partition a doc- or owner-scoped query has to search."""
+    if doc_id is not None:
+        owner_id = owner_of_document(doc_id)
+    if owner_id is not None:
+        return collection_for_owner(owner_id, generation)
+    return chroma_collection if generation == 1 else _collection(generation_prefix(generation))
+
+
+def partition_collections(generation: int = 1) -> list:
+    """Every collection currently holding vectors of an index generation under the configured scheme."""
+    prefix = generation_prefix(generation)
+    if settings.VECTOR_PARTITIONING == "none":
+        return [_collection(prefix)] if generation != 1 else [chroma_collection]
+    names = [getattr(entry, "name", entry) for client in chroma_cluster.clients() for entry in client.list_collections()]
+    # Other generations share the prefix ("documents_g2_owner_1"), so match the partition kinds exactly
+    return [_collection(name) for name in sorted(names) if name.startswith((f"{prefix}_owner_", f"{prefix}_shard_"))]
+
+
+def drop_generation(generation: int):
+    """Deletes every collection of a retired index generation."""
+    for collection in partition_collections(generation):
+        chroma_cluster.client_for(collection.name).delete_collection(collection.name)
+        with _lock:
+            _collections.pop(collection.name, None)
+
+
+def migrate_legacy_collection(batch_size: int = 500, delete_source: bool = False):
+    """
+    Copies every chunk of the legacy single collection into its owner's partition (upsert, so
+    the migration can be re-run after an interruption). The source is only dropped on request.
+    """
+    if settings.VECTOR_PARTITIONING == "none":
+        print("VECTOR_PARTITIONING is 'none'; nothing to migrate.")
+        return
+
+    offset, migrated, skipped = 0, 0, 0
+    while True:
+        batch = chroma_collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        offset += len(batch["ids"])
+
+        groups = {}
+        for chunk_id, embedding, text, meta in zip(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]):
+            owner_id = meta.get("owner_id") if meta else None
+            if owner_id is None and meta and meta.get("doc_id") is not None:
+                owner_id = owner_of_document(meta["doc_id"])
+            if owner_id is None:
+                skipped += 1
+                continue
+            group = groups.setdefault(partition_name(owner_id), {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            group["ids"].append(chunk_id)
+            group["embeddings"].append(embedding)
+            group["documents"].append(text)
+            group["metadatas"].append({**meta, "owner_id": owner_id})
+
+        for name, group in groups.items():
+            _collection(name).upsert(**group)
+            migrated += len(group["ids"])
+        print(f"Migrated {migrated} chunks so far ({skipped} without an owner skipped)")
+
+    print(f"Migration done: {migrated} chunks copied into {len(partition_collections())} partition(s), {skipped} skipped.")
+    if delete_source and not skipped:
+        chroma_cluster.client_for(CHROMA_COLLECTION_NAME).delete_collection(CHROMA_COLLECTION_NAME)
+        print(f"Legacy collection '{CHROMA_COLLECTION_NAME}' deleted.")
+
+
+if settings.VECTOR_PARTITIONING != "none" and chroma_collection.count() > 0:
+    print(
+        f"WARNING: the legacy '{CHROMA_COLLECTION_NAME}' collection still holds vectors but partitioning is "
+        f"'{settings.VECTOR_PARTITIONING}'. Run `python -m utils.vector_partitions` to migrate them."
+    )
+
+
+if __name__ == "__main__":
+    # python -m utils.vector_partitions [--delete-source]  (moves the legacy collection into partitions)
+    import sys
+    migrate_legacy_collection(delete_source="--delete-source" in sys.argv)
@@ -0,0 +1,885 @@
+import os
+import json
+import shutil
+from contextlib import contextmanager
+import time
+import uuid
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import numpy as np
+from sources.config import settings
+from utils.clustering import kmeans
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: deletes are only serialized within one process
+    fcntl = None
+
+NUMPY_STORE_PATH = "./vector_store"
+# Which index generation serves reads, and the shadow generation a reindex is building (utils/reindex.py)
+INDEX_STATE_PATH = "./vector_index.json"
+# Owners with more vectors than this are searched through an IVF index instead of a full scan
+EXACT_SEARCH_MAX_VECTORS = 20000
+IVF_NPROBE = 8
+IVF_TRAINING_SAMPLE = 50000
+# New rows join the nearest existing IVF list; the centroids are retrained once an owner has grown this much
+IVF_RETRAIN_GROWTH = 2.0
+# Owner indexes kept loaded per process (least recently used ones are dropped)
+MAX_LOADED_OWNERS = 64
+STORAGE_MODES = ("float32", "float16", "int8")
+# Candidates re-scored with the full float32 vectors per requested result, for lossy indexes
+RESCORE_FACTOR = 4
+
+
+class VectorStore(ABC):
+    """
+    Storage for chunk vectors, partitioned by owner. Results use Chroma's shapes so retrieval code
+    works with any backend: query() -> {"ids": [[...]], "documents": [[...]], "metadatas": [[...]],
+    "distances": [[...]]}, get() -> {"ids": [...], <included fields>: [...]}.
+    """
+    @abstractmethod
+    def add(self, owner_id: int, ids: list, embeddings, documents: list, metadatas: list):
+        ...
+
+    @abstractmethod
+    def query(self, owner_id: int, query_embedding, n_results: int, where: dict = None) -> dict:
+        ...
+
+    def query_many(self, owner_id: int, query_embeddings: list, n_results: int, where: dict = None) -> dict:
+        """Several queries against one partition; row i of each result field answers query i."""
+        results = [self.query(owner_id, embedding, n_results, where) for embedding in query_embeddings]
+        return {field: [result[field][0] for result in results] for field in ("ids", "documents", "metadatas", "distances")}
+
+    @abstractmethod
+    def get(self, owner_id: int, ids: list = None, where: dict = None, include: list = ("documents", "metadatas"), limit: int = None, offset: int = 0) -> dict:
+        ...
+
+    @abstractmethod
+    def delete(self, owner_id: int, where: dict):
+        ...
+
+    @abstractmethod
+    def scan(self, include: list = ("documents", "metadatas"), batch_size: int = 500):
+        """Yields get()-shaped batches covering every stored chunk (for index rebuilds and migrations)."""
+        ...
+
+    @abstractmethod
+    def drop(self):
+        """Deletes everything this store holds (a retired index generation)."""
+        ...
+
+
+class ChromaVectorStore(VectorStore):
+    """The Chroma collections of utils/vector_partitions, for one index generation."""
+    def __init__(self, generation: int = 1):
+        self.generation = generation
+
+    def _collection(self, owner_id: int):
+        from utils.vector_partitions import collection_for_scope
+        return collection_for_scope(owner_id=owner_id, generation=self.generation)
+
+    def _call(self, owner_id: int, call):
+        """Runs call(collection); a handle whose collection a rebalance moved away is re-resolved once."""
+        from chromadb.errors import NotFoundError
+        from utils.vector_partitions import forget_collection
+        collection = self._collection(owner_id)
+        try:
+            return call(collection)
+        except NotFoundError:
+            forget_collection(collection.name)
+            return call(self._collection(owner_id))
+
+    def add(self, owner_id, ids, embeddings, documents, metadatas):
+        from utils.shared_models import chroma_cluster
+        embeddings = np.asarray(embeddings).tolist()
+
+        def add(collection):
+            # As few round trips as the server's batch limit allows
+            batch_size = chroma_cluster.max_batch_size(collection.name)
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                collection.add(ids=ids[start:end], embeddings=embeddings[start:end], documents=documents[start:end], metadatas=metadatas[start:end])
+        self._call(owner_id, add)
+
+    def query(self, owner_id, query_embedding, n_results, where=None):
+        return self.query_many(owner_id, [query_embedding], n_results, where)
+
+    def query_many(self, owner_id, query_embeddings, n_results, where=None):
+        # One request for all queries instead of one per query
+        return self._call(owner_id, lambda collection: collection.query(
+            query_embeddings=[np.asarray(embedding).tolist() for embedding in query_embeddings],
+            n_results=n_results,
+            where=where if where else None
+        ))
+
+    def get(self, owner_id, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        return self._call(owner_id, lambda collection: collection.get(ids=ids, where=where if where else None, include=list(include), limit=limit, offset=offset))
+
+    def delete(self, owner_id, where):
+        self._call(owner_id, lambda collection: collection.delete(where=where))
+
+    def scan(self, include=("documents", "metadatas"), batch_size=500):
+        from utils.vector_partitions import partition_collections
+        for collection in partition_collections(self.generation):
+            offset = 0
+            while True:
+                batch = collection.get(include=list(include), limit=batch_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                yield batch
+                offset += len(batch["ids"])
+
+    def drop(self):
+        from utils.vector_partitions import drop_generation
+        drop_generation(self.generation)
+
+
+def _matches(metadata: dict, where: dict) -> bool:
+    return all(metadata.get(key) == value for key, value in where.items())
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+
+def encode_vectors(vectors: np.ndarray, mode: str, dim: int = 0) -> tuple:
+    """
+    Normalized float32 vectors -> (codes, scales) for the search index: optionally truncated to
+    the first `dim` dimensions (re-normalized), then stored as float32, float16 or int8 with one
+    scale per vector (symmetric scalar quantization). scales is None unless mode is int8.
+    """
+    if dim and dim < vectors.shape[1]:
+        vectors = _normalize(vectors[:, :dim])
+    if mode == "int8":
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(np.float16 if mode == "float16" else np.float32), None
+
+
+def decode_vectors(codes: np.ndarray, scales: np.ndarray = None) -> np.ndarray:
+    vectors = codes.astype(np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+def _scan_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray, rows: np.ndarray = None, block: int = 16384) -> np.ndarray:
+    """Dot products against compact codes, upcasting one block at a time so the index itself stays small."""
+    count = len(codes) if rows is None else len(rows)
+    scores = np.empty(count, dtype=np.float32)
+    for start in range(0, count, block):
+        index = slice(start, start + block) if rows is None else rows[start:start + block]
+        part = codes[index].astype(np.float32, copy=False) @ query
+        scores[start:start + block] = part * scales[index] if scales is not None else part
+    return scores
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k)[:k]
+        return candidates[np.argsort(-scores[candidates])]
+    return np.argsort(-scores)
+
+
+def _assign(codes: np.ndarray, scales: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    """Nearest centroid of every row."""
+    return np.concatenate([
+        (decode_vectors(codes[start:start + block], scales[start:start + block] if scales is not None else None) @ centroids.T).argmax(axis=1)
+        for start in range(0, len(codes), block)
+    ]) if len(codes) else np.zeros(0, dtype=np.int64)
+
+
+class _IVFIndex:
+    """Inverted file index: k-means coarse centroids, each holding the rows assigned to it."""
+    def __init__(self, centroids: np.ndarray, lists: list, trained_size: int):
+        self.centroids = centroids
+        self.lists = lists
+        # Rows the centroids were trained on; the owner retrains once it has grown IVF_RETRAIN_GROWTH-fold
+        self.trained_size = trained_size
+
+    @classmethod
+    def train(cls, codes: np.ndarray, scales: np.ndarray = None, centroids: np.ndarray = None, trained_size: int = None) -> "_IVFIndex":
+        """Trains centroids on a sample (or reuses given ones) and assigns every row."""
+        if centroids is None:
+            n_lists = max(1, int(np.sqrt(len(codes))))
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(codes), min(len(codes), IVF_TRAINING_SAMPLE), replace=False)
+            centroids, _ = kmeans(decode_vectors(codes[sample], scales[sample] if scales is not None else None), n_lists, iterations=10)
+            trained_size = len(codes)
+        assignments = _assign(codes, scales, centroids)
+        return cls(centroids, [np.flatnonzero(assignments == i) for i in range(len(centroids))], trained_size)
+
+    def extended(self, codes: np.ndarray, scales: np.ndarray, start: int) -> "_IVFIndex":
+        """A copy with rows `start:` of codes added to their nearest lists, without retraining."""
+        assignments = _assign(codes[start:], scales[start:] if scales is not None else None, self.centroids)
+        lists = [np.concatenate([rows, start + np.flatnonzero(assignments == i)]) for i, rows in enumerate(self.lists)]
+        return _IVFIndex(self.centroids, lists, self.trained_size)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nearest = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.concatenate([self.lists[i] for i in nearest])
+
+
+class _ShardedArray:
+    """
+    Row-wise concatenation of per-shard arrays (the memory-mapped .npy codes) without copying
+    them into RAM: a slice or an array of rows gathers just those rows from the shards holding them.
+    """
+    def __init__(self, parts: list):
+        self.parts = parts
+        self.offsets = np.concatenate([[0], np.cumsum([len(part) for part in parts])]).astype(np.int64)
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self),) + (self.parts[0].shape[1:] if self.parts else (0,))
+
+    def __getitem__(self, index) -> np.ndarray:
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(len(self))
+            first = max(0, int(np.searchsorted(self.offsets, start, side="right")) - 1)
+            pieces = []
+            for shard in range(first, len(self.parts)):
+                if self.offsets[shard] >= stop:
+                    break
+                local_start, local_stop = max(start - self.offsets[shard], 0), min(stop, self.offsets[shard + 1]) - self.offsets[shard]
+                pieces.append(self.parts[shard][local_start:local_stop])
+            return np.concatenate(pieces) if len(pieces) != 1 else np.asarray(pieces[0])
+        rows = np.asarray(index, dtype=np.int64)
+        shard_of = np.searchsorted(self.offsets, rows, side="right") - 1
+        gathered = np.empty((len(rows),) + self.shape[1:], dtype=self.parts[0].dtype)
+        for shard in np.unique(shard_of):
+            positions = np.flatnonzero(shard_of == shard)
+            gathered[positions] = self.parts[shard][rows[positions] - self.offsets[shard]]
+        return gathered
+
+
+@contextmanager
+def _directory_lock(directory: str):
+    """Exclusive lock on an owner directory across processes (shard rewrites on delete)."""
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class _Shard:
+    """
+    Ids, metadata and record offsets of one shard. Texts stay in its .jsonl and are read by
+    offset when results are returned, so loading an owner never parses chunk texts.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.has_full = os.path.exists(f"{path}.f32")
+        if os.path.exists(f"{path}.idx"):
+            with open(f"{path}.idx", encoding="utf-8") as f:
+                header = json.load(f)
+            self.ids, self.metadatas, self.offsets = header["ids"], header["metadatas"], header["offsets"]
+            return
+        # Shards written before the .idx sidecar existed: one pass over their records
+        self.ids, self.metadatas, self.offsets = [], [], [0]
+        with open(f"{path}.jsonl", "rb") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.metadatas.append(record["metadata"])
+                self.offsets.append(self.offsets[-1] + len(line))
+
+    def documents(self, rows: list) -> list:
+        texts = []
+        with open(f"{self.path}.jsonl", "rb") as f:
+            for row in rows:
+                f.seek(self.offsets[row])
+                texts.append(json.loads(f.read(self.offsets[row + 1] - self.offsets[row]))["document"])
+        return texts
+
+    def full_vectors(self, rows: list) -> np.ndarray:
+        return np.asarray(np.load(f"{self.path}.f32", mmap_mode="r")[rows], dtype=np.float32)
+
+
+class _OwnerIndex:
+    """
+    One owner's shards as a compact search index (codes + int8 scales in the configured
+    mode/dimension) plus ids and metadata. The codes are searched straight from the memory-mapped
+    .npy files; texts and the full float32 vectors stay on disk and are only read for returned rows
+    and re-scored candidates. Shards written under other settings are converted on load (those
+    are held in RAM until rewritten). After an add only the new shards are loaded (see `previous`)
+    and the IVF lists are extended, so neither the codes nor the index are rebuilt per upload.
+    """
+    def __init__(self, directory: str, version, mode: str, dim: int, rescore: bool, previous: "_OwnerIndex" = None):
+        self.version = version
+        self.mode, self.dim = mode, dim
+        shard_names = sorted(name[:-len(".npy")] for name in os.listdir(directory) if name.endswith(".npy")) if os.path.isdir(directory) else []
+        # New shards sort last (time-ordered names); anything else (a delete rewrote shards) reloads everything
+        appended = (
+            previous is not None and (previous.mode, previous.dim) == (mode, dim)
+            and shard_names[:len(previous.shard_names)] == previous.shard_names
+        )
+        if appended:
+            self.shard_names, self.shards = list(previous.shard_names), list(previous.shards)
+            self.ids, self.metadatas = list(previous.ids), list(previous.metadatas)
+            self.row_of, self.rows_by_doc = dict(previous.row_of), dict(previous.rows_by_doc)
+            self._shard_offsets = list(previous._shard_offsets)
+            code_parts, scale_parts, self.count = list(previous.codes.parts), list(previous._scale_parts), previous.count
+        else:
+            self.shard_names, self.shards, self.ids, self.metadatas = [], [], [], []
+            self.row_of, self.rows_by_doc, self._shard_offsets = {}, {}, [0]
+            code_parts, scale_parts, self.count = [], [], 0
+        loaded_before = self.count
+        # rows_by_doc lists shared with `previous` are copied once before this load appends to them
+        copied = set()
+
+        for shard in shard_names[len(self.shard_names):]:
+            path = os.path.join(directory, shard)
+            codes = np.load(f"{path}.npy", mmap_mode="r")
+            scales = np.load(f"{path}.scales") if os.path.exists(f"{path}.scales") else None
+            record = _Shard(path)
+            codes, scales = self._conform(codes, scales, path if record.has_full else None)
+            code_parts.append(codes)
+            scale_parts.append(scales)
+            for row, (chunk_id, meta) in enumerate(zip(record.ids, record.metadatas), start=self.count):
+                self.row_of[chunk_id] = row
+                doc_id = meta.get("doc_id")
+                if doc_id not in copied:
+                    self.rows_by_doc[doc_id] = list(self.rows_by_doc.get(doc_id, ()))
+                    copied.add(doc_id)
+                self.rows_by_doc[doc_id].append(row)
+            self.ids.extend(record.ids)
+            self.metadatas.extend(record.metadatas)
+            self.count += len(codes)
+            self.shard_names.append(shard)
+            self.shards.append(record)
+            self._shard_offsets.append(self.count)
+
+        self.codes = _ShardedArray(code_parts)
+        self._scale_parts = scale_parts
+        self.scales = _ShardedArray(scale_parts) if mode == "int8" and scale_parts else None
+        # Re-scoring only helps when the index is lossy, and needs every shard's float32 vectors
+        lossy = mode != "float32" or bool(dim)
+        self.rescore = bool(rescore and lossy and self.shards and all(shard.has_full for shard in self.shards))
+
+        self._ivf, self._ivf_seed = None, None
+        # Concurrent queries of a large owner must not each train the IVF index
+        self._ivf_lock = threading.Lock()
+        if previous is not None and previous._ivf is not None:
+            if appended:
+                self._ivf = previous._ivf.extended(self.codes, self.scales, loaded_before) if self.count > loaded_before else previous._ivf
+            else:
+                # Reassigning rows to the existing centroids is much cheaper than retraining
+                self._ivf_seed = previous._ivf
+
+    def _conform(self, codes, scales, full_path: str) -> tuple:
+        expected_dtype = {"int8": np.int8, "float16": np.float16}.get(self.mode, np.float32)
+        full = np.load(f"{full_path}.f32", mmap_mode="r") if full_path else None
+        dim_ok = not self.dim or codes.shape[1] == min(self.dim, full.shape[1] if full is not None else codes.shape[1])
+        if codes.dtype == expected_dtype and dim_ok and (scales is not None) == (self.mode == "int8"):
+            return codes, scales
+        source = np.asarray(full, dtype=np.float32) if full is not None else _normalize(decode_vectors(np.asarray(codes), scales))
+        return encode_vectors(source, self.mode, self.dim)
+
+    def _by_shard(self, rows) -> list:
+        """[(shard, local rows, positions in `rows`)] for global rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        shard_of = np.searchsorted(self._shard_offsets, rows, side="right") - 1
+        groups = []
+        for shard in np.unique(shard_of):
+            positions = np.flatnonzero(shard_of == shard)
+            groups.append((self.shards[shard], (rows[positions] - self._shard_offsets[shard]).tolist(), positions))
+        return groups
+
+    def documents(self, rows) -> list:
+        texts = [None] * len(rows)
+        for shard, local, positions in self._by_shard(rows):
+            for position, text in zip(positions, shard.documents(local)):
+                texts[position] = text
+        return texts
+
+    def full_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """float32 vectors for `rows` (from the memory-mapped .f32 files, else decoded from the index)."""
+        if not self.shards or not all(shard.has_full for shard in self.shards):
+            return _normalize(decode_vectors(self.codes[rows], self.scales[rows] if self.scales is not None else None))
+        vectors = None
+        for shard, local, positions in self._by_shard(rows):
+            part = shard.full_vectors(local)
+            if vectors is None:
+                vectors = np.empty((len(rows), part.shape[1]), dtype=np.float32)
+            vectors[positions] = part
+        return vectors
+
+    def filter_rows(self, where: dict) -> np.ndarray:
+        if list(where) == ["doc_id"]:
+            return np.asarray(self.rows_by_doc.get(where["doc_id"], []), dtype=np.int64)
+        return np.asarray([row for row, meta in enumerate(self.metadatas) if _matches(meta, where)], dtype=np.int64)
+
+    def _needs_training(self) -> bool:
+        return self._ivf is None or self.count > self._ivf.trained_size * IVF_RETRAIN_GROWTH
+
+    def _ivf_index(self) -> _IVFIndex:
+        if self._needs_training():
+            with self._ivf_lock:
+                if self._needs_training():
+                    seed = self._ivf_seed if self._ivf is None else None
+                    self._ivf = _IVFIndex.train(self.codes, self.scales, *((seed.centroids, seed.trained_size) if seed else ()))
+                    self._ivf_seed = None
+        return self._ivf
+
+    def search(self, query: np.ndarray, n_results: int, where: dict = None) -> tuple:
+        if not self.ids:
+            return [], np.zeros(0, dtype=np.float32)
+        scan_query = _normalize(query[:self.codes.shape[1]])
+        if where:
+            rows = self.filter_rows(where)
+        elif len(self.ids) > EXACT_SEARCH_MAX_VECTORS:
+            rows = self._ivf_index().candidates(scan_query, IVF_NPROBE)
+        else:
+            rows = None
+
+        scores = _scan_scores(self.codes, self.scales, scan_query, rows)
+        top = _top(scores, n_results * RESCORE_FACTOR if self.rescore else n_results)
+        selected = top if rows is None else rows[top]
+        if not self.rescore:
+            return selected.tolist(), scores[top]
+
+        exact = self.full_vectors(selected) @ query
+        order = np.argsort(-exact)[:n_results]
+        return selected[order].tolist(), exact[order]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Dependency-light backend: per owner, append-only shards (one per add) of the search index
+    (`<shard>.npy`: float32/float16/int8 codes, optionally dimension-truncated, plus `<shard>.scales`
+    for int8), the full float32 vectors for re-scoring (`<shard>.f32`, when enabled), the ids,
+    texts and metadata (`<shard>.jsonl`) and the ids, metadata and record offsets (`<shard>.idx`).
+    Loading an owner reads codes, ids and metadata only; texts and float32 vectors are read from
+    disk for the rows a query returns. Small owners are scanned exactly, large ones through an IVF
+    index; lossy indexes re-score the top candidates in fp32.
+    Without the float32 copies, get(include embeddings) returns the (possibly truncated) index vectors.
+    """
+    def __init__(self, path: str = NUMPY_STORE_PATH, mode: str = "float16", dim: int = 0, rescore: bool = True):
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown VECTOR_STORAGE_MODE '{mode}' (expected one of {', '.join(STORAGE_MODES)})")
+        self.path = path
+        self.mode, self.dim, self.rescore = mode, dim, rescore
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        # Loads are serialized so concurrent queries after an add load the new shards once
+        self._load_lock = threading.Lock()
+        self._loaded = OrderedDict()
+
+    def _directory(self, owner_id: int) -> str:
+        return os.path.join(self.path, f"owner_{owner_id}" if owner_id is not None else "unscoped")
+
+    def _index(self, owner_id: int) -> _OwnerIndex:
+        directory = self._directory(owner_id)
+        # Adding or removing a shard changes the directory's mtime, which also catches other processes' writes
+        version = os.stat(directory).st_mtime_ns if os.path.isdir(directory) else None
+        with self._lock:
+            index = self._loaded.get(owner_id)
+            if index is not None and index.version == version:
+                self._loaded.move_to_end(owner_id)
+                return index
+        with self._load_lock:
+            with self._lock:
+                previous = self._loaded.get(owner_id)
+            if previous is not None and previous.version == version:
+                return previous
+            index = _OwnerIndex(directory, version, self.mode, self.dim, self.rescore, previous)
+            with self._lock:
+                self._loaded[owner_id] = index
+                self._loaded.move_to_end(owner_id)
+                while len(self._loaded) > MAX_LOADED_OWNERS:
+                    self._loaded.popitem(last=False)
+        return index
+
+    def _write_shard(self, directory: str, vectors: np.ndarray, records: list):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.time_ns()}_{uuid.uuid4().hex[:8]}")
+        codes, scales = encode_vectors(vectors, self.mode, self.dim)
+        lines = [json.dumps(record) + "\n" for record in records]
+        offsets = np.concatenate([[0], np.cumsum([len(line.encode("utf-8")) for line in lines])]).tolist()
+        header = {"ids": [record["id"] for record in records], "metadatas": [record["metadata"] for record in records], "offsets": offsets}
+        files = [(".jsonl", lines), (".idx", header)]
+        if scales is not None:
+            files.append((".scales", scales))
+        if self.rescore and (self.mode != "float32" or codes.shape[1] < vectors.shape[1]):
+            files.append((".f32", vectors.astype(np.float32)))
+        # Readers only pick up shards whose .npy exists, so it is written last
+        files.append((".npy", codes))
+
+        tmp = f"{path}.tmp"
+        for suffix, array in files:
+            if isinstance(array, list):
+                with open(tmp, "w", encoding="utf-8", newline="") as f:
+                    f.writelines(array)
+            elif isinstance(array, dict):
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(array, f)
+            else:
+                with open(tmp, "wb") as f:
+                    np.save(f, array)
+            os.replace(tmp, f"{path}{suffix}")
+
+    def add(self, owner_id, ids, embeddings, documents, metadatas):
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        records = [{"id": i, "document": d, "metadata": m} for i, d, m in zip(ids, documents, metadatas)]
+        self._write_shard(self._directory(owner_id), vectors, records)
+
+    def _read(self, owner_id: int, read):
+        """Runs read(index); a concurrent delete may have removed a shard it reads texts from, so it retries on a fresh load."""
+        try:
+            return read(self._index(owner_id))
+        except FileNotFoundError:
+            with self._lock:
+                self._loaded.pop(owner_id, None)
+            return read(self._index(owner_id))
+
+    def query(self, owner_id, query_embedding, n_results, where=None):
+        # Every row of an owner's directory belongs to that owner, so an owner filter is a no-op
+        where = {key: value for key, value in (where or {}).items() if not (key == "owner_id" and value == owner_id)}
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        def read(index):
+            rows, scores = index.search(query, n_results, where)
+            return {
+                "ids": [[index.ids[row] for row in rows]],
+                "documents": [index.documents(rows)],
+                "metadatas": [[index.metadatas[row] for row in rows]],
+                "distances": [[float(1.0 - score) for score in scores]],
+            }
+        return self._read(owner_id, read)
+
+    def get(self, owner_id, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        def read(index):
+            if ids is not None:
+                rows = [index.row_of[chunk_id] for chunk_id in ids if chunk_id in index.row_of]
+            else:
+                rows = index.filter_rows(where).tolist() if where else list(range(len(index.ids)))
+            rows = rows[offset:offset + limit] if limit is not None else rows[offset:]
+            result = {"ids": [index.ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = index.documents(rows)
+            if "metadatas" in include:
+                result["metadatas"] = [index.metadatas[row] for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = index.full_vectors(np.asarray(rows, dtype=np.int64)) if rows else np.zeros((0, 0), dtype=np.float32)
+            return result
+        return self._read(owner_id, read)
+
+    def delete(self, owner_id, where):
+        directory = self._directory(owner_id)
+        if not os.path.isdir(directory):
+            return
+        # Two deletes rewriting the same shard would each write its kept rows
+        with _directory_lock(directory):
+            self._delete_rows(directory, where)
+
+    def _delete_rows(self, directory: str, where: dict):
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(directory, name[:-len(".npy")])
+            with open(f"{path}.jsonl", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            keep = [row for row, record in enumerate(records) if not _matches(record["metadata"], where)]
+            if len(keep) == len(records):
+                continue
+            if keep:
+                if os.path.exists(f"{path}.f32"):
+                    vectors = np.load(f"{path}.f32")[keep]
+                else:
+                    scales = np.load(f"{path}.scales")[keep] if os.path.exists(f"{path}.scales") else None
+                    vectors = _normalize(decode_vectors(np.load(f"{path}.npy")[keep], scales))
+                self._write_shard(directory, vectors, [records[row] for row in keep])
+            # The .npy goes first so readers never see a shard with missing companions
+            for suffix in (".npy", ".scales", ".f32", ".idx", ".jsonl"):
+                if os.path.exists(f"{path}{suffix}"):
+                    os.remove(f"{path}{suffix}")
+
+    def scan(self, include=("documents", "metadatas"), batch_size=500):
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith("owner_"):
+                owner_id = int(name[len("owner_"):])
+            elif name == "unscoped":
+                owner_id = None
+            else:
+                continue
+            total = len(self._index(owner_id).ids)
+            for offset in range(0, total, batch_size):
+                yield self.get(owner_id, include=include, limit=batch_size, offset=offset)
+
+    def drop(self):
+        with self._lock:
+            self._loaded.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def create_vector_store(backend: str, generation: int = 1) -> VectorStore:
+    if backend == "chroma":
+        return ChromaVectorStore(generation)
+    if backend == "numpy":
+        path = NUMPY_STORE_PATH if generation == 1 else f"{NUMPY_STORE_PATH}_g{generation}"
+        return NumpyVectorStore(path, mode=settings.VECTOR_STORAGE_MODE, dim=settings.VECTOR_TRUNCATE_DIM, rescore=settings.VECTOR_RESCORE)
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND '{backend}' (expected chroma or numpy)")
+
+
+def index_spec() -> dict:
+    """What this process embeds and chunks with; a generation built under another spec is not dual-written."""
+    return {"embedding_model": settings.EMBEDDING_MODEL, "chunk_size": settings.CHUNK_SIZE, "chunk_overlap": settings.CHUNK_OVERLAP}
+
+
+def read_index_state(path: str = INDEX_STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        # Deployments that never reindexed serve generation 1, built with whatever spec they ran
+        return {"active": 1, "shadow": None, "previous": None, "specs": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_index_state(state: dict, path: str = INDEX_STATE_PATH):
+    # Replaced in one rename, so no process ever reads a half-written state
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+class GenerationalVectorStore(VectorStore):
+    """
+    Reads go to the active index generation. While utils/reindex builds a shadow generation,
+    deletes also go to the shadow, and so do adds when the shadow uses this process's embedding
+    model and chunking (otherwise the reindex catch-up pass indexes those documents). The state
+    file is re-read whenever it changes, so a switch reaches every process without a restart.
+    A process still running the previous generation's embedding model after a switch keeps
+    reading (and adding to) the previous generation until it is restarted with the new settings;
+    `python -m utils.reindex cleanup` indexes what those processes added into the active one.
+    """
+    def __init__(self, backend: str, state_path: str = INDEX_STATE_PATH):
+        self.backend = backend
+        self.state_path = state_path
+        self._stores = {}
+        self._state, self._state_version = None, None
+        self._lock = threading.Lock()
+
+    def store(self, generation: int) -> VectorStore:
+        with self._lock:
+            if generation not in self._stores:
+                self._stores[generation] = create_vector_store(self.backend, generation)
+            return self._stores[generation]
+
+    def state(self) -> dict:
+        version = os.stat(self.state_path).st_mtime_ns if os.path.exists(self.state_path) else None
+        if self._state is None or version != self._state_version:
+            state = read_index_state(self.state_path)
+            previous = self._state
+            self._state, self._state_version = state, version
+            if previous is not None and previous["active"] != state["active"]:
+                self._on_switch(state)
+        return self._state
+
+    def _on_switch(self, state: dict):
+        from utils import answer_cache
+        # Cached answers were grounded in the previous generation's chunks
+        answer_cache.clear()
+        generation = self._read_generation(state)
+        if generation == state["active"]:
+            print(f"Vector index generation {state['active']} is now active")
+        else:
+            print(
+                f"Vector index generation {state['active']} is now active, but it was embedded with "
+                f"'{state['specs'][str(state['active'])]['embedding_model']}'; this process keeps serving generation "
+                f"{generation} until it is restarted with EMBEDDING_MODEL set accordingly."
+            )
+
+    @staticmethod
+    def _read_generation(state: dict) -> int:
+        """The generation this process can query: the active one, unless it was embedded under another spec and the previous one matches."""
+        spec = index_spec()
+        active_spec = state["specs"].get(str(state["active"]))
+        previous = state.get("previous")
+        if active_spec in (None, spec) or previous is None or state["specs"].get(str(previous)) not in (None, spec):
+            return state["active"]
+        return previous
+
+    @property
+    def active(self) -> VectorStore:
+        return self.store(self._read_generation(self.state()))
+
+    def _write_targets(self, adding: bool) -> list:
+        state = self.state()
+        if not adding:
+            # Removing chunks is right in every generation, whatever it was embedded with
+            generations = [state["active"], state["shadow"], state.get("previous")]
+            return [self.store(generation) for generation in generations if generation is not None]
+        targets = [self.store(self._read_generation(state))]
+        shadow = state["shadow"]
+        if shadow is not None and state["specs"].get(str(shadow)) == index_spec():
+            targets.append(self.store(shadow))
+        return targets
+
+    def add(self, owner_id, ids, embeddings, documents, metadatas):
+        for store in self._write_targets(adding=True):
+            store.add(owner_id, ids, embeddings, documents, metadatas)
+
+    def query(self, owner_id, query_embedding, n_results, where=None):
+        return self.active.query(owner_id, query_embedding, n_results, where)
+
+    def query_many(self, owner_id, query_embeddings, n_results, where=None):
+        return self.active.query_many(owner_id, query_embeddings, n_results, where)
+
+    def get(self, owner_id, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        return self.active.get(owner_id, ids, where, include, limit, offset)
+
+    def delete(self, owner_id, where):
+        for store in self._write_targets(adding=False):
+            store.delete(owner_id, where)
+
+    def scan(self, include=("documents", "metadatas"), batch_size=500):
+        return self.active.scan(include, batch_size)
+
+    def drop(self):
+        """Drops every generation the state file knows of, and the state file itself."""
+        state = self.state()
+        for generation in {1, state["active"], state["shadow"], state["previous"]} - {None}:
+            self.store(generation).drop()
+        with self._lock:
+            self._stores.clear()
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self._state, self._state_version = None, None
+
+
+vector_store = GenerationalVectorStore(settings.VECTOR_STORE_BACKEND)
+
+
+def _chunk_texts(size: int, rng) -> list:
+    """Chunk-sized filler texts, so loads pay for realistic .jsonl sizes."""
+    words = ["".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), rng.integers(3, 10))) for _ in range(2000)]
+    pool = []
+    for _ in range(min(size, 256)):
+        text = " ".join(rng.choice(words, settings.CHUNK_SIZE // 6))
+        pool.append(text[:settings.CHUNK_SIZE])
+    return [pool[i % len(pool)] for i in range(size)]
+
+
+def _benchmark(sizes: list, dim: int = 1024, queries: int = 200, n_results: int = 8):
+    """
+    Load time, reload time after one more upload, query latency and recall@n (vs exact) of the
+    NumPy backend next to Chroma, on synthetic vectors with CHUNK_SIZE-long chunk texts.
+    """
+    import tempfile
+    import chromadb
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        probes = vectors[rng.choice(size, queries)] + 0.05 * rng.standard_normal((queries, dim)).astype(np.float32)
+        ids = [f"doc0_chunk{i}" for i in range(size)]
+        metadatas = [{"doc_id": 0, "owner_id": 1} for _ in range(size)]
+        documents = _chunk_texts(size, rng)
+        exact = [set(np.argsort(-(vectors @ probe))[:n_results]) for probe in probes]
+        upload = min(size, 50)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "numpy"))
+            for start in range(0, size - upload, 5000):
+                end = min(start + 5000, size - upload)
+                store.add(1, ids[start:end], vectors[start:end], documents[start:end], metadatas[start:end])
+            started = time.perf_counter()
+            store._index(1)
+            load_ms = (time.perf_counter() - started) * 1000
+            store.query(1, probes[0], n_results)  # builds the IVF index for large owners
+            # A typical upload, then the first query pays for picking it up (shard load + IVF extension)
+            store.add(1, ids[-upload:], vectors[-upload:], documents[-upload:], metadatas[-upload:])
+            started = time.perf_counter()
+            store.query(1, probes[0], n_results)
+            reload_ms = (time.perf_counter() - started) * 1000
+            numpy_latencies, numpy_recall = [], []
+            for probe, truth in zip(probes, exact):
+                started = time.perf_counter()
+                result = store.query(1, probe, n_results)
+                numpy_latencies.append((time.perf_counter() - started) * 1e6)
+                numpy_recall.append(len(truth & {int(i.rsplit("_chunk", 1)[1]) for i in result["ids"][0]}) / n_results)
+
+            collection = chromadb.PersistentClient(path=os.path.join(tmp, "chroma")).get_or_create_collection("benchmark")
+            for start in range(0, size, 5000):
+                collection.add(ids=ids[start:start + 5000], embeddings=vectors[start:start + 5000].tolist(), documents=documents[start:start + 5000], metadatas=metadatas[start:start + 5000])
+            chroma_latencies, chroma_recall = [], []
+            for probe, truth in zip(probes, exact):
+                started = time.perf_counter()
+                result = collection.query(query_embeddings=[probe.tolist()], n_results=n_results, where={"owner_id": 1})
+                chroma_latencies.append((time.perf_counter() - started) * 1e6)
+                chroma_recall.append(len(truth & {int(i.rsplit("_chunk", 1)[1]) for i in result["ids"][0]}) / n_results)
+
+        print(
+            f"{size:>8} vectors | numpy: load {load_ms:8.1f} ms, after upload {reload_ms:8.1f} ms, "
+            f"p50 {np.percentile(numpy_latencies, 50):9.0f} us, "
+            f"p95 {np.percentile(numpy_latencies, 95):9.0f} us, recall {np.mean(numpy_recall):.3f} | "
+            f"chroma: p50 {np.percentile(chroma_latencies, 50):9.0f} us, p95 {np.percentile(chroma_latencies, 95):9.0f} us, "
+            f"recall {np.mean(chroma_recall):.3f}"
+        )
+
+
+def precision_report(vectors: np.ndarray, queries: int = 200, n_results: int = 8, dims: tuple = (0, 768, 512, 256)):
+    """
+    Recall@n (vs exact float32 search) and bytes per vector of every storage mode x truncated
+    dimension, with and without float32 re-scoring, using sampled stored chunks as queries.
+    "index" is what stays in RAM; "disk" adds the float32 originals kept for re-scoring.
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    rng = np.random.default_rng(0)
+    probes = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+    # Each probe is itself stored, so it is excluded from its own results
+    truth = []
+    for probe in probes:
+        scores = vectors @ vectors[probe]
+        scores[probe] = -np.inf
+        truth.append(set(_top(scores, n_results).tolist()))
+
+    full_dim = vectors.shape[1]
+    print(f"{len(vectors)} vectors, {len(probes)} queries, recall@{n_results}")
+    print(f"{'mode':>8} {'dims':>5} {'index B/vec':>12} {'recall':>7} {'recall+rescore':>15} {'disk B/vec':>11}")
+    for mode in STORAGE_MODES:
+        for dim in dims:
+            dim = dim if dim and dim < full_dim else full_dim
+            codes, scales = encode_vectors(vectors, mode, dim)
+            index_bytes = codes.shape[1] * codes.itemsize + (4 if scales is not None else 0)
+            disk_bytes = index_bytes + (full_dim * 4 if mode != "float32" or dim < full_dim else 0)
+            recall, rescored = [], []
+            for probe, expected in zip(probes, truth):
+                scores = _scan_scores(codes, scales, _normalize(vectors[probe][:dim]))
+                scores[probe] = -np.inf
+                candidates = _top(scores, n_results * RESCORE_FACTOR)
+                recall.append(len(expected & set(candidates[:n_results].tolist())) / n_results)
+                exact = vectors[candidates] @ vectors[probe]
+                rescored.append(len(expected & set(candidates[np.argsort(-exact)[:n_results]].tolist())) / n_results)
+            print(
+                f"{mode:>8} {dim:>5} {index_bytes:>12} {np.mean(recall):>7.3f} {np.mean(rescored):>15.3f} "
+                f"{disk_bytes:>11}"
+            )
+
+
+if __name__ == "__main__":
+    # python -m utils.vector_store [sizes...]          (benchmark; defaults to typical per-owner library sizes)
+    # python -m utils.vector_store report [max_vectors] (recall vs memory of the storage modes on stored embeddings)
+    import sys
+    if sys.argv[1:2] == ["report"]:
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        sample = []
+        for batch in vector_store.scan(include=("embeddings",)):
+            sample.extend(np.asarray(batch["embeddings"], dtype=np.float32))
+            if len(sample) >= limit:
+                break
+        if len(sample) <= 8:
+            print("Not enough stored embeddings for a report.")
+        else:
+            precision_report(np.stack(sample[:limit]))
+    else:
+        _benchmark([int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000, 100000])